@@ -5,6 +5,10 @@ Configuration file for Celery
 
 from os import environ as env
 
+from kombu import Exchange, Queue
+
+from framework.tasks.variables import PROCESSING_QUEUES
+
 broker_url = None
 
 if not env.get('IN_CLOUD'):
@@ -18,3 +22,11 @@ result_backend = 'rpc://'
 task_serializer = 'json'
 result_serializer = 'json'
 accept_content = ['json']
+
+# Declaring every queue means a worker started without -Q consumes all of them, while
+# dedicated workers can be started with -Q to keep CPU and IO bound processing apart.
+task_default_queue = 'celery'
+task_queues = [
+    Queue(name, Exchange(name), routing_key=name)
+    for name in ['celery'] + sorted(set(PROCESSING_QUEUES.values()))
+]
@@ -22,6 +22,7 @@ from google.api_core.exceptions import NotFound
 
 from framework.celery.celery import APP
 from framework.tasks.authorized_task import AuthorizedTask
+from framework.tasks.eve_query import iter_items, iter_where
 from framework.tasks.variables import (
     AUTH0_DOMAIN,
     EVE_URL,
@@ -46,8 +47,8 @@ def get_user_trials(user_email: str, token: str) -> List[dict]:
         List[dict] -- List of trials user is a collaborator on.
     """
     collabs = {"collaborators": user_email}
-    query = "trials?where=%s" % json.dumps(collabs)
-    return EVE_FETCHER.get(token=token, endpoint=query).json()["_items"]
+    fields = ["collaborators", "trial_name"]
+    return list(iter_where(EVE_FETCHER, "trials", token, collabs, fields))
 
 
 def get_user_records(permissions: List[dict], token: str) -> List[str]:
@@ -90,7 +91,7 @@ def get_user_records(permissions: List[dict], token: str) -> List[str]:
 
     query = "data?where=%s" % json.dumps(conditions)
     try:
-        records = EVE_FETCHER.get(token=token, endpoint=query).json()["_items"]
+        records = iter_where(EVE_FETCHER, "data", token, conditions, ["gs_uri"])
         return [record["gs_uri"] for record in records]
     except RuntimeError as rte:
         log = "get_user_records failed with error %s. Query structure = %s" % (
@@ -290,10 +291,11 @@ def check_last_login() -> None:
     """
     Function that scans the user collection for inactive accounts and deletes any if found.
     """
-    # Get list of accounts and their last logins.
-    user_results = EVE_FETCHER.get(
-        token=check_last_login.token["access_token"], endpoint="last_access"
-    ).json()["_items"]
+    # Get list of accounts and their last logins. Read them all before changing any, so
+    # the pages don't shift underneath the scan.
+    user_results = list(
+        iter_items(EVE_FETCHER, "last_access", check_last_login.token["access_token"])
+    )
 
     # Define relevant time periods and get current time.
     year = timedelta(days=365)
@@ -399,9 +401,7 @@ def get_authorized_users(record_info: dict, token: str) -> List[str]:
             {"permissions": {"trial": trial, "assay": assay, "role": "write"}},
         ]
     }
-    authorized_users = EVE_FETCHER.get(
-        "accounts?where=%s" % json.dumps(query), token=token
-    ).json()["_items"]
+    authorized_users = iter_where(EVE_FETCHER, "accounts", token, query, ["email"])
     return [user["email"] for user in authorized_users]
 
 
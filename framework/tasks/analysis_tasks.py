@@ -7,14 +7,24 @@ __license__ = "MIT"
 
 import json
 import logging
+import os
 import re
-from typing import List, Tuple
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
 
 import requests
+from requests.adapters import HTTPAdapter
 from cidc_utils.requests import SmartFetch
-from framework.tasks.variables import EVE_URL
+from framework.tasks.eve_query import iter_where_in
+from framework.tasks.variables import (
+    EVE_URL,
+    RECORD_PATCH_CONCURRENCY,
+    RECORD_PATCH_CONFLICT_RETRIES,
+)
 
 EVE_FETCHER = SmartFetch(EVE_URL)
+# Keep-alive session of the process, by process id.
+SESSIONS = {}  # type: Dict[int, requests.Session]
 
 
 def create_input_json(sample_assay: dict, assay: dict) -> dict:
@@ -69,10 +79,90 @@ def create_input_json(sample_assay: dict, assay: dict) -> dict:
     return input_dictionary
 
 
-def set_record_processed(records: List[dict], condition: bool, token: str) -> bool:
+class RecordPatch(NamedTuple):
+    """
+    Outcome of patching one record.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    record_id: str
+    ok: bool
+    status: Optional[int]
+    etag: Optional[str]
+
+
+def pooled_session() -> requests.Session:
+    """
+    Returns this process's keep-alive session for the API, creating it if needed. Forked
+    processes don't reuse their parent's session.
+
+    Returns:
+        requests.Session -- Session pooling up to RECORD_PATCH_CONCURRENCY connections.
+    """
+    session = SESSIONS.get(os.getpid())
+    if session is None:
+        SESSIONS.clear()
+        session = SESSIONS[os.getpid()] = requests.Session()
+        adapter = HTTPAdapter(pool_maxsize=max(1, RECORD_PATCH_CONCURRENCY))
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+    return session
+
+
+def patch_record_processed(
+    session: requests.Session, record: dict, condition: bool, token: str
+) -> RecordPatch:
+    """
+    Sets the processed flag of one record. When the record changed since it was read, its
+    current ETag is fetched and the patch tried again.
+
+    Arguments:
+        session {requests.Session} -- Session to send the requests with.
+        record {dict} -- "data" collection record with _id and _etag.
+        condition {bool} -- True if processed else false.
+        token {str} -- JWT
+
+    Returns:
+        RecordPatch -- Outcome, with the record's new ETag if it was patched.
+    """
+    headers = {"Authorization": "Bearer {}".format(token)}
+    etag = record["_etag"]
+    status = None
+    for _ in range(RECORD_PATCH_CONFLICT_RETRIES + 1):
+        try:
+            patch_res = session.patch(
+                EVE_URL + "/data_edit/" + record["_id"],
+                json={"processed": condition},
+                headers=dict(headers, **{"If-Match": etag}),
+            )
+            status = patch_res.status_code
+            if status == 200:
+                new_etag = patch_res.json()["_etag"]
+                return RecordPatch(record["_id"], True, status, new_etag)
+            if status != 412:
+                break
+            current = session.get(
+                EVE_URL + "/data_edit/" + record["_id"], headers=headers
+            )
+            if current.status_code != 200:
+                break
+            etag = current.json()["_etag"]
+        except (requests.RequestException, ValueError, KeyError) as err:
+            log_message = "Patching record %s failed: %s" % (record["_id"], str(err))
+            logging.error({"message": log_message, "category": "ERROR-CELERY-PATCH"})
+            break
+    return RecordPatch(record["_id"], False, status, None)
+
+
+def set_record_processed(
+    records: List[dict], condition: bool, token: str
+) -> List[RecordPatch]:
     """
     Takes a list of records, then changes their
-    processed status to match the condition.
+    processed status to match the condition. Up to RECORD_PATCH_CONCURRENCY records are
+    patched at once, over one pooled session.
 
     Arguments:
         records {List[dict]} -- List of "data" collection records.
@@ -80,23 +170,44 @@ def set_record_processed(records: List[dict], condition: bool, token: str) -> bo
         token {str} -- JWT
 
     Returns:
-        bool -- True if all records were succesfully patched, else false.
+        List[RecordPatch] -- Outcome for each record, in order.
     """
-    patch_status = []
-    for record in records:
-        patch_res = requests.patch(
-            EVE_URL + "/data_edit/" + record["_id"],
-            json={"processed": condition},
-            headers={
-                "If-Match": record["_etag"],
-                "Authorization": "Bearer {}".format(
-                    token
-                ),
-            },
+    if not records:
+        return []
+    session = pooled_session()
+    workers = max(1, min(RECORD_PATCH_CONCURRENCY, len(records)))
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(patch_record_processed, session, record, condition, token)
+            for record in records
+        ]
+        outcomes = [future.result() for future in futures]
+
+    failed = [outcome.record_id for outcome in outcomes if not outcome.ok]
+    if failed:
+        log_message = "Could not set processed to %s for records: %s" % (
+            condition,
+            ", ".join(failed),
         )
-        patch_status.append(patch_res.status_code == 200)
+        logging.error({"message": log_message, "category": "ERROR-CELERY-PATCH"})
+    return outcomes
+
 
-    return all(patch_status)
+def patched_records(outcomes: List[RecordPatch]) -> List[dict]:
+    """
+    Records that were patched, with their new ETags, so the patch can be undone.
+
+    Arguments:
+        outcomes {List[RecordPatch]} -- Outcomes from set_record_processed.
+
+    Returns:
+        List[dict] -- Records with _id and _etag.
+    """
+    return [
+        {"_id": outcome.record_id, "_etag": outcome.etag}
+        for outcome in outcomes
+        if outcome.ok
+    ]
 
 
 def check_processed(records: List[dict], token: str) -> Tuple[List[dict], bool]:
@@ -111,11 +222,11 @@ def check_processed(records: List[dict], token: str) -> Tuple[List[dict], bool]:
         Tuple[List[dict], bool] -- Returns record ids and whether they are all processed or not.
     """
     record_ids = [x["_id"] for x in records]
-    query_expr = {"_id": {"$in": record_ids}}
-    response = EVE_FETCHER.get(
-        token=token,
-        endpoint="data?where=%s" % (json.dumps(query_expr)),
-    ).json()["_items"]
+    response = list(
+        iter_where_in(
+            EVE_FETCHER, "data", token, "_id", record_ids, fields=["processed"]
+        )
+    )
 
     # Check if all records are unprocessed.
     all_free = all(x["processed"] is False for x in response)
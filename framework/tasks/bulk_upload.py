@@ -0,0 +1,245 @@
+#!/usr/bin/env python
+"""
+Uploader for posting many documents to an Eve endpoint. Documents are sent in chunks sized
+by their serialized bytes, a few chunks at a time. The chunk size grows while the API
+answers quickly and halves when it slows down or rejects a chunk as too large, and chunks
+that fail with a server error are retried.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import json
+import logging
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from itertools import accumulate
+from typing import List, NamedTuple, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+
+class UploadTally(NamedTuple):
+    """
+    Outcome of an upload.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    total: int
+    uploaded: int
+    failed: int
+    requests: int
+    retries: int
+
+    @property
+    def complete(self) -> bool:
+        """
+        Whether every document was uploaded.
+
+        Returns:
+            bool -- True if nothing failed.
+        """
+        return self.uploaded == self.total
+
+
+class Chunk(NamedTuple):
+    """
+    Slice of the documents being uploaded.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    start: int
+    end: int
+    attempt: int
+
+
+class BulkUploader:
+    """
+    Posts lists of documents to one endpoint. The chunk byte budget follows additive
+    increase, multiplicative decrease: it grows by min_bytes after every response faster
+    than target_latency, and halves after a slow response, a 413 or a server error. A
+    413 also lowers max_bytes below the refused size.
+    """
+
+    def __init__(
+        self,
+        url: str,
+        token: str,
+        max_bytes: int = 1024 * 1024,
+        min_bytes: int = 16 * 1024,
+        max_in_flight: int = 4,
+        target_latency: float = 2.0,
+        max_retries: int = 3,
+        retry_delay: float = 1.0,
+        session: Optional[requests.Session] = None,
+    ):
+        """
+        Constructor.
+
+        Arguments:
+            url {str} -- Endpoint URL.
+            token {str} -- Access token.
+
+        Keyword Arguments:
+            max_bytes {int} -- Largest chunk, in bytes. (default: {1MB})
+            min_bytes {int} -- Smallest chunk budget, and the step it grows by.
+                (default: {16KB})
+            max_in_flight {int} -- Chunks being posted at once. (default: {4})
+            target_latency {float} -- Seconds a response may take before chunks shrink.
+                (default: {2.0})
+            max_retries {int} -- Retries of a chunk after server errors. (default: {3})
+            retry_delay {float} -- Seconds before the first retry, doubled for each one
+                after. (default: {1.0})
+            session {Optional[requests.Session]} -- Session to post with. (default: {a
+                new session pooling max_in_flight connections})
+        """
+        self.url = url
+        self.token = token
+        self.max_bytes = max_bytes
+        self.min_bytes = min(min_bytes, max_bytes)
+        self.max_in_flight = max(1, max_in_flight)
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.retry_delay = retry_delay
+        # Start in the middle and let the responses decide.
+        self.budget = max(self.min_bytes, max_bytes // 4)
+        if session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_maxsize=self.max_in_flight)
+            session.mount("http://", adapter)
+            session.mount("https://", adapter)
+        self.session = session
+
+    def _post(self, body: bytes, delay: float) -> Tuple[Optional[int], float, str]:
+        """
+        Posts one chunk, runs on the executor's threads.
+
+        Arguments:
+            body {bytes} -- JSON array of documents.
+            delay {float} -- Seconds to wait first.
+
+        Returns:
+            Tuple[Optional[int], float, str] -- Status code, None if the request failed,
+                seconds the request took, and the error.
+        """
+        if delay:
+            time.sleep(delay)
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                self.url,
+                data=body,
+                headers={
+                    "Authorization": "Bearer {}".format(self.token),
+                    "Content-Type": "application/json",
+                },
+            )
+            return response.status_code, time.monotonic() - started, response.text
+        except requests.RequestException as err:
+            return None, time.monotonic() - started, str(err)
+
+    def upload(self, documents: List[dict]) -> UploadTally:
+        """
+        Posts every document, waiting for all chunks to finish.
+
+        Arguments:
+            documents {List[dict]} -- Documents.
+
+        Returns:
+            UploadTally -- What was uploaded.
+        """
+        encoded = [json.dumps(document).encode("utf-8") for document in documents]
+        # Byte offsets, so the size of any slice is a subtraction. Each document also
+        # takes a separator.
+        offsets = [0] + list(accumulate(len(document) + 1 for document in encoded))
+        retries = deque()  # type: deque
+        cursor = 0
+        uploaded = failed = request_count = retry_count = 0
+
+        def fit(start: int, limit: int) -> int:
+            """
+            End of the longest slice from start that fits the budget, at least one long.
+            """
+            end = start + 1
+            while end < limit and offsets[end + 1] - offsets[start] <= self.budget:
+                end += 1
+            return end
+
+        def next_chunk() -> Optional[Chunk]:
+            """
+            Takes the next chunk to post, retries first.
+            """
+            nonlocal cursor
+            if retries:
+                chunk = retries.popleft()
+                end = fit(chunk.start, chunk.end)
+                if end < chunk.end:
+                    retries.appendleft(Chunk(end, chunk.end, chunk.attempt))
+                return Chunk(chunk.start, end, chunk.attempt)
+            if cursor < len(encoded):
+                start, cursor = cursor, fit(cursor, len(encoded))
+                return Chunk(start, cursor, 0)
+            return None
+
+        with ThreadPoolExecutor(max_workers=self.max_in_flight) as executor:
+            running = {}
+            while True:
+                while len(running) < self.max_in_flight:
+                    chunk = next_chunk()
+                    if chunk is None:
+                        break
+                    body = b"[" + b",".join(encoded[chunk.start : chunk.end]) + b"]"
+                    delay = 0.0
+                    if chunk.attempt:
+                        delay = self.retry_delay * 2 ** (chunk.attempt - 1)
+                    future = executor.submit(self._post, body, delay)
+                    running[future] = (chunk, len(body))
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    chunk, size = running.pop(future)
+                    status, latency, error = future.result()
+                    request_count += 1
+                    count = chunk.end - chunk.start
+
+                    if status is not None and 200 <= status < 300:
+                        uploaded += count
+                        if latency <= self.target_latency:
+                            self.budget = min(
+                                self.max_bytes, self.budget + self.min_bytes
+                            )
+                        else:
+                            self.budget = max(self.min_bytes, self.budget // 2)
+                    elif status == 413 and count > 1:
+                        # Don't grow back past what the server refused.
+                        self.max_bytes = max(
+                            self.min_bytes, min(self.max_bytes, size - 1)
+                        )
+                        self.budget = max(self.min_bytes, min(self.budget, size // 2))
+                        middle = chunk.start + count // 2
+                        retries.appendleft(Chunk(middle, chunk.end, chunk.attempt))
+                        retries.appendleft(Chunk(chunk.start, middle, chunk.attempt))
+                    elif (status is None or status >= 500) and (
+                        chunk.attempt < self.max_retries
+                    ):
+                        self.budget = max(self.min_bytes, self.budget // 2)
+                        retry_count += 1
+                        retries.append(Chunk(chunk.start, chunk.end, chunk.attempt + 1))
+                    else:
+                        failed += count
+                        logging.error(
+                            {
+                                "message": "Gave up on %s documents for %s: %s %s"
+                                % (count, self.url, status, error[:500]),
+                                "category": "ERROR-CELERY-UPLOAD",
+                            }
+                        )
+
+        return UploadTally(len(encoded), uploaded, failed, request_count, retry_count)
@@ -0,0 +1,240 @@
+#!/usr/bin/env python
+"""
+Buffers links between data records and the records processed from them, so that a parent's
+child list is updated once per window instead of once per processed file. Buffered links
+can be journaled to disk, so links a process did not save, because it was killed or the
+update failed, are replayed by the next worker process to start.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import atexit
+import fcntl
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, TextIO
+from uuid import uuid4
+
+from celery.signals import worker_process_init, worker_process_shutdown
+
+
+class ChildLinkAggregator:
+    """
+    Collects (parent, child) links and hands them to a flush function grouped by parent.
+    Links are flushed when the window since the first buffered link has passed, when the
+    buffer holds max_links links, or when the process shuts down.
+    """
+
+    def __init__(
+        self,
+        flush_parent: Callable[[str, List[dict]], bool],
+        window: float,
+        max_links: int,
+        journal_dir: Optional[str] = None,
+    ):
+        """
+        Constructor.
+
+        Arguments:
+            flush_parent {Callable[[str, List[dict]], bool]} -- Called with a parent id and
+                all of its buffered links, returns True if they were saved.
+            window {float} -- Seconds links are held before being flushed. With a window of
+                zero or less, links are flushed as soon as they are added.
+            max_links {int} -- Number of buffered links that triggers an early flush.
+
+        Keyword Arguments:
+            journal_dir {Optional[str]} -- Directory buffered and unsaved links are
+                journaled in. (default: {None, links are only held in memory})
+        """
+        self.flush_parent = flush_parent
+        self.window = window
+        self.max_links = max_links
+        self.journal_dir = journal_dir
+        self._pending = OrderedDict()  # type: Dict[str, List[dict]]
+        self._count = 0
+        self._lock = threading.Lock()
+        # Only one flush runs at a time, so a process never races itself on a parent's etag.
+        self._flush_lock = threading.Lock()
+        self._timer = None
+        self._journal = None  # type: Optional[TextIO]
+        self._journal_pid = None
+
+    def _journal_links(self, parent_id: str, links: List[dict]) -> None:
+        """
+        Writes links to this process' journal, opening one if needed. The journal stays
+        locked while it is open, which tells replay that its links are not abandoned.
+        Callers hold the lock.
+
+        Arguments:
+            parent_id {str} -- id of the parent record.
+            links {List[dict]} -- Child entries.
+        """
+        if not self.journal_dir:
+            return
+        # A journal opened before a fork belongs to the parent process.
+        if self._journal is None or self._journal_pid != os.getpid():
+            os.makedirs(self.journal_dir, exist_ok=True)
+            name = "%s-%s.jsonl" % (os.getpid(), uuid4())
+            self._journal = open(os.path.join(self.journal_dir, name), "a")
+            fcntl.flock(self._journal, fcntl.LOCK_EX)
+            self._journal_pid = os.getpid()
+        self._journal.write(json.dumps({"parent": parent_id, "links": links}) + "\n")
+        self._journal.flush()
+
+    def add(self, parent_id: str, links: List[dict]) -> None:
+        """
+        Buffers links to a parent.
+
+        Arguments:
+            parent_id {str} -- id of the parent record.
+            links {List[dict]} -- Child entries, {"_id": ..., "resource": ...}.
+        """
+        with self._lock:
+            self._journal_links(parent_id, links)
+            self._pending.setdefault(parent_id, []).extend(links)
+            self._count += len(links)
+            flush_now = self.window <= 0 or self._count >= self.max_links
+            if not flush_now and self._timer is None:
+                self._timer = threading.Timer(self.window, self.flush)
+                self._timer.daemon = True
+                self._timer.start()
+        if flush_now:
+            self.flush()
+
+    def flush(self) -> int:
+        """
+        Hands every buffered link to flush_parent, one call per parent. Links of a parent
+        whose call fails or raises are journaled for replay, or dropped without a journal.
+
+        Returns:
+            int -- Number of links saved.
+        """
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, OrderedDict()
+                self._count = 0
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+                journal = None
+                if self._journal_pid == os.getpid():
+                    journal, self._journal = self._journal, None
+
+            saved = 0
+            failed = OrderedDict()  # type: Dict[str, List[dict]]
+            for parent_id, links in pending.items():
+                try:
+                    linked = self.flush_parent(parent_id, links)
+                except Exception as error:  # pylint: disable=broad-except
+                    logging.error(
+                        {
+                            "message": "Error linking children of parent %s: %s"
+                            % (parent_id, str(error)),
+                            "category": "ERROR-CELERY-PATCH-FAIR",
+                        }
+                    )
+                    linked = False
+                if linked:
+                    saved += len(links)
+                else:
+                    failed[parent_id] = links
+                    logging.error(
+                        {
+                            "message": "%s %s child links of parent %s"
+                            % (
+                                "Kept for replay" if self.journal_dir else "Dropped",
+                                len(links),
+                                parent_id,
+                            ),
+                            "category": "ERROR-CELERY-PATCH-FAIR",
+                        }
+                    )
+
+            if failed and self.journal_dir:
+                self.write_unsaved(failed)
+            if journal is not None:
+                os.remove(journal.name)
+                journal.close()
+            return saved
+
+    def write_unsaved(self, links: Dict[str, List[dict]]) -> None:
+        """
+        Journals links that could not be saved in a file that is left unlocked, so that
+        the next replay picks them up.
+
+        Arguments:
+            links {Dict[str, List[dict]]} -- Child entries by parent id.
+        """
+        name = "%s-%s.jsonl" % (os.getpid(), uuid4())
+        temp_path = os.path.join(self.journal_dir, name + ".tmp")
+        with open(temp_path, "w") as unsaved:
+            for parent_id, parent_links in links.items():
+                line = json.dumps({"parent": parent_id, "links": parent_links})
+                unsaved.write(line + "\n")
+        os.replace(temp_path, os.path.join(self.journal_dir, name))
+
+    def replay(self) -> int:
+        """
+        Buffers the links of every journal that no running process holds, then deletes
+        the journal. They are journaled again by this process before the file goes away.
+
+        Returns:
+            int -- Number of links buffered.
+        """
+        if not self.journal_dir or not os.path.isdir(self.journal_dir):
+            return 0
+        replayed = 0
+        for name in sorted(os.listdir(self.journal_dir)):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            try:
+                journal = open(path)
+            except FileNotFoundError:
+                continue
+            with journal:
+                try:
+                    fcntl.flock(journal, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    continue
+                if not os.path.exists(path):
+                    # Replayed and removed by another process since it was opened.
+                    continue
+                for line in journal:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # The last line of a process killed mid write.
+                        continue
+                    self.add(entry["parent"], entry["links"])
+                    replayed += len(entry["links"])
+                os.remove(path)
+        if replayed:
+            logging.info(
+                {
+                    "message": "Replayed %s child links from %s"
+                    % (replayed, self.journal_dir),
+                    "category": "INFO-CELERY-PATCH-FAIR",
+                }
+            )
+        return replayed
+
+    def flush_on_shutdown(self) -> None:
+        """
+        Makes sure buffered links are flushed when a worker process or the interpreter exits,
+        and that journaled links left behind by other processes are replayed when a worker
+        process starts.
+        """
+
+        def flush_buffered(**kwargs) -> None:
+            self.flush()
+
+        def replay_journals(**kwargs) -> None:
+            self.replay()
+
+        worker_process_shutdown.connect(flush_buffered, weak=False)
+        worker_process_init.connect(replay_journals, weak=False)
+        atexit.register(self.flush)
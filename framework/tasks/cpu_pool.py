@@ -0,0 +1,248 @@
+#!/usr/bin/env python
+"""
+Pool of processes that CPU bound processors run in, so a worker keeps its own process free
+for network IO and a processor stuck on a pathological file can be killed without taking the
+worker down with it.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import atexit
+import importlib
+import logging
+import os
+import pickle
+import signal
+import threading
+import time
+from io import BytesIO
+from typing import BinaryIO, Callable, List, Optional, Tuple
+
+from billiard import Pool
+from billiard.exceptions import WorkerLostError
+from celery.signals import worker_process_shutdown
+
+from framework.tasks.data_classes import RecordContext
+
+# Seconds between checks on a running file's pool process.
+POLL_INTERVAL = 0.5
+
+
+def warm_imports(modules: List[str]) -> None:
+    """
+    Pool initializer, imports the modules processors need before the first file arrives.
+
+    Arguments:
+        modules {List[str]} -- Dotted module names.
+    """
+    for module in modules:
+        importlib.import_module(module)
+
+
+def pool_source(source: BinaryIO) -> Tuple[str, object]:
+    """
+    Describes a downloaded file in a form that can be sent to another process. Files held in
+    memory are sent as bytes, files on disk by path.
+
+    Arguments:
+        source {BinaryIO} -- Open binary file.
+
+    Raises:
+        ValueError -- If the file is neither in memory nor on disk.
+
+    Returns:
+        Tuple[str, object] -- "bytes" and the contents, or "path" and the file path.
+    """
+    if isinstance(source, BytesIO):
+        return "bytes", source.getvalue()
+    name = getattr(source, "name", None)
+    if isinstance(name, str) and os.path.isfile(name):
+        return "path", name
+    raise ValueError("Can not hand %r to another process" % source)
+
+
+def run_in_child(
+    func: Callable, kind: str, payload: object, context: RecordContext
+) -> object:
+    """
+    Runs a processor inside a pool process, on a file object rebuilt from pool_source.
+    Files on disk are reopened rather than handed over by path, so processors that rename
+    or remove the paths they are given can not touch the original.
+
+    Arguments:
+        func {Callable} -- Processor function, must be importable by name.
+        kind {str} -- "bytes" or "path".
+        payload {object} -- File contents or path.
+        context {RecordContext} -- Processor context.
+
+    Returns:
+        object -- Whatever the processor returns.
+    """
+    if kind == "bytes":
+        return func(BytesIO(payload), context)
+    with open(payload, "rb") as source:
+        return func(source, context)
+
+
+def process_alive(pid: int) -> bool:
+    """
+    Checks whether a process still exists.
+
+    Arguments:
+        pid {int} -- Process id.
+
+    Returns:
+        bool -- False once the process has exited and been reaped.
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def kill_process(pid: int) -> None:
+    """
+    Kills a process, ignoring processes that already exited.
+
+    Arguments:
+        pid {int} -- Process id.
+    """
+    try:
+        os.kill(pid, signal.SIGKILL)
+    except ProcessLookupError:
+        pass
+
+
+class CpuPool:
+    """
+    Lazily started billiard pool. Pool processes are recycled after max_tasks files, and the
+    process working on a file that takes longer than timeout seconds is killed and replaced.
+    A pool started before a fork is not reused by the child, which starts its own.
+    """
+
+    def __init__(
+        self, processes: int, max_tasks: int, timeout: float, modules: List[str]
+    ):
+        """
+        Constructor.
+
+        Arguments:
+            processes {int} -- Number of pool processes, 0 runs processors inline.
+            max_tasks {int} -- Files a pool process handles before it is replaced.
+            timeout {float} -- Seconds a file may take.
+            modules {List[str]} -- Modules imported by each pool process when it starts.
+        """
+        self.processes = processes
+        self.max_tasks = max_tasks
+        self.timeout = timeout
+        self.modules = modules
+        self._pool = None  # type: Optional[Pool]
+        self._pid = None  # type: Optional[int]
+        self._lock = threading.Lock()
+
+    def _get_pool(self) -> Pool:
+        """
+        Returns the running pool, starting one if needed.
+
+        Returns:
+            Pool -- The pool.
+        """
+        with self._lock:
+            if self._pool is None or self._pid != os.getpid():
+                self._pool = Pool(
+                    self.processes,
+                    initializer=warm_imports,
+                    initargs=(self.modules,),
+                    maxtasksperchild=self.max_tasks,
+                )
+                self._pid = os.getpid()
+            return self._pool
+
+    def run(self, func: Callable, source: BinaryIO, context: RecordContext) -> object:
+        """
+        Runs a processor on a downloaded file in the pool, or inline if the pool is disabled.
+        The processor's return value must be picklable.
+
+        Arguments:
+            func {Callable} -- Processor function.
+            source {BinaryIO} -- Downloaded file.
+            context {RecordContext} -- Processor context.
+
+        Raises:
+            TypeError -- If the processor or context can not be sent to the pool.
+            TimeoutError -- If the processor ran past the timeout.
+            ChildProcessError -- If the pool process died while processing the file.
+
+        Returns:
+            object -- Whatever the processor returns.
+        """
+        if self.processes <= 0:
+            return func(source, context)
+
+        # The pool pickles jobs on a background thread and a failure there never reaches
+        # the result, so check up front rather than wait out the timeout.
+        try:
+            pickle.dumps((func, context))
+        except (pickle.PicklingError, AttributeError, TypeError) as err:
+            raise TypeError(
+                "%s can not be sent to the processing pool: %s" % (func, str(err))
+            )
+
+        kind, payload = pool_source(source)
+        result = self._get_pool().apply_async(run_in_child, (func, kind, payload, context))
+        deadline = time.monotonic() + self.timeout
+        while True:
+            result.wait(max(0, min(POLL_INTERVAL, deadline - time.monotonic())))
+            if result.ready():
+                try:
+                    return result.get()
+                except WorkerLostError as err:
+                    raise ChildProcessError(
+                        "Pool process died while running %s: %s"
+                        % (func.__name__, str(err))
+                    )
+
+            pids = result.worker_pids()
+            if any(not process_alive(pid) for pid in pids):
+                raise ChildProcessError(
+                    "Pool process died while running %s" % func.__name__
+                )
+
+            if time.monotonic() >= deadline:
+                logging.error(
+                    {
+                        "message": "%s ran for more than %s seconds, killing pool process %s"
+                        % (func.__name__, self.timeout, ", ".join(map(str, pids))),
+                        "category": "ERROR-CELERY-PROCESSING",
+                    }
+                )
+                # The pool replaces the killed process with a fresh one.
+                for pid in pids:
+                    kill_process(pid)
+                raise TimeoutError(
+                    "%s ran for more than %s seconds" % (func.__name__, self.timeout)
+                )
+
+    def close(self) -> None:
+        """
+        Lets the pool processes finish their files, then stops them.
+        """
+        with self._lock:
+            pool, self._pool = self._pool, None
+            if pool is not None and self._pid == os.getpid():
+                pool.close()
+                pool.join()
+
+    def close_on_shutdown(self) -> None:
+        """
+        Makes sure the pool is stopped when a worker process or the interpreter exits.
+        """
+
+        def close_pool(**kwargs) -> None:
+            self.close()
+
+        worker_process_shutdown.connect(close_pool, weak=False)
+        atexit.register(self.close)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python
+"""
+Queries that read every page of an Eve collection. Pages are followed through their
+_links.next, the next page is fetched while the caller works through the current one, and
+long $in filters are split into several queries so URLs stay short. Callers name the
+fields they use, and only those are sent back.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import json
+from concurrent.futures import ThreadPoolExecutor
+from typing import Generator, List, Optional, Tuple
+from urllib.parse import quote
+
+from cidc_utils.requests import SmartFetch
+
+# Longest URL encoded where clause sent by iter_where_in.
+MAX_WHERE_LENGTH = 4000
+
+
+def fetch_page(
+    fetcher: SmartFetch, endpoint: str, token: str
+) -> Tuple[List[dict], Optional[str]]:
+    """
+    Fetches one page of results.
+
+    Arguments:
+        fetcher {SmartFetch} -- API client.
+        endpoint {str} -- Resource and query string.
+        token {str} -- JWT
+
+    Returns:
+        Tuple[List[dict], Optional[str]] -- Items, and the endpoint of the next page, None
+            on the last page.
+    """
+    page = fetcher.get(endpoint=endpoint, token=token).json()
+    next_page = page.get("_links", {}).get("next", {}).get("href")
+    return page.get("_items", []), next_page.lstrip("/") if next_page else None
+
+
+def iter_items(
+    fetcher: SmartFetch, endpoint: str, token: str, prefetch: bool = True
+) -> Generator[dict, None, None]:
+    """
+    Yields the items of every page of a query, holding at most two pages at a time.
+
+    Arguments:
+        fetcher {SmartFetch} -- API client.
+        endpoint {str} -- Resource and query string.
+        token {str} -- JWT
+
+    Keyword Arguments:
+        prefetch {bool} -- Fetch the next page in the background while the current one is
+            consumed. (default: {True})
+
+    Raises:
+        RuntimeError -- If a request fails, when the iteration reaches it.
+
+    Returns:
+        Generator[dict, None, None] -- Items, in the order the API returns them.
+    """
+    items, next_page = fetch_page(fetcher, endpoint, token)
+    executor = ThreadPoolExecutor(max_workers=1) if prefetch else None
+    try:
+        while True:
+            upcoming = None
+            if next_page and executor:
+                upcoming = executor.submit(fetch_page, fetcher, next_page, token)
+            yield from items
+            if not next_page:
+                return
+            if upcoming:
+                items, next_page = upcoming.result()
+            else:
+                items, next_page = fetch_page(fetcher, next_page, token)
+    finally:
+        if executor:
+            executor.shutdown(wait=False)
+
+
+def chunk_values(
+    where: dict, field: str, values: List[object], max_length: int = MAX_WHERE_LENGTH
+) -> Generator[List[object], None, None]:
+    """
+    Splits values into lists that keep the URL encoded where clause with a $in on them
+    within max_length. Every list holds at least one value.
+
+    Arguments:
+        where {dict} -- Other conditions of the where clause.
+        field {str} -- Field the $in applies to.
+        values {List[object]} -- JSON serializable values.
+
+    Keyword Arguments:
+        max_length {int} -- Longest encoded clause. (default: {MAX_WHERE_LENGTH})
+
+    Returns:
+        Generator[List[object], None, None] -- Lists of values, in order.
+    """
+    base = len(quote(json.dumps(dict(where, **{field: {"$in": []}}))))
+    separator = len(quote(", "))
+    chunk = []  # type: List[object]
+    length = base
+    for value in values:
+        size = len(quote(json.dumps(value))) + (separator if chunk else 0)
+        if chunk and length + size > max_length:
+            yield chunk
+            chunk, length = [], base
+            size = len(quote(json.dumps(value)))
+        chunk.append(value)
+        length += size
+    if chunk:
+        yield chunk
+
+
+def query_endpoint(
+    resource: str, where: dict, fields: Optional[List[str]] = None
+) -> str:
+    """
+    Builds the endpoint of a query.
+
+    Arguments:
+        resource {str} -- Resource name.
+        where {dict} -- Mongo style where clause.
+
+    Keyword Arguments:
+        fields {Optional[List[str]]} -- Fields to return, besides _id and _etag which Eve
+            always returns. (default: {None, every field})
+
+    Returns:
+        str -- Resource and query string.
+    """
+    endpoint = "%s?where=%s" % (resource, json.dumps(where))
+    if fields:
+        endpoint += "&projection=%s" % json.dumps({field: 1 for field in fields})
+    return endpoint
+
+
+def iter_where(
+    fetcher: SmartFetch,
+    resource: str,
+    token: str,
+    where: dict,
+    fields: Optional[List[str]] = None,
+    prefetch: bool = True,
+) -> Generator[dict, None, None]:
+    """
+    Yields every item of a resource matching a where clause.
+
+    Arguments:
+        fetcher {SmartFetch} -- API client.
+        resource {str} -- Resource name.
+        token {str} -- JWT
+        where {dict} -- Mongo style where clause.
+
+    Keyword Arguments:
+        fields {Optional[List[str]]} -- Fields to return. (default: {None, every field})
+        prefetch {bool} -- Fetch pages ahead. (default: {True})
+
+    Returns:
+        Generator[dict, None, None] -- Items.
+    """
+    endpoint = query_endpoint(resource, where, fields)
+    yield from iter_items(fetcher, endpoint, token, prefetch)
+
+
+def iter_where_in(
+    fetcher: SmartFetch,
+    resource: str,
+    token: str,
+    field: str,
+    values: List[object],
+    where: Optional[dict] = None,
+    fields: Optional[List[str]] = None,
+    prefetch: bool = True,
+    max_length: int = MAX_WHERE_LENGTH,
+) -> Generator[dict, None, None]:
+    """
+    Yields every item of a resource whose field is one of the values, in as many queries as
+    it takes to keep their URLs short. Repeated values are only asked for once.
+
+    Arguments:
+        fetcher {SmartFetch} -- API client.
+        resource {str} -- Resource name.
+        token {str} -- JWT
+        field {str} -- Field to match.
+        values {List[object]} -- Hashable, JSON serializable values.
+
+    Keyword Arguments:
+        where {Optional[dict]} -- Other conditions. (default: {None})
+        fields {Optional[List[str]]} -- Fields to return. (default: {None, every field})
+        prefetch {bool} -- Fetch pages ahead. (default: {True})
+        max_length {int} -- Longest encoded where clause. (default: {MAX_WHERE_LENGTH})
+
+    Returns:
+        Generator[dict, None, None] -- Items.
+    """
+    where = where or {}
+    unique = list(dict.fromkeys(values))
+    for chunk in chunk_values(where, field, unique, max_length):
+        chunk_where = dict(where, **{field: {"$in": chunk}})
+        yield from iter_where(fetcher, resource, token, chunk_where, fields, prefetch)
@@ -7,21 +7,45 @@ __license__ = "MIT"
 
 import logging
 import json
-from ftplib import FTP
-import gzip
-from io import BytesIO
-from typing import List
+import zlib
+from ftplib import FTP, error_perm, error_reply
+from os import makedirs, path, remove
+from typing import Generator, Iterable, List, NamedTuple, Optional, Set, Union
 from cidc_utils.requests import SmartFetch
 from framework.celery.celery import APP
 from framework.tasks.authorized_task import AuthorizedTask
-from framework.tasks.variables import EVE_URL
-from framework.tasks.parallelize_tasks import execute_in_parallel
+from framework.tasks.bulk_upload import BulkUploader
+from framework.tasks.eve_query import iter_where_in
+from framework.tasks.variables import (
+    BULK_UPLOAD_IN_FLIGHT,
+    BULK_UPLOAD_MAX_BYTES,
+    EVE_URL,
+    HUGO_CACHE_DIR,
+    HUGO_MAX_STALE_SYMBOLS,
+    SYMBOL_BATCH_WINDOW,
+    SYMBOL_CACHE_MAX,
+    SYMBOL_CACHE_TTL,
+    SYMBOL_INDEX_DIR,
+)
+from framework.tasks.symbol_index import (
+    SNAPSHOT_FILE,
+    SymbolIndex,
+    SymbolIndexLoader,
+    load_snapshot,
+    remove_snapshot,
+    save_snapshot,
+)
+from framework.tasks.symbol_validation import SymbolBatcher
 
 
 HUGO_URL = "ftp.ncbi.nlm.nih.gov"
 HUGO_DIRECTORY = "gene/DATA/GENE_INFO/Mammalia"
 HUGO_FILE_NAME = "Homo_sapiens.gene_info.gz"
+# zlib window bits that make it expect a gzip header and trailer.
+GZIP_WBITS = 16 + zlib.MAX_WBITS
+FTP_BLOCK_SIZE = 64 * 1024
 EVE = SmartFetch(EVE_URL)
+SYMBOL_INDEX = SymbolIndexLoader(SYMBOL_INDEX_DIR)
 IDENTIFIER_FIELDS = [
     {"key": 2, "is_array": False},  # Symbol
     {"key": 4, "is_array": True},  # Synonyms
@@ -59,64 +83,219 @@ def mk_error(
     }
 
 
-@APP.task(base=AuthorizedTask)
-def chunked_upload(symbols: List[dict]):
+class RemoteFile(NamedTuple):
     """
-    Posts to the gene_symbols endpoint, declared here as a task for execution purposes.
+    Size and modification time of a file on an FTP server.
 
     Arguments:
-        symbols {List[dict]} -- List of gene symbols.
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
     """
-    EVE.post(
-        endpoint="gene_symbols",
-        token=chunked_upload.token["access_token"],
-        code=201,
-        json=symbols,
-    )
+
+    name: str
+    size: Optional[int]
+    modified: Optional[str]
 
 
 @APP.task(base=AuthorizedTask)
 def refresh_hugo_defs():
     """
-    Periodic task meant to keep the hugo definitions up to date.
+    Periodic task meant to keep the hugo definitions up to date. The refresh is skipped when
+    the remote file has the same size and modification time as on the last successful run.
+    Only symbols added since the last refresh are posted. The collection is rebuilt from
+    scratch when there is no snapshot of what was published, or too many removed symbols
+    have built up in it.
+    """
+    info_path = path.join(HUGO_CACHE_DIR, "%s.json" % HUGO_FILE_NAME)
+    part_path = path.join(HUGO_CACHE_DIR, "%s.part" % HUGO_FILE_NAME)
+    ftp = FTP(HUGO_URL)
+    try:
+        ftp.login()
+        ftp.cwd(HUGO_DIRECTORY)
+        remote = remote_file_info(ftp, HUGO_FILE_NAME)
+        if remote.size is not None and remote.modified is not None:
+            if remote == load_file_info(info_path):
+                message = "%s is unchanged since %s, skipping the refresh" % (
+                    HUGO_FILE_NAME,
+                    remote.modified,
+                )
+                logging.info({"message": message, "category": "INFO-CELERY-HUGO"})
+                return
+        blocks = iter_cached_ftp_blocks(ftp, remote, part_path)
+        symbols = set(iter_gene_symbols(decompress_lines(blocks)))
+    finally:
+        ftp.close()
+
+    if update_gene_symbols(symbols, refresh_hugo_defs.token["access_token"]):
+        try:
+            save_file_info(info_path, remote)
+            remove_file(part_path)
+            remove_file("%s.json" % part_path)
+        except OSError as err:
+            error = "Error caching the HUGO download's metadata: %s" % str(err)
+            logging.error({"message": error, "category": "ERROR-CELERY-HUGO"})
+
+
+def update_gene_symbols(symbols: Set[str], token: str) -> bool:
+    """
+    Publishes a new set of symbols to the local index and the API.
+
+    Arguments:
+        symbols {Set[str]} -- Every valid symbol and synonym.
+        token {str} -- Access token.
+
+    Returns:
+        bool -- True if both are up to date.
     """
-    hugo_string = get_gz_ftp(HUGO_URL, HUGO_DIRECTORY, HUGO_FILE_NAME)
-    hugo_entries = build_gene_collection(hugo_string)
-    tasks = []
+    if not symbols:
+        error = "The HUGO download had no gene symbols, keeping the current ones"
+        logging.error({"message": error, "category": "ERROR-CELERY-HUGO"})
+        return False
+    publish_symbol_index(symbols)
+    snapshot_path = path.join(SYMBOL_INDEX_DIR, SNAPSHOT_FILE)
+    published = load_snapshot(snapshot_path)
     try:
-        # Quickly get a record
-        existing = EVE.get(
-            endpoint="gene_symbols", token=refresh_hugo_defs.token["access_token"]
-        ).json()["_items"][0]
-        _id = existing["_id"]
-        _etag = existing["_etag"]
-
-        # Delete it. There is a hook in the API that responds to any completed deletion of a
-        # of a record by dropping the whole collection. This is by far the easiest way to
-        # update the collection, 
+        if published is None:
+            message = "No gene symbol snapshot, rebuilding the collection"
+            added = symbols
+        else:
+            added = symbols - published
+            stale = published - symbols
+            message = "Added %s gene symbols, %s removed symbols left in place" % (
+                len(added),
+                len(stale),
+            )
+            if len(stale) > HUGO_MAX_STALE_SYMBOLS:
+                message = "%s gene symbols were removed, rebuilding the collection" % (
+                    len(stale)
+                )
+                published = None
+                added = symbols
+
+        if added:
+            # What the collection holds is unknown until the writes succeed, a failure
+            # leaves no snapshot and the next refresh rebuilds.
+            remove_snapshot(snapshot_path)
+            if published is None:
+                rebuild_gene_collection(symbols, token)
+                published = symbols
+            else:
+                post_symbols(added, token)
+                published = published | added
+            save_snapshot(snapshot_path, published)
+        logging.info({"message": message, "category": "INFO-CELERY-HUGO"})
+        return True
+    except RuntimeError as run:
+        error = "Error adding hugo symbols to DB: %s" % str(run)
+        logging.error({"message": error, "category": "ERROR-CELERY-HUGO"})
+    except OSError as err:
+        error = "Error writing the gene symbol snapshot: %s" % str(err)
+        logging.error({"message": error, "category": "ERROR-CELERY-HUGO"})
+    return False
+
+
+def post_symbols(symbols: Iterable[str], token: str) -> None:
+    """
+    Posts symbols to the gene_symbols endpoint with a BulkUploader.
+
+    Arguments:
+        symbols {Iterable[str]} -- Symbols to add.
+        token {str} -- Access token.
+
+    Raises:
+        RuntimeError -- If any symbol could not be posted.
+    """
+    uploader = BulkUploader(
+        EVE_URL + "/gene_symbols",
+        token,
+        max_bytes=BULK_UPLOAD_MAX_BYTES,
+        max_in_flight=BULK_UPLOAD_IN_FLIGHT,
+    )
+    tally = uploader.upload([{"symbol": symbol} for symbol in sorted(symbols)])
+    message = "Posted %s of %s gene symbols in %s requests, %s of them retries" % (
+        tally.uploaded,
+        tally.total,
+        tally.requests,
+        tally.retries,
+    )
+    if not tally.complete:
+        raise RuntimeError(message)
+    logging.info({"message": message, "category": "INFO-CELERY-HUGO"})
+
+
+def rebuild_gene_collection(symbols: Iterable[str], token: str) -> None:
+    """
+    Replaces the whole gene_symbols collection.
+
+    Arguments:
+        symbols {Iterable[str]} -- Every valid symbol and synonym.
+        token {str} -- Access token.
+
+    Raises:
+        RuntimeError -- If a request fails.
+    """
+    existing = EVE.get(endpoint="gene_symbols", token=token).json()["_items"]
+    if existing:
+        # Delete a record. There is a hook in the API that responds to any completed
+        # deletion of a record by dropping the whole collection.
         EVE.delete(
             endpoint="gene_symbols",
-            token=refresh_hugo_defs.token["access_token"],
-            item_id=_id,
-            _etag=_etag,
+            token=token,
+            item_id=existing[0]["_id"],
+            _etag=existing[0]["_etag"],
             code=204,
         )
-        # Chunk the list to only post 10000 items at a time
-        tasks = [
-            chunked_upload.s(hugo_entries[x : x + 10000])
-            for x in range(0, len(hugo_entries), 10000)
-        ]
+    post_symbols(symbols, token)
 
-        execute_in_parallel(tasks)
-    except RuntimeError as run:
-        error = "Error adding hugo symbols to DB: %s" % str(run)
+
+def publish_symbol_index(symbols: Iterable[str]) -> None:
+    """
+    Writes a new version of the local gene symbol index, which workers pick up on their
+    next validation.
+
+    Arguments:
+        symbols {Iterable[str]} -- Every valid symbol and synonym.
+    """
+    try:
+        index = SymbolIndex.build(symbols)
+        version = index.save(SYMBOL_INDEX_DIR)
+        message = "Published gene symbol index %s with %s symbols" % (
+            version,
+            len(index),
+        )
+        logging.info({"message": message, "category": "INFO-CELERY-HUGO"})
+    except OSError as err:
+        error = "Error writing the gene symbol index: %s" % str(err)
         logging.error({"message": error, "category": "ERROR-CELERY-HUGO"})
 
 
+def lookup_symbols(symbols: List[str]) -> List[str]:
+    """
+    Asks the API which of the symbols are valid.
+
+    Arguments:
+        symbols {List[str]} -- Unique gene symbols.
+
+    Returns:
+        List[str] -- The valid ones.
+    """
+    token = check_symbols_valid.token["access_token"]
+    results = iter_where_in(
+        EVE, "gene_symbols", token, "symbol", symbols, fields=["symbol"]
+    )
+    return [result["symbol"] for result in results]
+
+
+SYMBOL_BATCHER = SymbolBatcher(
+    lookup_symbols, SYMBOL_BATCH_WINDOW, SYMBOL_CACHE_TTL, SYMBOL_CACHE_MAX
+)
+
+
 @APP.task(base=AuthorizedTask)
 def check_symbols_valid(symbols: List[str]) -> dict:
     """
-    Takes a list of symbols and confirms their validity.
+    Takes a list of symbols and confirms their validity. The local symbol index is used
+    when one has been published. Otherwise the API is asked, in lookups shared by the
+    validations running at the same time and cached for a while.
 
     Arguments:
         symbols {List[str]} -- List of gene symbols.
@@ -125,19 +304,17 @@ def check_symbols_valid(symbols: List[str]) -> dict:
         dict -- If unmatched symbols, an error message, else None.
     """
     try:
-        results = EVE.get(
-            endpoint="gene_symbols?where=%s" % json.dumps({"symbol": {"$in": symbols}}),
-            token=check_symbols_valid.token["access_token"],
-            json={},
-        ).json()["_items"]
-        found = [result["symbol"] for result in results]
-
-        if len(found) == len(symbols):
+        index = SYMBOL_INDEX.current()
+        if index is not None:
+            invalid = index.missing(symbols)
+        else:
+            invalid = SYMBOL_BATCHER.missing(symbols)
+
+        if not invalid:
             return None
 
         return mk_error(
-            "Found invalid gene symbols: %s"
-            % (", ".join([x for x in symbols if x not in found])),
+            "Found invalid gene symbols: %s" % ", ".join(invalid),
             affected_paths=["ol_assay"],
         )
     except RuntimeError as run:
@@ -150,38 +327,205 @@ def check_symbols_valid(symbols: List[str]) -> dict:
         )
 
 
-def get_gz_ftp(server_url: str, directory: str, file_name: str) -> str:
+def decompress_lines(blocks: Iterable[bytes]) -> Generator[str, None, None]:
+    """
+    Decompresses a stream of gzip blocks and yields its lines as they are completed.
+
+    Arguments:
+        blocks {Iterable[bytes]} -- Compressed blocks, in order.
+
+    Returns:
+        Generator[str, None, None] -- Lines, without line endings.
+    """
+    decompressor = zlib.decompressobj(GZIP_WBITS)
+    partial = b""
+    for block in blocks:
+        while block:
+            partial += decompressor.decompress(block)
+            # Concatenated gzip members start a new decompressor.
+            block = decompressor.unused_data
+            if decompressor.eof:
+                decompressor = zlib.decompressobj(GZIP_WBITS)
+            lines = partial.split(b"\n")
+            partial = lines.pop()
+            for line in lines:
+                yield line.decode("utf-8")
+    partial += decompressor.flush()
+    if partial:
+        yield partial.decode("utf-8")
+
+
+def iter_ftp_blocks(
+    ftp: FTP, file_name: str, block_size: int = FTP_BLOCK_SIZE, rest: int = None
+) -> Generator[bytes, None, None]:
     """
-    Fetch a .gz file from an ftp server and return in plain text.
+    Downloads a file from a logged in FTP connection, yielding blocks as they arrive.
 
     Arguments:
-        sever_url {str} -- URL of the FTP server
-        directory {str} -- Directory of file
+        ftp {FTP} -- Connection, in the file's directory.
         file_name {str} -- Name of file.
 
+    Keyword Arguments:
+        block_size {int} -- Bytes read per block. (default: {FTP_BLOCK_SIZE})
+        rest {int} -- Offset to start the transfer at. (default: {None})
+
     Returns:
-        str -- String contents of the file.
+        Generator[bytes, None, None] -- Blocks of the file.
     """
-    ftp = FTP(server_url)
-    ftp.login()
-    ftp.cwd(directory)
-    bytes_io = BytesIO()
-    ftp.retrbinary("RETR %s" % file_name, bytes_io.write)
-    return str(gzip.decompress(bytes_io.getvalue()), "utf-8").strip()
+    ftp.voidcmd("TYPE I")
+    connection = ftp.transfercmd("RETR %s" % file_name, rest=rest)
+    try:
+        while True:
+            block = connection.recv(block_size)
+            if not block:
+                break
+            yield block
+    finally:
+        connection.close()
+    ftp.voidresp()
 
 
-def build_gene_collection(tsv: str) -> List[dict]:
-    """Returns a list of dictionary entries of valid symbols.
+def remote_file_info(ftp: FTP, file_name: str) -> RemoteFile:
+    """
+    Asks an FTP server for the size and modification time of a file.
 
     Arguments:
-        tsv {str} -- TSV formatted string.
+        ftp {FTP} -- Connection, in the file's directory.
+        file_name {str} -- Name of file.
 
     Returns:
-        List[dict] -- List of valid gene symbols with one key "symbol"
+        RemoteFile -- File information, with None for what the server would not tell.
+    """
+    # SIZE is only reliable in binary mode.
+    ftp.voidcmd("TYPE I")
+    try:
+        size = ftp.size(file_name)
+    except (error_perm, error_reply):
+        size = None
+    try:
+        modified = ftp.sendcmd("MDTM %s" % file_name).split()[-1]
+    except (error_perm, error_reply):
+        modified = None
+    return RemoteFile(file_name, size, modified)
+
+
+def load_file_info(file_path: str) -> Optional[RemoteFile]:
+    """
+    Reads file information saved by save_file_info.
+
+    Arguments:
+        file_path {str} -- Path of the JSON file.
+
+    Returns:
+        Optional[RemoteFile] -- File information, None if missing or unreadable.
+    """
+    try:
+        with open(file_path) as info:
+            return RemoteFile(**json.load(info))
+    except (OSError, ValueError, TypeError):
+        return None
+
+
+def save_file_info(file_path: str, remote: RemoteFile) -> None:
+    """
+    Saves file information as JSON.
+
+    Arguments:
+        file_path {str} -- Path of the JSON file.
+        remote {RemoteFile} -- File information.
+    """
+    makedirs(path.dirname(file_path), exist_ok=True)
+    with open(file_path, "w") as info:
+        json.dump(remote._asdict(), info)
+
+
+def remove_file(file_path: str) -> None:
+    """
+    Deletes a file, if it exists.
+
+    Arguments:
+        file_path {str} -- Path of file.
+    """
+    try:
+        remove(file_path)
+    except FileNotFoundError:
+        pass
+
+
+def iter_cached_ftp_blocks(
+    ftp: FTP, remote: RemoteFile, part_path: str, block_size: int = FTP_BLOCK_SIZE
+) -> Generator[bytes, None, None]:
+    """
+    Downloads a file to a local copy, yielding blocks as they arrive. When a previous
+    download of the same version of the file was interrupted, the bytes already on disk are
+    yielded first and the transfer resumes where it stopped.
+
+    Arguments:
+        ftp {FTP} -- Connection, in the file's directory.
+        remote {RemoteFile} -- The file, as described by remote_file_info.
+        part_path {str} -- Path of the local copy. Its file information is kept next to
+            it, with a .json suffix.
+
+    Keyword Arguments:
+        block_size {int} -- Bytes read per block. (default: {FTP_BLOCK_SIZE})
+
+    Raises:
+        IOError -- If the transfer ended before the whole file was received.
+
+    Returns:
+        Generator[bytes, None, None] -- Blocks of the file.
+    """
+    info_path = "%s.json" % part_path
+    offset = 0
+    # A copy can only be resumed if it is known to be a prefix of the same file.
+    if None not in remote and load_file_info(info_path) == remote:
+        try:
+            offset = path.getsize(part_path)
+        except FileNotFoundError:
+            pass
+        if offset > remote.size:
+            offset = 0
+    if not offset:
+        remove_file(part_path)
+        save_file_info(info_path, remote)
+    else:
+        message = "Resuming the download of %s at byte %s of %s" % (
+            remote.name,
+            offset,
+            remote.size,
+        )
+        logging.info({"message": message, "category": "INFO-CELERY-HUGO"})
+        with open(part_path, "rb") as part:
+            yield from iter(lambda: part.read(block_size), b"")
+
+    with open(part_path, "ab") as part:
+        if remote.size is None or offset < remote.size:
+            for block in iter_ftp_blocks(ftp, remote.name, block_size, offset or None):
+                part.write(block)
+                offset += len(block)
+                yield block
+
+    if remote.size is not None and offset != remote.size:
+        raise IOError(
+            "Received %s of the %s bytes of %s" % (offset, remote.size, remote.name)
+        )
+
+
+def iter_gene_symbols(lines: Iterable[str]) -> Generator[str, None, None]:
+    """
+    Parses gene_info lines, yielding every symbol and synonym as it is read. Repeats are
+    not removed.
+
+    Arguments:
+        lines {Iterable[str]} -- Lines of a gene_info file, the first being the header.
+
+    Returns:
+        Generator[str, None, None] -- Symbols.
     """
     first_line = False
-    entries = []
-    for line in tsv.split("\n"):
+    for line in lines:
+        if not line:
+            continue
         if line[0] == "#" and not first_line:
             first_line = True
         elif first_line:
@@ -189,7 +533,19 @@ def build_gene_collection(tsv: str) -> List[dict]:
             for field in IDENTIFIER_FIELDS:
                 field_value = values[field["key"]]
                 if field["is_array"] and "|" in field_value:
-                    entries.extend([v for v in field_value.split("|")])
+                    yield from field_value.split("|")
                 elif field_value != "-":
-                    entries.append(field_value)
-    return [{"symbol": entry} for entry in set(entries)]
+                    yield field_value
+
+
+def build_gene_collection(tsv: Union[str, Iterable[str]]) -> List[dict]:
+    """Returns a list of dictionary entries of valid symbols.
+
+    Arguments:
+        tsv {Union[str, Iterable[str]]} -- TSV formatted string, or its lines.
+
+    Returns:
+        List[dict] -- List of valid gene symbols with one key "symbol"
+    """
+    lines = tsv.split("\n") if isinstance(tsv, str) else tsv
+    return [{"symbol": entry} for entry in set(iter_gene_symbols(lines))]
@@ -0,0 +1,275 @@
+#!/usr/bin/env python
+"""
+Single pass parser for olink NPX worksheets opened in read-only mode. Rows are streamed once,
+top to bottom, and the assay and sample structures are built as they go by. Results are kept
+as NumPy columns, one set of arrays per assay.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+from collections import deque
+from typing import Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+from openpyxl.cell.read_only import EMPTY_CELL
+
+# First column labels of the rows that follow the samples.
+MISSING_DATA_LABEL = "Missing Data freq."
+LOD_LABEL = "LOD"
+
+
+class NpxSheet(NamedTuple):
+    """
+    Everything read from an NPX worksheet. Validation of what was found is left to the caller.
+
+    Attributes:
+        version {object} -- Value of B1, the NPX Manager version.
+        first_column {Optional[List[str]]} -- Lowercased labels from the first expected label
+            to the OlinkID row, None if that row was never found.
+        has_mdf {bool} -- Whether a missing data frequency row was found.
+        samples_match {bool} -- False if the sample block has rows that are not samples.
+        assays {List[dict]} -- Assay definitions. Each "results" is a dict of parallel
+            arrays: "value" (float, NaN where empty), "qc_fail" and "below_lod" (bool).
+        samples {List[dict]} -- Sample plate and QC information.
+        result_sample_ids {List[str]} -- Sample of each position in the result arrays.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    version: object
+    first_column: Optional[List[str]]
+    has_mdf: bool
+    samples_match: bool
+    assays: List[dict]
+    samples: List[dict]
+    result_sample_ids: List[str]
+
+
+def style_flags(font, fill) -> Tuple[bool, bool]:
+    """
+    Reads the QC and LOD markers from a cell's style. Any font color marks a failed QC and
+    any fill marks a value below LOD.
+
+    Arguments:
+        font {openpyxl.styles.Font} -- Cell font.
+        fill {openpyxl.styles.Fill} -- Cell fill.
+
+    Returns:
+        Tuple[bool, bool] -- qc_fail, below_lod.
+    """
+    return font.color is not None, fill.bgColor.rgb != "00000000"
+
+
+def style_flag_table(workbook) -> List[Tuple[bool, bool]]:
+    """
+    Decodes the workbook's cell style table once, so cells can be classified by their style
+    index instead of resolving a font and fill per cell.
+
+    Arguments:
+        workbook {Workbook} -- Loaded workbook.
+
+    Returns:
+        List[Tuple[bool, bool]] -- (qc_fail, below_lod) for each style id.
+    """
+    return [
+        style_flags(workbook._fonts[style.fontId], workbook._fills[style.fillId])
+        for style in workbook._cell_styles
+    ]
+
+
+def sheet_width(worksheet) -> int:
+    """
+    Number of columns in a read-only worksheet, scanning the sheet only if the file does not
+    record its dimensions.
+
+    Arguments:
+        worksheet {ReadOnlyWorksheet} -- Worksheet.
+
+    Returns:
+        int -- Index of the last column, 1 based.
+    """
+    if not worksheet.max_column:
+        worksheet.calculate_dimension(force=True)
+    return worksheet.max_column or 0
+
+
+def cell_at(row: tuple, column: int):
+    """
+    Gets a cell of a streamed row, which may be shorter than the sheet.
+
+    Arguments:
+        row {tuple} -- Row of cells.
+        column {int} -- Column index, 1 based.
+
+    Returns:
+        Union[ReadOnlyCell, EmptyCell] -- The cell.
+    """
+    return row[column - 1] if 0 < column <= len(row) else EMPTY_CELL
+
+
+def find_olink_row(
+    rows: Iterator[tuple], first_column: List[str]
+) -> Tuple[object, Optional[List[str]], List[tuple]]:
+    """
+    Reads rows until the OlinkID row, the last of the expected first column labels.
+
+    Arguments:
+        rows {Iterator[tuple]} -- Streamed rows, consumed up to and including the OlinkID row.
+        first_column {List[str]} -- Expected lowercase labels, ending with "olinkid".
+
+    Returns:
+        Tuple[object, Optional[List[str]], List[tuple]] -- B1 value, labels found from the
+            first expected label on, and the last four rows read.
+    """
+    version = None
+    labels = []
+    header_rows = deque(maxlen=4)
+    for index, row in enumerate(rows, 1):
+        if index == 1:
+            version = cell_at(row, 2).value
+        value = cell_at(row, 1).value
+        label = str(value).lower() if value else ""
+        labels.append(label)
+        header_rows.append(row)
+        if label == first_column[0]:
+            labels = [label]
+        elif label == first_column[-1]:
+            return version, labels, list(header_rows)
+    return version, None, list(header_rows)
+
+
+def read_npx_sheet(worksheet, first_column: List[str]) -> NpxSheet:
+    """
+    Parses an NPX worksheet in one pass. The layout is a column of labels ending in OlinkID,
+    with the assay definitions in the four rows up to it, then one row per sample, an LOD
+    row and a missing data frequency row. The last two columns hold plate ids and QC status.
+
+    Arguments:
+        worksheet {ReadOnlyWorksheet} -- Worksheet from a workbook opened with read_only=True.
+        first_column {List[str]} -- Expected lowercase labels, ending with "olinkid".
+
+    Returns:
+        NpxSheet -- Parsed sheet.
+    """
+    width = sheet_width(worksheet)
+    workbook = worksheet.parent
+    # Cells missing from the file render with the workbook's default style.
+    empty_flags = style_flags(workbook._fonts[0], workbook._fills[0])
+    flags_by_style = style_flag_table(workbook)
+    assay_columns = range(2, width - 1)
+    rows = worksheet.iter_rows()
+
+    version, labels, header_rows = find_olink_row(rows, first_column)
+    if labels is None:
+        return NpxSheet(version, None, False, False, [], [], [])
+
+    header_rows = [()] * (4 - len(header_rows)) + header_rows
+    assays = [
+        {
+            "panel": cell_at(header_rows[0], column).value,
+            "assay": cell_at(header_rows[1], column).value,
+            "uniprot_id": cell_at(header_rows[2], column).value,
+            "olink_id": cell_at(header_rows[3], column).value,
+            "lod": None,
+            "missing_data_freq": None,
+        }
+        for column in assay_columns
+    ]
+
+    sample_ids = []
+    plates = []
+    qc_statuses = []
+    # One row per sample, one entry per assay column.
+    value_rows = []
+    flag_rows = []
+    # Rows that are not samples but sit between samples count as part of the sample block.
+    pending = []
+    samples_match = True
+    previous_row = header_rows[-1]
+    lod_row = None
+    mdf_row = None
+
+    for row in rows:
+        label = cell_at(row, 1).value
+        if label == MISSING_DATA_LABEL:
+            lod_row, mdf_row = previous_row, row
+        if label and label not in (LOD_LABEL, MISSING_DATA_LABEL):
+            if pending:
+                if samples_match:
+                    # The results can no longer be matched to samples, stop keeping them.
+                    samples_match = False
+                    value_rows = []
+                    flag_rows = []
+                for plate, qc_status in pending:
+                    plates.append(plate)
+                    qc_statuses.append(qc_status)
+                pending = []
+            sample_ids.append(label)
+            plates.append(cell_at(row, width - 1).value)
+            qc_statuses.append(cell_at(row, width).value)
+            if samples_match:
+                values = []
+                flags = []
+                for column in assay_columns:
+                    cell = cell_at(row, column)
+                    if cell is EMPTY_CELL:
+                        values.append(np.nan)
+                        flags.append(empty_flags)
+                    else:
+                        values.append(float(cell.value) if cell.value else np.nan)
+                        flags.append(flags_by_style[cell._style_id])
+                value_rows.append(values)
+                flag_rows.append(flags)
+        elif sample_ids:
+            pending.append((cell_at(row, width - 1).value, cell_at(row, width).value))
+        previous_row = row
+
+    if mdf_row is not None:
+        for column, assay in zip(assay_columns, assays):
+            assay["lod"] = cell_at(lod_row, column).value
+            assay["missing_data_freq"] = cell_at(mdf_row, column).value
+
+    if assays:
+        # Samples x assays, transposed so each assay's results are contiguous.
+        values = np.array(value_rows, dtype=np.float64).reshape(-1, len(assays)).T.copy()
+        flags = np.array(flag_rows, dtype=bool).reshape(-1, len(assays), 2)
+        flags = flags.transpose(1, 2, 0).copy()
+        del value_rows, flag_rows
+        for index, assay in enumerate(assays):
+            assay["results"] = {
+                "value": values[index],
+                "qc_fail": flags[index, 0],
+                "below_lod": flags[index, 1],
+            }
+
+    return NpxSheet(
+        version,
+        labels,
+        mdf_row is not None,
+        samples_match,
+        assays,
+        [
+            {"sample_id": sample_id, "qc_status": qc_status, "plate_id": plate}
+            for plate, qc_status, sample_id in zip(plates, qc_statuses, sample_ids)
+        ],
+        sample_ids if samples_match else [],
+    )
+
+
+def result_columns(results: dict) -> Tuple[list, list, list]:
+    """
+    Turns an assay's result arrays into plain lists, with None for empty values.
+
+    Arguments:
+        results {dict} -- "value", "qc_fail" and "below_lod" arrays or lists.
+
+    Returns:
+        Tuple[list, list, list] -- Values, qc_fail flags, below_lod flags.
+    """
+    values = np.asarray(results["value"], dtype=np.float64)
+    return (
+        np.where(np.isnan(values), None, values.astype(object)).tolist(),
+        np.asarray(results["qc_fail"], dtype=bool).tolist(),
+        np.asarray(results["below_lod"], dtype=bool).tolist(),
+    )
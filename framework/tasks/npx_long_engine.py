@@ -0,0 +1,184 @@
+#!/usr/bin/env python
+"""
+Parser for olink NPX exports in long format, the CSV/TSV layout with one row per sample and
+assay. The rows are grouped with pandas and produce the same NpxSheet as the xlsx engine.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+from typing import BinaryIO, List, Tuple, Union
+
+import numpy as np
+import pandas as pd
+
+from framework.tasks.npx_engine import NpxSheet
+from framework.tasks.object_store import binary_file
+from framework.tasks.table_engine import rewound
+
+# Columns of a long format export, and the ones every file must have.
+LONG_COLUMNS = [
+    "SampleID",
+    "OlinkID",
+    "UniProt",
+    "Assay",
+    "MissingFreq",
+    "Panel",
+    "PlateID",
+    "QC_Warning",
+    "LOD",
+    "NPX",
+]
+REQUIRED_COLUMNS = ["SampleID", "OlinkID", "Assay", "NPX"]
+NUMERIC_COLUMNS = ["MissingFreq", "LOD", "NPX"]
+DELIMITERS = ["\t", ";", ","]
+
+
+def sniff_delimiter(header: str) -> str:
+    """
+    Picks the delimiter of a long format file from its header line.
+
+    Arguments:
+        header {str} -- First line of the file.
+
+    Returns:
+        str -- The delimiter appearing most often, tab on a tie.
+    """
+    return max(DELIMITERS, key=header.count)
+
+
+def to_numbers(column: pd.Series) -> np.ndarray:
+    """
+    Converts a column to floats. Columns pandas could not parse as numbers are converted
+    from text, accepting decimal commas and turning anything else into NaN.
+
+    Arguments:
+        column {pd.Series} -- Column as read.
+
+    Returns:
+        np.ndarray -- Float array.
+    """
+    if column.dtype.kind in "fiu":
+        return column.to_numpy(dtype=np.float64)
+    return pd.to_numeric(
+        column.astype(str).str.replace(",", ".", regex=False), errors="coerce"
+    ).to_numpy(dtype=np.float64)
+
+
+def nullable(values: Union[np.ndarray, pd.Series]) -> List[object]:
+    """
+    Converts an array to a list of plain python values, with None in place of NaN.
+
+    Arguments:
+        values {Union[np.ndarray, pd.Series]} -- Values.
+
+    Returns:
+        List[object] -- Values.
+    """
+    values = np.asarray(values, dtype=object)
+    return np.where(pd.isnull(values), None, values).tolist()
+
+
+def read_npx_long(source: Union[str, BinaryIO]) -> Tuple[NpxSheet, int]:
+    """
+    Parses a long format NPX export. Samples and assays are kept in order of first
+    appearance. An assay's LOD and missing data frequency come from its first row, a result
+    fails QC when its QC_Warning is anything but "Pass", and is below LOD when its NPX is
+    lower than the LOD of its row.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
+
+    Raises:
+        ValueError -- If the file can not be read as a table or lacks a required column.
+
+    Returns:
+        Tuple[NpxSheet, int] -- Parsed sheet, and the number of rows repeating a sample and
+            assay pair already seen. The last of the repeated values is kept.
+    """
+    with binary_file(source) as table:
+        header = table.readline().decode("utf-8-sig")
+    delimiter = sniff_delimiter(header)
+    columns = [column.strip().strip('"') for column in header.rstrip("\r\n").split(delimiter)]
+    missing = [column for column in REQUIRED_COLUMNS if column not in columns]
+    if missing:
+        raise ValueError("Missing required columns: %s" % ", ".join(missing))
+
+    frame = pd.read_csv(
+        rewound(source),
+        sep=delimiter,
+        usecols=lambda column: column in LONG_COLUMNS,
+        dtype={
+            column: str for column in LONG_COLUMNS if column not in NUMERIC_COLUMNS
+        },
+        encoding="utf-8-sig",
+    )
+    for column in LONG_COLUMNS:
+        if column not in frame:
+            frame[column] = np.nan
+    frame = frame[frame["SampleID"].notnull() & frame["OlinkID"].notnull()]
+
+    sample_codes, sample_ids = pd.factorize(frame["SampleID"])
+    assay_codes, olink_ids = pd.factorize(frame["OlinkID"])
+    npx = to_numbers(frame["NPX"])
+    lod = to_numbers(frame["LOD"])
+    # Classify the few distinct QC values rather than every row. Missing values get code
+    # -1, which picks the trailing False.
+    qc_codes, qc_values = pd.factorize(frame["QC_Warning"])
+    qc_fail = np.array(
+        [str(value).strip().lower() != "pass" for value in qc_values] + [False]
+    )[qc_codes]
+    with np.errstate(invalid="ignore"):
+        below_lod = npx < lod
+
+    # Scatter the rows into assays x samples arrays.
+    values = np.full((len(olink_ids), len(sample_ids)), np.nan)
+    flags = np.zeros((2, len(olink_ids), len(sample_ids)), dtype=bool)
+    values[assay_codes, sample_codes] = npx
+    flags[0, assay_codes, sample_codes] = qc_fail
+    flags[1, assay_codes, sample_codes] = below_lod
+
+    first = (~frame.duplicated("OlinkID")).to_numpy()
+    assay_columns = zip(
+        nullable(frame["Panel"][first]),
+        nullable(frame["Assay"][first]),
+        nullable(frame["UniProt"][first]),
+        nullable(frame["OlinkID"][first]),
+        nullable(lod[first]),
+        nullable(to_numbers(frame["MissingFreq"])[first]),
+    )
+    assays = [
+        {
+            "panel": panel,
+            "assay": assay,
+            "uniprot_id": uniprot_id,
+            "olink_id": olink_id,
+            "lod": assay_lod,
+            "missing_data_freq": missing_data_freq,
+            "results": {
+                "value": values[index],
+                "qc_fail": flags[0, index],
+                "below_lod": flags[1, index],
+            },
+        }
+        for index, (
+            panel,
+            assay,
+            uniprot_id,
+            olink_id,
+            assay_lod,
+            missing_data_freq,
+        ) in enumerate(assay_columns)
+    ]
+
+    first = (~frame.duplicated("SampleID")).to_numpy()
+    samples = [
+        {"sample_id": sample_id, "qc_status": qc_status, "plate_id": plate_id}
+        for sample_id, qc_status, plate_id in zip(
+            nullable(frame["SampleID"][first]),
+            nullable(frame["QC_Warning"][first]),
+            nullable(frame["PlateID"][first]),
+        )
+    ]
+
+    duplicates = int(frame.duplicated(["SampleID", "OlinkID"]).sum())
+    return NpxSheet(None, None, True, True, assays, samples, list(sample_ids)), duplicates
@@ -0,0 +1,646 @@
+#!/usr/bin/env python
+"""
+Thin storage backends for objects that tasks write to, so that appends can be done on the
+server instead of by downloading and re-uploading whole files.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import base64
+import hashlib
+import json
+import logging
+import shutil
+import time
+from os import (
+    O_CREAT,
+    O_EXCL,
+    O_WRONLY,
+    fdopen,
+    listdir,
+    makedirs,
+    open as os_open,
+    path as os_path,
+    remove,
+    replace,
+)
+from contextlib import contextmanager
+from io import BytesIO
+from tempfile import NamedTemporaryFile
+from typing import BinaryIO, Generator, List, Optional, Tuple, Union
+from uuid import uuid4
+
+from google.cloud import storage
+from google.api_core.exceptions import NotFound, PreconditionFailed
+
+# GCS compose accepts at most 32 source objects per request, and a composite object can
+# be made of at most 1024 components.
+MAX_COMPOSE_SOURCES = 32
+MAX_COMPONENT_COUNT = 1024
+# Metadata key of the last fragment composed onto an object.
+COMPOSED_THROUGH = "composed_through"
+
+
+@contextmanager
+def binary_file(
+    source: Union[str, BinaryIO]
+) -> Generator[BinaryIO, None, None]:
+    """
+    Lets functions accept either a path or an already open binary file. Paths are opened and
+    closed, open files are passed through untouched.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path or binary file object.
+
+    Returns:
+        Generator[BinaryIO, None, None] -- Context manager yielding a binary file object.
+    """
+    if isinstance(source, str):
+        with open(source, "rb") as handle:
+            yield handle
+    else:
+        yield source
+
+
+def pending_name() -> str:
+    """
+    Creates a unique name for a queue entry that sorts in arrival order.
+
+    Returns:
+        str -- Entry name.
+    """
+    return "%017.6f-%s" % (time.time(), uuid4())
+
+
+def parse_gs_uri(gs_uri: str) -> Tuple[str, str]:
+    """
+    Splits a gs:// uri into bucket and object name.
+
+    Arguments:
+        gs_uri {str} -- Google storage uri.
+
+    Returns:
+        Tuple[str, str] -- Bucket name, object name.
+    """
+    bucket_name, _, blob_name = gs_uri.replace("gs://", "", 1).partition("/")
+    return bucket_name, blob_name
+
+
+class GCSStore(object):
+    """
+    Google Cloud Storage backend. Appends are uploaded as fragment objects, then stitched
+    onto the target with compose.
+    """
+
+    def __init__(self, client: storage.Client = None):
+        """
+        Constructor.
+
+        Keyword Arguments:
+            client {storage.Client} -- Storage client, created on first use if not given.
+                (default: {None})
+        """
+        self._client = client
+
+    @property
+    def client(self) -> storage.Client:
+        """
+        Storage client, created lazily so importing this module does not need credentials.
+
+        Returns:
+            storage.Client -- Google storage client.
+        """
+        if self._client is None:
+            self._client = storage.Client()
+        return self._client
+
+    def blob(self, gs_uri: str) -> storage.Blob:
+        """
+        Gets a blob handle for a uri.
+
+        Arguments:
+            gs_uri {str} -- Google storage uri.
+
+        Returns:
+            storage.Blob -- Blob handle, not fetched.
+        """
+        bucket_name, blob_name = parse_gs_uri(gs_uri)
+        return self.client.bucket(bucket_name).blob(blob_name)
+
+    def upload(self, local_path: str, gs_uri: str) -> None:
+        """
+        Uploads a local file, replacing the object if it exists.
+
+        Arguments:
+            local_path {str} -- Path of the local file.
+            gs_uri {str} -- Destination uri.
+        """
+        self.blob(gs_uri).upload_from_filename(local_path)
+
+    def open_for_read(self, gs_uri: str, spool_limit: int) -> BinaryIO:
+        """
+        Downloads an object without going through a file in the working directory. Objects
+        up to spool_limit bytes are held in memory, larger ones are spooled to a temporary
+        file that is deleted when closed.
+
+        Arguments:
+            gs_uri {str} -- Uri of the object.
+            spool_limit {int} -- Largest object, in bytes, kept in memory.
+
+        Raises:
+            FileNotFoundError -- If the object does not exist.
+
+        Returns:
+            BinaryIO -- Binary file object positioned at the start.
+        """
+        bucket_name, blob_name = parse_gs_uri(gs_uri)
+        blob = self.client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            raise FileNotFoundError(gs_uri)
+
+        if blob.size <= spool_limit:
+            return BytesIO(blob.download_as_string())
+
+        spooled = NamedTemporaryFile()
+        blob.download_to_file(spooled)
+        spooled.seek(0)
+        return spooled
+
+    def fingerprint(self, gs_uri: str) -> Optional[str]:
+        """
+        Content hash of an object from its metadata, without downloading it. Composite
+        objects have no md5, so their crc32c is used instead.
+
+        Arguments:
+            gs_uri {str} -- Uri of the object.
+
+        Returns:
+            Optional[str] -- Hash prefixed with its algorithm, None if the object is missing.
+        """
+        bucket_name, blob_name = parse_gs_uri(gs_uri)
+        blob = self.client.bucket(bucket_name).get_blob(blob_name)
+        if blob is None:
+            return None
+        if blob.md5_hash:
+            return "md5:%s" % blob.md5_hash
+        return "crc32c:%s:%s" % (blob.crc32c, blob.size)
+
+    def copy(self, source_uri: str, gs_uri: str) -> None:
+        """
+        Copies an object on the server.
+
+        Arguments:
+            source_uri {str} -- Uri of the object to copy.
+            gs_uri {str} -- Destination uri.
+        """
+        source = self.blob(source_uri)
+        destination_bucket, destination_name = parse_gs_uri(gs_uri)
+        source.bucket.copy_blob(
+            source, self.client.bucket(destination_bucket), destination_name
+        )
+
+    def concat(self, gs_uri: str, fragment_uris: List[str]) -> None:
+        """
+        Composes existing objects onto the end of the target, in as many compose requests
+        as the source limit requires, deleting each request's objects once it succeeds.
+        Every compose is conditional on the target being unchanged since it was read, and
+        records the last object it appended in the target's metadata. Calling concat again
+        after a failure therefore skips what was already appended instead of duplicating it.
+
+        Arguments:
+            gs_uri {str} -- Uri of the object being appended to, it must exist.
+            fragment_uris {List[str]} -- Objects to append, in arrival order.
+
+        Raises:
+            PreconditionFailed -- If the target was changed by someone else meanwhile.
+        """
+        target = self.blob(gs_uri)
+        target.reload()
+        composed_through = (target.metadata or {}).get(COMPOSED_THROUGH)
+        if composed_through in fragment_uris:
+            done = fragment_uris.index(composed_through) + 1
+            logging.warning(
+                {
+                    "message": "Skipping %s fragments already composed onto %s"
+                    % (done, gs_uri),
+                    "category": "WARNING-CELERY-STORAGE",
+                }
+            )
+            self.delete_fragments(fragment_uris[:done])
+            fragment_uris = fragment_uris[done:]
+
+        step = MAX_COMPOSE_SOURCES - 1
+        for i in range(0, len(fragment_uris), step):
+            batch = fragment_uris[i : i + step]
+            if (target.component_count or 1) + len(batch) > MAX_COMPONENT_COUNT:
+                self.compact(target)
+            target.content_type = target.content_type or "text/plain"
+            target.metadata = dict(target.metadata or {}, **{COMPOSED_THROUGH: batch[-1]})
+            target.compose(
+                [target] + [self.blob(uri) for uri in batch],
+                if_generation_match=target.generation,
+            )
+            self.delete_fragments(batch)
+
+        logging.info(
+            {
+                "message": "Composed %s fragments onto %s" % (len(fragment_uris), gs_uri),
+                "category": "INFO-CELERY-STORAGE",
+            }
+        )
+
+    def delete_fragments(self, fragment_uris: List[str]) -> None:
+        """
+        Deletes objects that were composed onto another one.
+
+        Arguments:
+            fragment_uris {List[str]} -- Uris of the objects.
+        """
+        for uri in fragment_uris:
+            self.delete(uri)
+
+    def compact(self, target: storage.Blob) -> None:
+        """
+        Rewrites a composite object as a single component, so more can be composed onto
+        it. A server side copy keeps the components, so the object is downloaded and
+        uploaded again, conditional on it not having changed in between.
+
+        Arguments:
+            target {storage.Blob} -- Loaded handle of the object, updated in place.
+
+        Raises:
+            PreconditionFailed -- If the object was changed by someone else meanwhile.
+        """
+        generation = target.generation
+        with NamedTemporaryFile() as spooled:
+            target.download_to_file(spooled, if_generation_match=generation)
+            spooled.seek(0)
+            target.upload_from_file(
+                spooled,
+                content_type=target.content_type or "text/plain",
+                if_generation_match=generation,
+            )
+        logging.info(
+            {
+                "message": "Compacted %s to a single component" % target.name,
+                "category": "INFO-CELERY-STORAGE",
+            }
+        )
+
+    def append(self, gs_uri: str, local_paths: List[str]) -> None:
+        """
+        Appends the contents of local files to an existing object.
+
+        Arguments:
+            gs_uri {str} -- Uri of the object being appended to.
+            local_paths {List[str]} -- Files to append, in order.
+        """
+        fragment_uris = []
+        for local_path in local_paths:
+            fragment_uri = "%s.fragments/%s" % (gs_uri, uuid4())
+            self.upload(local_path, fragment_uri)
+            fragment_uris.append(fragment_uri)
+        self.concat(gs_uri, fragment_uris)
+
+    def push_pending(self, queue_uri: str, source: BinaryIO, metadata: dict) -> str:
+        """
+        Adds a file to a queue of objects waiting to be processed.
+
+        Arguments:
+            queue_uri {str} -- Uri prefix of the queue.
+            source {BinaryIO} -- Binary file object to enqueue, read from the start.
+            metadata {dict} -- JSON serializable information kept with the file.
+
+        Returns:
+            str -- Uri of the queued object.
+        """
+        entry_uri = "%s/%s" % (queue_uri, pending_name())
+        blob = self.blob(entry_uri)
+        blob.metadata = {key: json.dumps(value) for key, value in metadata.items()}
+        blob.upload_from_file(source, rewind=True)
+        return entry_uri
+
+    def list_pending(self, queue_uri: str) -> List[Tuple[str, dict]]:
+        """
+        Lists a queue in arrival order.
+
+        Arguments:
+            queue_uri {str} -- Uri prefix of the queue.
+
+        Returns:
+            List[Tuple[str, dict]] -- Uri and metadata of every queued object.
+        """
+        bucket_name, prefix = parse_gs_uri(queue_uri)
+        entries = [
+            (
+                "gs://%s/%s" % (bucket_name, blob.name),
+                {key: json.loads(value) for key, value in (blob.metadata or {}).items()},
+            )
+            for blob in self.client.bucket(bucket_name).list_blobs(prefix=prefix + "/")
+        ]
+        return sorted(entries, key=lambda entry: entry[0])
+
+    def delete(self, gs_uri: str) -> None:
+        """
+        Deletes an object if it exists.
+
+        Arguments:
+            gs_uri {str} -- Uri of the object.
+        """
+        try:
+            self.blob(gs_uri).delete()
+        except NotFound:
+            pass
+
+    def acquire_lease(self, lease_uri: str, ttl: int) -> Optional[str]:
+        """
+        Tries to take an exclusive lease, by creating an object that must not exist yet.
+        A lease older than its ttl is considered abandoned and broken.
+
+        Arguments:
+            lease_uri {str} -- Uri of the lease object.
+            ttl {int} -- Seconds after which the lease expires.
+
+        Returns:
+            Optional[str] -- Generation of the lease object, to release it with, None if
+                the lease is held by someone else.
+        """
+        blob = self.blob(lease_uri)
+        try:
+            blob.upload_from_string(str(time.time() + ttl), if_generation_match=0)
+            return str(blob.generation)
+        except PreconditionFailed:
+            pass
+
+        try:
+            blob.reload()
+            if float(blob.download_as_string()) > time.time():
+                return None
+            logging.warning(
+                {
+                    "message": "Breaking expired lease %s" % lease_uri,
+                    "category": "WARNING-CELERY-STORAGE",
+                }
+            )
+            blob.delete(if_generation_match=blob.generation)
+            blob.upload_from_string(str(time.time() + ttl), if_generation_match=0)
+            return str(blob.generation)
+        except (NotFound, PreconditionFailed):
+            return None
+
+    def release_lease(self, lease_uri: str, lease: str) -> None:
+        """
+        Gives up a lease, unless it expired and was taken by someone else meanwhile.
+
+        Arguments:
+            lease_uri {str} -- Uri of the lease object.
+            lease {str} -- Generation returned by acquire_lease.
+        """
+        try:
+            self.blob(lease_uri).delete(if_generation_match=int(lease))
+        except (NotFound, PreconditionFailed):
+            logging.warning(
+                {
+                    "message": "Lease %s expired before it was released" % lease_uri,
+                    "category": "WARNING-CELERY-STORAGE",
+                }
+            )
+
+
+class LocalStore(object):
+    """
+    Local filesystem backend with the same semantics as GCSStore, used for tests and for
+    running without a bucket. Uris are plain paths or file:// uris.
+    """
+
+    @staticmethod
+    def local_path(uri: str) -> str:
+        """
+        Converts a uri to a filesystem path.
+
+        Arguments:
+            uri {str} -- Path or file:// uri.
+
+        Returns:
+            str -- Filesystem path.
+        """
+        return uri.replace("file://", "", 1)
+
+    def upload(self, local_path: str, uri: str) -> None:
+        """
+        Copies a local file to the destination, replacing it if it exists.
+
+        Arguments:
+            local_path {str} -- Path of the local file.
+            uri {str} -- Destination uri.
+        """
+        destination = self.local_path(uri)
+        if os_path.dirname(destination):
+            makedirs(os_path.dirname(destination), exist_ok=True)
+        shutil.copyfile(local_path, destination)
+
+    def open_for_read(self, uri: str, spool_limit: int) -> BinaryIO:
+        """
+        Opens a file for reading. Local files are already on disk, so nothing is spooled.
+
+        Arguments:
+            uri {str} -- Uri of the file.
+            spool_limit {int} -- Unused, kept for parity with GCSStore.
+
+        Returns:
+            BinaryIO -- Binary file object positioned at the start.
+        """
+        return open(self.local_path(uri), "rb")
+
+    def fingerprint(self, uri: str) -> Optional[str]:
+        """
+        Content hash of a file.
+
+        Arguments:
+            uri {str} -- Uri of the file.
+
+        Returns:
+            Optional[str] -- Hash prefixed with its algorithm, None if the file is missing.
+        """
+        digest = hashlib.md5()
+        try:
+            with open(self.local_path(uri), "rb") as handle:
+                for block in iter(lambda: handle.read(1024 * 1024), b""):
+                    digest.update(block)
+        except FileNotFoundError:
+            return None
+        return "md5:%s" % base64.b64encode(digest.digest()).decode("ascii")
+
+    def copy(self, source_uri: str, uri: str) -> None:
+        """
+        Copies a file.
+
+        Arguments:
+            source_uri {str} -- Uri of the file to copy.
+            uri {str} -- Destination uri.
+        """
+        self.upload(self.local_path(source_uri), uri)
+
+    def concat(self, uri: str, fragment_uris: List[str]) -> None:
+        """
+        Appends existing files to the end of the target, then deletes them.
+
+        Arguments:
+            uri {str} -- Uri of the file being appended to, it must exist.
+            fragment_uris {List[str]} -- Files to append, in order.
+        """
+        self.append(uri, [self.local_path(fragment) for fragment in fragment_uris])
+        for fragment in fragment_uris:
+            self.delete(fragment)
+
+    def append(self, uri: str, local_paths: List[str]) -> None:
+        """
+        Appends the contents of local files to an existing file.
+
+        Arguments:
+            uri {str} -- Uri of the file being appended to.
+            local_paths {List[str]} -- Files to append, in order.
+        """
+        if not os_path.exists(self.local_path(uri)):
+            raise FileNotFoundError(uri)
+        with open(self.local_path(uri), "ab") as target:
+            for local_path in local_paths:
+                with open(local_path, "rb") as fragment:
+                    shutil.copyfileobj(fragment, target)
+
+    def push_pending(self, queue_uri: str, source: BinaryIO, metadata: dict) -> str:
+        """
+        Adds a file to a queue of files waiting to be processed. The metadata is kept in a
+        json file next to it.
+
+        Arguments:
+            queue_uri {str} -- Directory of the queue.
+            source {BinaryIO} -- Binary file object to enqueue, read from the start.
+            metadata {dict} -- JSON serializable information kept with the file.
+
+        Returns:
+            str -- Path of the queued file.
+        """
+        entry_uri = "%s/%s" % (queue_uri, pending_name())
+        makedirs(self.local_path(queue_uri), exist_ok=True)
+        source.seek(0)
+        with open(self.local_path(entry_uri), "wb") as entry:
+            shutil.copyfileobj(source, entry)
+        # list_pending skips files without a sidecar, so it is moved in place last.
+        sidecar_path = self.local_path(entry_uri) + ".json"
+        with open(sidecar_path + ".tmp", "w") as sidecar:
+            json.dump(metadata, sidecar)
+        replace(sidecar_path + ".tmp", sidecar_path)
+        return entry_uri
+
+    def list_pending(self, queue_uri: str) -> List[Tuple[str, dict]]:
+        """
+        Lists a queue in arrival order.
+
+        Arguments:
+            queue_uri {str} -- Directory of the queue.
+
+        Returns:
+            List[Tuple[str, dict]] -- Path and metadata of every queued file.
+        """
+        queue_dir = self.local_path(queue_uri)
+        if not os_path.isdir(queue_dir):
+            return []
+
+        entries = []
+        for name in sorted(listdir(queue_dir)):
+            entry_path = os_path.join(queue_dir, name)
+            if name.endswith((".json", ".tmp")) or not os_path.exists(
+                entry_path + ".json"
+            ):
+                continue
+            with open(entry_path + ".json") as sidecar:
+                entries.append((entry_path, json.load(sidecar)))
+        return entries
+
+    def delete(self, uri: str) -> None:
+        """
+        Deletes a file, and its queue metadata if it has any.
+
+        Arguments:
+            uri {str} -- Uri of the file.
+        """
+        for file_path in (self.local_path(uri), self.local_path(uri) + ".json"):
+            try:
+                remove(file_path)
+            except FileNotFoundError:
+                pass
+
+    def acquire_lease(self, lease_uri: str, ttl: int) -> Optional[str]:
+        """
+        Tries to take an exclusive lease, by creating a file that must not exist yet.
+        A lease older than its ttl is considered abandoned and broken.
+
+        Arguments:
+            lease_uri {str} -- Path of the lease file.
+            ttl {int} -- Seconds after which the lease expires.
+
+        Returns:
+            Optional[str] -- Content of the lease file, to release it with, None if the
+                lease is held by someone else.
+        """
+        lease_path = self.local_path(lease_uri)
+        for _ in range(2):
+            try:
+                descriptor = os_open(lease_path, O_CREAT | O_EXCL | O_WRONLY)
+                lease = "%r %s" % (time.time() + ttl, uuid4())
+                with fdopen(descriptor, "w") as lease_file:
+                    lease_file.write(lease)
+                return lease
+            except FileExistsError:
+                try:
+                    with open(lease_path) as lease_file:
+                        expiry = lease_file.read().split(" ")[0]
+                    # An empty lease is one that is still being written.
+                    if not expiry or float(expiry) > time.time():
+                        return None
+                    remove(lease_path)
+                except (FileNotFoundError, ValueError):
+                    pass
+        return None
+
+    def release_lease(self, lease_uri: str, lease: str) -> None:
+        """
+        Gives up a lease, unless it expired and was taken by someone else meanwhile.
+
+        Arguments:
+            lease_uri {str} -- Path of the lease file.
+            lease {str} -- Content returned by acquire_lease.
+        """
+        try:
+            with open(self.local_path(lease_uri)) as lease_file:
+                if lease_file.read() == lease:
+                    remove(self.local_path(lease_uri))
+                    return
+        except FileNotFoundError:
+            pass
+        logging.warning(
+            {
+                "message": "Lease %s expired before it was released" % lease_uri,
+                "category": "WARNING-CELERY-STORAGE",
+            }
+        )
+
+
+GCS_STORE = GCSStore()
+LOCAL_STORE = LocalStore()
+
+
+def get_store(uri: str):
+    """
+    Picks the backend for a uri.
+
+    Arguments:
+        uri {str} -- gs:// uri, file:// uri or local path.
+
+    Returns:
+        Union[GCSStore, LocalStore] -- Storage backend.
+    """
+    if uri.startswith("gs://"):
+        return GCS_STORE
+    return LOCAL_STORE
@@ -7,16 +7,25 @@ __license__ = "MIT"
 
 import logging
 import subprocess
+from contextlib import contextmanager
 from datetime import datetime
 from os import remove
-from typing import Generator, List, NamedTuple, Tuple
+from typing import BinaryIO, Generator, List, Tuple, Union
 
 from openpyxl import load_workbook
 from openpyxl.utils.exceptions import InvalidFileException
 
 from framework.tasks.data_classes import RecordContext
 from framework.tasks.hugo_tasks import check_symbols_valid
-
+from framework.tasks.npx_engine import NpxSheet, read_npx_sheet, result_columns
+from framework.tasks.npx_long_engine import read_npx_long
+from framework.tasks.object_store import binary_file
+from framework.tasks.table_engine import rewound
+from framework.tasks.variables import NPX_RESULT_LAYOUT
+from framework.tasks.worksheet_index import WorksheetIndex
+
+# First bytes of a zip archive, which xlsx workbooks are.
+ZIP_MAGIC = b"PK\x03\x04"
 OLINK_FIRST_COLUMN = ["npx data", "panel", "assay", "uniprot id", "olinkid"]
 HUGO_URL = 'https://beta.genenames.org/cgi-bin/tools/symbol-check'
 
@@ -72,35 +81,6 @@ FIELD_NAME_LIST = [
 ]
 
 
-class SampleInfo(NamedTuple):
-    """
-    Basic store for sample related info.
-
-    Attributes:
-        plate_gen {Generator} -- plate info
-        qc_gen {Generator} -- qc info
-        sample_ids {List[str]} -- id list
-
-    Arguments:
-        NamedTuple {[type]} -- [description]
-    """
-
-    plate_gen: Generator
-    qc_gen: Generator
-    sample_ids: List[str]
-
-
-class AssayColumn(NamedTuple):
-    """
-    Structure for holding all the generators needed to get assay information
-        from olink files.
-    """
-
-    assay_info_gen: Generator
-    assay_metrics_gen: Generator
-    data_col_gen: Generator
-
-
 def mk_error(
     explanation: str,
     affected_paths: List[str],
@@ -164,6 +144,46 @@ def lazy_remove(path: str) -> None:
         pass
 
 
+@contextmanager
+def xlsx_source(
+    source: Union[str, BinaryIO]
+) -> Generator[Union[str, BinaryIO], None, None]:
+    """
+    Makes a source loadable by openpyxl. Paths get an xlsx extension for the duration, file
+    objects are passed through.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- File path or binary file object.
+
+    Returns:
+        Generator[Union[str, BinaryIO], None, None] -- Context manager yielding something
+            load_workbook accepts.
+    """
+    if not isinstance(source, str):
+        yield source
+        return
+    xlsx_path = add_file_extension(source, "xlsx")
+    try:
+        yield xlsx_path
+    finally:
+        lazy_remove(xlsx_path)
+
+
+def source_name(source: Union[str, BinaryIO]) -> str:
+    """
+    Name of a source for log messages.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- File path or binary file object.
+
+    Returns:
+        str -- The path, or the file object's name if it has one.
+    """
+    if isinstance(source, str):
+        return source
+    return str(getattr(source, "name", "<stream>"))
+
+
 def diff_fields(actual: List[str], expected: List[str]) -> List[str]:
     """
     Compares two lists and returns the items not present in the second list.
@@ -205,167 +225,22 @@ def bad_xlsx(record_errs: List[dict], path: str, err: InvalidFileException) -> N
     )
 
 
-def validate_qc_info(generators: SampleInfo, errors: List[dict]) -> List[dict]:
-    """
-    Loops over the qc/plateid info and returns it in a formatted list.
-
-    Arguments:
-        generators {SampleInfo} -- Tuple for holding the generators that loop over the cells
-            where the QC info is stored.
-        errors {List[dict]} -- List of errors.
-
-    Returns:
-        List[dict] -- List of SAMPLE_SCHEMA structured dicts.
-    """
-    sample_list = []
-    try:
-        # Generator should have a single column.
-        plate_col = next(generators.plate_gen)
-        qc_col = next(generators.qc_gen)
-        for plate_cell, qc_cell, sample_id in zip(
-            plate_col, qc_col, generators.sample_ids
-        ):
-            sample_list.append(
-                {
-                    "sample_id": sample_id,
-                    "qc_status": qc_cell.value,
-                    "plate_id": plate_cell.value,
-                }
-            )
-    except StopIteration:
-        errors.append(
-            mk_error(
-                "Unable to find the plate or qc column",
-                ["samples.qc_status", "samples.plate_id"],
-                raw_or_parse="PARSE",
-                severity="WARNING",
-            )
-        )
-
-    return sample_list
-
-
-def extract_assay_data(
-    assay_obj: AssayColumn, sample_ids: List[str], errors: List[dict]
-) -> List[dict]:
-    """
-    Takes a generator of assay info cells and data containing cells, and returns the
-    data in a formatted manner.
-
-    Arguments:
-        assay_obj {AssayColumn} -- namedtuple that holds all the generators for data processing.
-        sample_ids {List[str]} -- List of sample_ids.
-        errors {List[dict]} -- A list of parsing errors that have been found.
-
-    Raises:
-        InvalidFileException -- Indicates to the calling function that this file is invalid.
-
-    Returns:
-        List[dict] -- List of olink assay structured dicts.
-    """
-    assay_list = []
-    for assay_def, data, metrics in zip(
-        assay_obj.assay_info_gen, assay_obj.data_col_gen, assay_obj.assay_metrics_gen
-    ):
-        # Create the assay definition.
-        olink_assay = {
-            "panel": assay_def[0].value,
-            "assay": assay_def[1].value,
-            "uniprot_id": assay_def[2].value,
-            "olink_id": assay_def[3].value,
-            "lod": metrics[0].value,
-            "missing_data_freq": metrics[1].value,
-            "results": [],
-        }
-
-        # Sanity check sample number.
-        if len(data) != len(sample_ids):
-            errors.append(
-                mk_error(
-                    "There is a mismatch between the number of samples and the"
-                    "number of data points for assay %s" % olink_assay["assay"],
-                    ["samples"],
-                    raw_or_parse="PARSE",
-                    severity="CRITICAL",
-                )
-            )
-            return []
-
-        # Create a new entry in the assay list.
-        # Note that the check for qc/lod checks for any variation from a black-text no-fill
-        # cell. If other colors are used to indicate other things, this implementation will
-        # have to be changed.
-        for i, data_cell in enumerate(data):
-            value = float(data_cell.value) if data_cell.value else None
-            olink_assay["results"].append(
-                {
-                    "sample_id": sample_ids[i],
-                    "value": value,
-                    "qc_fail": data_cell.font.color is not None,
-                    "below_lod": data_cell.fill.bgColor.rgb != "00000000",
-                }
-            )
-        assay_list.append(olink_assay)
-    return assay_list
-
-
-def process_sample_rows(cell_gen: Generator) -> Tuple[int, int, int, int, List[str]]:
-    """
-    Takes a generator that loops over the cells containing the collected data, returns
-    relevant coordinates used to further process the file.
-
-    Arguments:
-        cell_gen {Generator} -- Generator object to loop over cells containing sample data.
-            This generator should be created on the first column, but then iterated over until
-            olink ID has been seen.
-
-    Returns:
-        Tuple[int, int, int, List[str]] -- Tuple containing in order, row of first sample,
-            row of last sample, row of missing data frequency, panel type row, and list of sample
-            ids.
-    """
-    mdf_row = None
-    sample_cells = []
-    sample_ids = []
-
-    for sam_cell in cell_gen:
-        value = sam_cell[0].value
-        if value == "Missing Data freq.":
-            mdf_row = sam_cell[0].row
-        # If a value is a sampleID, note it down.
-        elif value and value != "LOD":
-            sample_cells.append(sam_cell[0])
-            sample_ids.append(value)
-
-    return (
-        sample_cells[0].row,
-        sample_cells[-1].row,
-        mdf_row,
-        sample_ids,
-    )
-
-
 def validate_row(row_details: Tuple[List[str], int, int], wks_record: dict) -> None:
     """
     Validates a row of field names has the expected values.
 
     Arguments:
-        row_details {Tuple[List[str], int, int]} -- Field names, row index, column index
+        row_details {Tuple[List[str], int, int]} -- Field names, column index, row index
             (both 1 based).
-        wks_record {dict} -- Record.
+        wks_record {dict} -- Record and worksheet index.
 
     Returns:
         None -- [description]
     """
     try:
         extracted_sample_headers = [
-            str(cell[0].value).lower()
-            for cell in wks_record["wks"].iter_cols(
-                min_col=row_details[1],
-                max_col=row_details[1] + len(row_details[0]) - 1,
-                min_row=row_details[2],
-                max_row=row_details[2],
-            )
+            str(wks_record["wks"].value(row_details[2], column)).lower()
+            for column in range(row_details[1], row_details[1] + len(row_details[0]))
         ]
 
         if not extracted_sample_headers == row_details[0]:
@@ -391,55 +266,49 @@ def validate_column(
     """
     Compares the values of a column of cell with the expected values for those cells.
     If they match, returns the row value of the first and last cells in the column.
+    The column ends at the first cell holding the last expected value, and starts at the
+    closest cell above it holding the first expected value.
 
     Arguments:
         expected {Tuple[List[str], int]} -- The values, in order, you expect the cells to have,
             and the column index.
-        wks_record {dict} -- Record and worksheet
+        wks_record {dict} -- Record and worksheet index.
 
     Returns:
         Tuple[int, int] -- Row of first cell, row of last cell, 1 based.
     """
-    start_row = None
-    end_row = None
-    values = []
+    index = wks_record["wks"]
+    expected = [key.lower() for key in column_details[0]]
+    column = column_details[1]
+    start_rows = [row for row, _ in index.find(expected[0], column)]
+    end_rows = [row for row, _ in index.find(expected[-1], column) if row not in start_rows]
 
-    try:
-        expected = [key for key in column_details[0]]
-        gen_exp = wks_record["wks"].iter_rows(
-            min_col=column_details[1], max_col=column_details[1]
-        )
-        while not end_row:
-            cell = next(gen_exp)[0]
-            value = str(cell.value) if cell.value else ""
-            values.append(value.lower())
-
-            if value.lower() == expected[0].lower():
-                values = values[-1:]
-                start_row = cell.row
-            elif value.lower() == expected[-1].lower():
-                end_row = cell.row
-
-        if not values == expected:
-            diff = diff_fields(values, expected)
-            wks_record["record"]["validation_errors"].append(
-                mk_error(
-                    "Values of column did not match expected values. Missing: %s"
-                    % ", ".join(diff)
-                    if diff
-                    else "None",
-                    diff,
-                )
-            )
-
-    except StopIteration:
+    if not end_rows:
         wks_record["record"]["validation_errors"].append(
             mk_error(
                 "Could not find a column matching the provided description. Affected Column: %s"
-                % column_details[1],
+                % column,
                 [],
             )
         )
+        return (start_rows[-1] if start_rows else None), None
+
+    end_row = end_rows[0]
+    start_rows = [row for row in start_rows if row < end_row]
+    start_row = start_rows[-1] if start_rows else None
+    values = [index.text(row, column) for row in range(start_row or 1, end_row + 1)]
+
+    if not values == expected:
+        diff = diff_fields(values, expected)
+        wks_record["record"]["validation_errors"].append(
+            mk_error(
+                "Values of column did not match expected values. Missing: %s"
+                % ", ".join(diff)
+                if diff
+                else "None",
+                diff,
+            )
+        )
 
     return start_row, end_row
 
@@ -466,20 +335,6 @@ def cast_cell_value(cell) -> object:
     return None
 
 
-def extract_cell_values(generator: Generator) -> List[object]:
-    """
-    Given a single-column generator expression,
-    extract all rows from the generator.
-
-    Arguments:
-        generator {Generator} -- Single column generator exprsesion for xlsx worksheet.
-
-    Returns:
-        List[object] -- List of the values of the cells.
-    """
-    return list(map(lambda cell: cast_cell_value(cell[0]), generator))
-
-
 def parse_matched_column(
     column_details: Tuple[List[str], int], wks_record: dict
 ) -> dict:
@@ -488,58 +343,47 @@ def parse_matched_column(
 
     Arguments:
         column_details {Tuple[List[str], int]} -- List of field names, column index (1 base)
-        wks_record {dict} -- Record object.
+        wks_record {dict} -- Record and worksheet index.
 
     Returns:
         dict -- Column information in dict form.
     """
+    index = wks_record["wks"]
     start_row, end_row = validate_column(column_details, wks_record)
-    values = extract_cell_values(
-        wks_record["wks"].iter_rows(
-            min_col=column_details[1] + 1,
-            max_col=column_details[1] + 1,
-            min_row=start_row,
-            max_row=end_row,
-        )
-    )
+    first_row = start_row or 1
+    last_row = min(end_row or index.max_row, first_row + len(column_details[0]) - 1)
     data = {}
-    for field_name, value in zip(
-        [value for key, value in column_details[0].items()], values
-    ):
-        data[field_name] = value
+    for field_name, row in zip(column_details[0].values(), range(first_row, last_row + 1)):
+        data[field_name] = cast_cell_value(index.cell(row, column_details[1] + 1))
 
     return data
 
 
 def find_row_wise(wks_record: dict, header_fields: List[str]) -> Tuple[int, int]:
     """
-    Looks for a set of fields arranged in a row.
+    Looks for a set of fields arranged in a row. When the first field name appears more than
+    once, the leftmost, then topmost, occurrence is used.
 
     Arguments:
-        wks_record {dict} -- Dictionary with loaded file and parsed record.
+        wks_record {dict} -- Record and worksheet index.
         header_fields {List[str]} -- Ordered list of field names.
 
     Returns:
         Tuple[int, int] -- 1 based index for the found row's index, 1 based column index of the
-            first values.
-    """
-    header_row = None
-    column = 1
-
-    # Search for the sample information until found,or you run out of space to look.
-    while (
-        not header_row
-        and column < wks_record["wks"].max_column - len(header_fields) + 2
-    ):
-        for cell in wks_record["wks"].iter_rows(
-            min_col=column, max_col=column, max_row=wks_record["wks"].max_column
-        ):
-            value = str(cell[0].value) if cell[0].value else ""
-            if value.lower() == header_fields[0]:
-                header_row = cell[0].row
-                return header_row, column
-        column += 1
-    return header_row, column
+            first values. The row is None if the fields were not found.
+    """
+    index = wks_record["wks"]
+    # The whole row of fields has to fit in the sheet.
+    last_column = index.max_column - len(header_fields) + 1
+    found = [
+        (column, row)
+        for row, column in index.find(header_fields[0])
+        if column <= last_column
+    ]
+    if not found:
+        return None, max(1, last_column + 1)
+    column, row = min(found)
+    return row, column
 
 
 def extract_row_sample(generator: Generator) -> List[dict]:
@@ -573,12 +417,14 @@ def extract_row_sample(generator: Generator) -> List[dict]:
         return entry_list
 
 
-def process_clinical_metadata(path: str, context: RecordContext) -> dict:
+def process_clinical_metadata(
+    source: Union[str, BinaryIO], context: RecordContext
+) -> dict:
     """
     Function for dealing with olink metadata xlsx.
 
     Arguments:
-        path {str} -- File path.
+        source {Union[str, BinaryIO]} -- File path or binary file object.
         context {RecordContext} -- Background information about the trial,
     Returns:
         dict -- Mongo formatted record.
@@ -592,9 +438,16 @@ def process_clinical_metadata(path: str, context: RecordContext) -> dict:
     }
     header_fields = [key for key in SAMPLE_DESCRIPTION]
     try:
-        xlsx_path = add_file_extension(path, "xlsx")
-        # This needs to be adapted to handle multi-sheet workbooks.
-        wks_record = {"record": metadata_record, "wks": load_workbook(xlsx_path).active}
+        with xlsx_source(source) as xlsx:
+            workbook = load_workbook(xlsx, read_only=True)
+            try:
+                # This needs to be adapted to handle multi-sheet workbooks.
+                wks_record = {
+                    "record": metadata_record,
+                    "wks": WorksheetIndex(workbook.active),
+                }
+            finally:
+                workbook.close()
 
         # Handle all information presented in side by side columns of field_name:value type.
         for sub_table in FIELD_NAME_LIST:
@@ -602,6 +455,11 @@ def process_clinical_metadata(path: str, context: RecordContext) -> dict:
 
         # Find the sample row.
         header_row, column = find_row_wise(wks_record, header_fields)
+        if header_row is None:
+            metadata_record["validation_errors"].append(
+                mk_error("Could not find the sample description headers", [])
+            )
+            return metadata_record
 
         # Check to make sure all the expected headers are there.
         validate_row((header_fields, column, header_row), wks_record)
@@ -612,13 +470,71 @@ def process_clinical_metadata(path: str, context: RecordContext) -> dict:
                 min_row=header_row + 1,
                 min_col=column,
                 max_col=column + len(header_fields) - 1,
-                max_row=wks_record["wks"].max_column,
             )
         )
-        lazy_remove(xlsx_path)
         return metadata_record
     except InvalidFileException as err:
-        bad_xlsx(metadata_record["validation_errors"], xlsx_path, err)
+        bad_xlsx(metadata_record["validation_errors"], source_name(source), err)
+
+
+def encode_columnar(olink_record: dict, sample_ids: List[str]) -> dict:
+    """
+    Puts an olink record in the columnar layout: the sample ids are stored once on the record
+    and each assay's results are parallel value, qc_fail and below_lod lists.
+
+    Arguments:
+        olink_record {dict} -- Record whose assay results are arrays.
+        sample_ids {List[str]} -- Sample of each position in the result arrays.
+
+    Returns:
+        dict -- The record, ready to be posted.
+    """
+    for assay in olink_record["ol_assay"]:
+        values, qc_fail, below_lod = result_columns(assay["results"])
+        assay["results"] = {"value": values, "qc_fail": qc_fail, "below_lod": below_lod}
+    olink_record["result_layout"] = "columnar"
+    olink_record["result_sample_ids"] = list(sample_ids)
+    return olink_record
+
+
+def columnar_to_legacy(olink_record: dict) -> dict:
+    """
+    Converts a columnar olink record to the legacy layout, with one result dict per assay and
+    sample. Records already in the legacy layout are returned as is.
+
+    Arguments:
+        olink_record {dict} -- Olink record.
+
+    Returns:
+        dict -- Record in the legacy layout.
+    """
+    if olink_record.get("result_layout") != "columnar":
+        return olink_record
+
+    sample_ids = olink_record["result_sample_ids"]
+    legacy = {
+        key: value
+        for key, value in olink_record.items()
+        if key not in ("result_layout", "result_sample_ids")
+    }
+    legacy["ol_assay"] = [
+        dict(
+            assay,
+            results=[
+                {
+                    "sample_id": sample_id,
+                    "value": value,
+                    "qc_fail": qc_fail,
+                    "below_lod": below_lod,
+                }
+                for sample_id, value, qc_fail, below_lod in zip(
+                    sample_ids, *result_columns(assay["results"])
+                )
+            ],
+        )
+        for assay in olink_record["ol_assay"]
+    ]
+    return legacy
 
 
 def run_validation(olink_record: RecordContext) -> None:
@@ -638,12 +554,86 @@ def run_validation(olink_record: RecordContext) -> None:
         olink_record["validation_errors"].append(invalid_err)
 
 
-def process_olink_npx(path: str, context: RecordContext) -> dict:
+def fill_olink_record(olink_record: dict, sheet: NpxSheet) -> None:
     """
-    Processes an olink npx file and creates a record.
+    Adds the assays and samples of a parsed NPX sheet to an olink record, checks them, and
+    lays the results out as configured by NPX_RESULT_LAYOUT.
 
     Arguments:
-        path {str} -- Location of the file.
+        olink_record {dict} -- Olink record, updated in place.
+        sheet {NpxSheet} -- Parsed sheet.
+
+    Raises:
+        IndexError -- If the sheet has no usable assays.
+
+    Returns:
+        None -- [description]
+    """
+    # Sanity check sample number.
+    olink_record["ol_assay"] = sheet.assays
+    if sheet.assays and not sheet.samples_match:
+        olink_record["validation_errors"].append(
+            mk_error(
+                "There is a mismatch between the number of samples and the"
+                "number of data points for assay %s" % sheet.assays[0]["assay"],
+                ["samples"],
+                raw_or_parse="PARSE",
+                severity="CRITICAL",
+            )
+        )
+        olink_record["ol_assay"] = []
+
+    if olink_record["ol_assay"][0]["panel"]:
+        olink_record["ol_panel_type"] = olink_record["ol_assay"][0]["panel"]
+    else:
+        olink_record["ol_panel_type"] = None
+        olink_record["validation_errors"].append(
+            {
+                "explanation": ("Unable to determine panel type"),
+                "affected_paths": ["ol_panel_type"],
+                "raw_or_parse": "PARSE",
+                "severity": "WARNING",
+            }
+        )
+
+    # Check gene symbols
+    run_validation(olink_record)
+
+    # Get the sample-specific information.
+    olink_record["samples"] = sheet.samples
+
+    # Get NPX Manager Version
+    olink_record["npx_m_ver"] = sheet.version
+
+    encode_columnar(olink_record, sheet.result_sample_ids)
+    if NPX_RESULT_LAYOUT != "columnar":
+        olink_record["ol_assay"] = columnar_to_legacy(olink_record)["ol_assay"]
+        del olink_record["result_layout"], olink_record["result_sample_ids"]
+
+
+def is_zip(source: Union[str, BinaryIO]) -> bool:
+    """
+    Checks whether a file is a zip archive, as xlsx files are, from its first bytes.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- File path or binary file object.
+
+    Returns:
+        bool -- True for zip archives.
+    """
+    with binary_file(source) as handle:
+        magic = handle.read(len(ZIP_MAGIC))
+    rewound(source)
+    return magic == ZIP_MAGIC
+
+
+def process_olink_long(source: Union[str, BinaryIO], context: RecordContext) -> dict:
+    """
+    Processes an olink npx export in long format, a CSV or TSV file with one row per sample
+    and assay, and creates the same record process_olink_npx builds from a workbook.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Location of the file or binary file object.
         context {RecordContext} -- Context object containing assay/trial/parent record ID.
 
     Returns:
@@ -655,21 +645,94 @@ def process_olink_npx(path: str, context: RecordContext) -> dict:
         "record_id": context.record,
         "validation_errors": [],
     }
-    xlsx_path = add_file_extension(path, "xlsx")
-
     try:
-        # Load workbook, create iterators to figure out where the relevant information is stored.
-        wks = load_workbook(xlsx_path).active
-        wks_record = {"record": olink_record, "wks": wks}
-
-        olink_row = validate_column((OLINK_FIRST_COLUMN, 1), wks_record)[1]
-        cell_gen = wks.iter_rows(max_col=1, min_row=olink_row + 1)
-        # Big function to generate a bunch of important information.
-        samples_start_row, samples_end_row, mdf_row, sample_ids = process_sample_rows(
-            cell_gen
+        sheet, duplicates = read_npx_long(source)
+        if duplicates:
+            olink_record["validation_errors"].append(
+                mk_error(
+                    "%s rows repeat a sample and assay already seen, the last value was kept"
+                    % duplicates,
+                    ["ol_assay"],
+                )
+            )
+        fill_olink_record(olink_record, sheet)
+    except ValueError as err:
+        log = "Error loading file %s as a long format NPX table. Error message: %s" % (
+            source_name(source),
+            str(err),
         )
+        logging.warning({"message": log, "category": "WARNING-CELERY-FAIR-IMPORT"})
+        olink_record["validation_errors"].append(
+            mk_error(
+                "The file could not be read as a long format NPX table: %s" % str(err),
+                [],
+                raw_or_parse="RAW",
+                severity="CRITICAL",
+            )
+        )
+    except IndexError:
+        log = "Error processing the file"
+        logging.error({"message": log, "category": "ERROR-CELERY-FAIR-IMPORT"})
+        olink_record["validation_errors"].append(
+            mk_error(
+                "An index that does not exist was accessed.", [], severity="CRITICAL"
+            )
+        )
+    return olink_record
+
+
+def process_olink_npx(source: Union[str, BinaryIO], context: RecordContext) -> dict:
+    """
+    Processes an olink npx file and creates a record. Files that are not workbooks are
+    handed to process_olink_long.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Location of the file or binary file object.
+        context {RecordContext} -- Context object containing assay/trial/parent record ID.
+
+    Returns:
+        dict -- Olink data formatted for mongodb.
+    """
+    if not is_zip(source):
+        return process_olink_long(source, context)
+
+    olink_record = {
+        "trial": context.trial,
+        "assay": context.assay,
+        "record_id": context.record,
+        "validation_errors": [],
+    }
+    try:
+        # Read the sheet once, in read-only mode, then validate what was found.
+        with xlsx_source(source) as xlsx:
+            workbook = load_workbook(xlsx, read_only=True)
+            try:
+                sheet = read_npx_sheet(workbook.active, OLINK_FIRST_COLUMN)
+            finally:
+                workbook.close()
+
+        if sheet.first_column is None:
+            olink_record["validation_errors"].append(
+                mk_error(
+                    "Could not find a column matching the provided description. "
+                    "Affected Column: 1",
+                    [],
+                )
+            )
+            raise IndexError
+        if sheet.first_column != OLINK_FIRST_COLUMN:
+            diff = diff_fields(sheet.first_column, OLINK_FIRST_COLUMN)
+            olink_record["validation_errors"].append(
+                mk_error(
+                    "Values of column did not match expected values. Missing: %s"
+                    % ", ".join(diff)
+                    if diff
+                    else "None",
+                    diff,
+                )
+            )
 
-        if not mdf_row:
+        if not sheet.has_mdf:
             olink_record["validation_errors"].append(
                 {
                     "explanation": (
@@ -682,73 +745,10 @@ def process_olink_npx(path: str, context: RecordContext) -> dict:
                 }
             )
 
-        # Get all of the data needed to create the "assay" objects.
-        olink_record["ol_assay"] = extract_assay_data(
-            AssayColumn(
-                wks.iter_cols(
-                    min_col=2,
-                    max_col=wks.max_column - 2,
-                    min_row=olink_row - 3,
-                    max_row=olink_row,
-                ),
-                wks.iter_cols(
-                    min_col=2,
-                    max_col=wks.max_column - 2,
-                    min_row=mdf_row - 1,
-                    max_row=mdf_row,
-                ),
-                wks.iter_cols(
-                    min_col=2,
-                    max_col=wks.max_column - 2,
-                    min_row=samples_start_row,
-                    max_row=samples_end_row,
-                ),
-            ),
-            sample_ids,
-            olink_record["validation_errors"],
-        )
-
-        if olink_record["ol_assay"][0]["panel"]:
-            olink_record["ol_panel_type"] = olink_record["ol_assay"][0]["panel"]
-        else:
-            olink_record["ol_panel_type"] = None
-            olink_record["validation_errors"].append(
-                {
-                    "explanation": ("Unable to determine panel type"),
-                    "affected_paths": ["ol_panel_type"],
-                    "raw_or_parse": "PARSE",
-                    "severity": "WARNING",
-                }
-            )
-
-        # Check gene symbols
-        run_validation(olink_record)
-
-        # Get the sample-specific information.
-        olink_record["samples"] = validate_qc_info(
-            SampleInfo(
-                wks.iter_cols(
-                    min_col=wks.max_column - 1,
-                    max_col=wks.max_column,
-                    min_row=samples_start_row,
-                    max_row=samples_end_row,
-                ),
-                wks.iter_cols(
-                    min_col=wks.max_column,
-                    max_col=wks.max_column,
-                    min_row=samples_start_row,
-                    max_row=samples_end_row,
-                ),
-                sample_ids,
-            ),
-            olink_record["validation_errors"],
-        )
-
-        # Get NPX Manager Version
-        olink_record["npx_m_ver"] = wks["B1"].value
+        fill_olink_record(olink_record, sheet)
 
     except InvalidFileException as err:
-        bad_xlsx(olink_record["validation_errors"], xlsx_path, err)
+        bad_xlsx(olink_record["validation_errors"], source_name(source), err)
     except IndexError:
         log = "Error processing the file"
         logging.error({"message": log, "category": "ERROR-CELERY-FAIR-IMPORT"})
@@ -757,7 +757,6 @@ def process_olink_npx(path: str, context: RecordContext) -> dict:
                 "An index that does not exist was accessed.", [], severity="CRITICAL"
             )
         )
-    lazy_remove(xlsx_path)
     rec_str = str(olink_record)
     logging.info({"message": rec_str, "category": "DEBUG-NPX"})
     return olink_record
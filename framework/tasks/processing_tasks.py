@@ -5,33 +5,68 @@ Module for tasks that do post-run processing of output files.
 __author__ = "Lloyd McCarthy"
 __license__ = "MIT"
 
-import datetime
 import json
 import logging
-import re
-import subprocess
-import time
-from os import remove
-from typing import List
-from uuid import uuid4
+from io import BytesIO, TextIOWrapper
+from tempfile import SpooledTemporaryFile
+from types import GeneratorType
+from typing import BinaryIO, Generator, Iterable, List, Optional, Tuple, Union
 
 from cidc_utils.requests import SmartFetch
+from google.api_core.exceptions import GoogleAPIError
 from cidc_utils.loghandler.stack_driver_handler import log_formatted
-from dateutil import parser
 
 from framework.celery.celery import APP
 from framework.tasks.authorized_task import AuthorizedTask
+from framework.tasks.child_links import ChildLinkAggregator
+from framework.tasks.cpu_pool import CpuPool
 from framework.tasks.data_classes import RecordContext
+from framework.tasks.eve_query import iter_where_in
 from framework.tasks.parallelize_tasks import execute_in_parallel
+from framework.tasks.object_store import binary_file, get_store
 from framework.tasks.process_npx import (
     mk_error,
     process_clinical_metadata,
+    process_olink_long,
     process_olink_npx,
 )
-from framework.tasks.storage_tasks import run_subprocess_with_logs
-from framework.tasks.variables import EVE_URL
+from framework.tasks.processor_registry import Processor, ProcessorRegistry
+from framework.tasks.result_cache import DiskResultCache
+from framework.tasks.table_engine import iter_typed_records
+from framework.tasks.variables import (
+    CHILD_LINK_JOURNAL_DIR,
+    CHILD_LINK_MAX,
+    CHILD_LINK_WINDOW,
+    CPU_POOL_MAX_TASKS,
+    CPU_POOL_PROCESSES,
+    CPU_POOL_TIMEOUT,
+    DOWNLOAD_SPOOL_LIMIT,
+    EVE_URL,
+    MAF_LEASE_TTL,
+    MAF_MERGE_DELAY,
+    RESULT_CACHE_DIR,
+    RESULT_CACHE_MAX_BYTES,
+    TABLE_BLOCK_ROWS,
+    TABLE_ENGINE,
+    TABLE_PAGE_SIZE,
+    TABLE_PATTERNS,
+)
 
 EVE_FETCHER = SmartFetch(EVE_URL)
+MAF_PATCH_ATTEMPTS = 5
+CHILD_LINK_ATTEMPTS = 5
+CPU_POOL = CpuPool(
+    CPU_POOL_PROCESSES,
+    CPU_POOL_MAX_TASKS,
+    CPU_POOL_TIMEOUT,
+    ["numpy", "pandas", "openpyxl", "framework.tasks.process_npx"],
+)
+CPU_POOL.close_on_shutdown()
+RESULT_CACHE = (
+    DiskResultCache(RESULT_CACHE_DIR, RESULT_CACHE_MAX_BYTES)
+    if RESULT_CACHE_MAX_BYTES > 0
+    else None
+)
 
 
 def add_record_context(records: List[dict], context: RecordContext) -> None:
@@ -55,12 +90,15 @@ def add_record_context(records: List[dict], context: RecordContext) -> None:
         )
 
 
-def process_table(path: str, context: RecordContext) -> List[dict]:
+def iter_table(
+    source: Union[str, BinaryIO], context: RecordContext
+) -> Generator[dict, None, None]:
     """
-    Processes any table format data assuming the first row is a header row.
+    Lazily parses any table format data assuming the first row is a header row. Rows are
+    yielded one at a time so callers never hold more than they ask for.
 
     Arguments:
-        path {str} -- Path to file.
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
         context {RecordContext} -- Context object containing assay/trial/parentID.
 
     Raises:
@@ -68,38 +106,153 @@ def process_table(path: str, context: RecordContext) -> List[dict]:
             values in a row
 
     Returns:
-        List[dict] -- List of entries, where each row becomes a mongo record.
+        Generator[dict, None, None] -- Generator of entries, where each row becomes a mongo
+            record.
     """
     first_line = False
-    entries = []
-    with open(path, "r", 8192) as table:
-        column_headers = []
-        for line in table:
-            if line[0] != "#" and not first_line:
-                first_line = True
-                column_headers = [
-                    header.strip().replace('"', "").replace(".", "")
-                    for header in line.split("\t")
-                ]
-            elif first_line:
-                values = line.split("\t")
-                if not len(column_headers) == len(values):
-                    logging.error(
-                        {
-                            "message": "Header and value length mismatch!",
-                            "category": "ERROR-CELERY-PROCESSING",
-                        }
-                    )
-                    raise IndexError
-                entries.append(
-                    dict(
-                        (column_headers[i], values[i].strip().replace('"', ""))
-                        for i, j in enumerate(values)
+    with binary_file(source) as handle:
+        table = TextIOWrapper(handle, encoding="utf-8")
+        try:
+            column_headers = []
+            for line in table:
+                if line[0] != "#" and not first_line:
+                    first_line = True
+                    column_headers = [
+                        header.strip().replace('"', "").replace(".", "")
+                        for header in line.split("\t")
+                    ]
+                elif first_line:
+                    values = line.split("\t")
+                    if not len(column_headers) == len(values):
+                        logging.error(
+                            {
+                                "message": "Header and value length mismatch!",
+                                "category": "ERROR-CELERY-PROCESSING",
+                            }
+                        )
+                        raise IndexError
+                    entry = dict(
+                        (column_headers[i], value.strip().replace('"', ""))
+                        for i, value in enumerate(values)
                     )
-                )
+                    add_record_context([entry], context)
+                    yield entry
+        finally:
+            # Hand the file back to its owner open.
+            table.detach()
+
+
+def iter_typed_table(
+    source: Union[str, BinaryIO], context: RecordContext
+) -> Generator[dict, None, None]:
+    """
+    Lazily parses table format data with the columnar engine, which emits int, float and
+    bool values instead of strings.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
+        context {RecordContext} -- Context object containing assay/trial/parentID.
+
+    Returns:
+        Generator[dict, None, None] -- Generator of entries, where each row becomes a mongo
+            record.
+    """
+    record_context = {
+        "trial": context.trial,
+        "assay": context.assay,
+        "record_id": context.record,
+    }
+    for entry in iter_typed_records(source, TABLE_BLOCK_ROWS):
+        entry.update(record_context)
+        yield entry
+
+
+# Parsers available to process_table, keyed by the name used in TABLE_ENGINE.
+TABLE_ENGINES = {"python": iter_table, "typed": iter_typed_table}
+
+
+def process_table(
+    source: Union[str, BinaryIO],
+    context: RecordContext,
+    stream: bool = False,
+    engine: str = None,
+):
+    """
+    Processes any table format data assuming the first row is a header row.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
+        context {RecordContext} -- Context object containing assay/trial/parentID.
+
+    Keyword Arguments:
+        stream {bool} -- If true, return a generator of rows instead of a list, so that the
+            caller can upload the table page by page. (default: {False})
+        engine {str} -- Key of TABLE_ENGINES to parse with, "typed" or "python".
+            (default: {TABLE_ENGINE})
+
+    Raises:
+        IndexError -- Will be thrown if there is some mismatch number of headers and number of
+            values in a row
 
-    add_record_context(entries, context)
-    return entries
+    Returns:
+        Union[List[dict], Generator[dict, None, None]] -- Entries, where each row becomes a
+            mongo record.
+    """
+    rows = TABLE_ENGINES[engine or TABLE_ENGINE](source, context)
+    if stream:
+        return rows
+    return list(rows)
+
+
+def paginate(records: Iterable[dict], page_size: int) -> Generator[List[dict], None, None]:
+    """
+    Groups an iterable of records into fixed size pages. Only one page is held in memory at
+    a time.
+
+    Arguments:
+        records {Iterable[dict]} -- Records, typically a generator.
+        page_size {int} -- Maximum number of records per page.
+
+    Returns:
+        Generator[List[dict], None, None] -- Generator of pages, the last one may be short.
+    """
+    page = []
+    for record in records:
+        page.append(record)
+        if len(page) >= page_size:
+            yield page
+            page = []
+    if page:
+        yield page
+
+
+def combined_maf_uri(gs_uri: str) -> str:
+    """
+    Gets the location of the combined maf that a maf belongs to.
+
+    Arguments:
+        gs_uri {str} -- Location of a maf.
+
+    Returns:
+        str -- Location of combined.maf in the same directory.
+    """
+    return gs_uri.rsplit("/", 1)[0] + "/combined.maf"
+
+
+def combined_maf_query(trial: str, assay: str) -> str:
+    """
+    Builds the query that finds the combined maf record of a trial/assay.
+
+    Arguments:
+        trial {str} -- Trial id.
+        assay {str} -- Assay id.
+
+    Returns:
+        str -- Query string for the data endpoint.
+    """
+    return "data?where=%s" % json.dumps(
+        {"trial": trial, "assay": assay, "file_name": "combined.maf"}
+    )
 
 
 def reformat_maf(new_record: dict, context: RecordContext) -> dict:
@@ -127,110 +280,110 @@ def reformat_maf(new_record: dict, context: RecordContext) -> dict:
     new_record["processed"] = True
 
     # Generate new alias for combined maf.
-    new_record["gs_uri"] = (
-        new_record["gs_uri"].replace(new_record["file_name"], "") + "combined.maf"
-    )
+    new_record["gs_uri"] = combined_maf_uri(new_record["gs_uri"])
     return new_record
 
 
-def combine_mafs(path: str, combined_file_name: str) -> None:
+def write_maf_body(source: Union[str, BinaryIO], outfile: BinaryIO) -> None:
     """
-    Takes an existing maf, then writes a second maf file to it.
+    Writes the data rows of a maf to an open file, skipping the "#" header lines and the
+    column header row.
 
     Arguments:
-        path {str} -- Path to existing combined maf.
-        combined_file_name {str} -- Path to write out to.
+        source {Union[str, BinaryIO]} -- Path of the maf or binary file object.
+        outfile {BinaryIO} -- File opened for binary writing.
 
     Returns:
         None -- [description]
     """
-    with open(combined_file_name, "a") as outfile, open(path, "r") as new_maf:
+    with binary_file(source) as new_maf:
         line = new_maf.readline()
-        while line[0] == "#":
-            line = new_maf.readline()
-        while line:
-            outfile.write(new_maf.readline())
+        while line and line[:1] == b"#":
             line = new_maf.readline()
+        # The first line that isn't a comment is the column header row.
+        for line in new_maf:
+            outfile.write(line)
 
 
-def create_new_maf(path: str, context: RecordContext, token: str) -> bool:
+def combine_mafs(path: str, combined_file_name: str) -> None:
     """
-    Create a new combined MAF.
+    Takes an existing maf, then writes a second maf file to it.
 
     Arguments:
-        path {str} -- path to file
-        context {RecordContext} -- Object holding the record.
+        path {str} -- Path to the maf being added.
+        combined_file_name {str} -- Path to write out to.
 
     Returns:
-        bool -- True if succeeds, else false.
+        None -- [description]
     """
-    new_record = context.full_record
+    with open(combined_file_name, "ab") as outfile:
+        write_maf_body(path, outfile)
 
-    # Check for other analyses that finished recently.
-    an_query = "analysis?where=%s" % json.dumps(
-        {"trial": context.trial, "assay": context.assay, "status": "Completed"}
-    )
-    analysis_runs = EVE_FETCHER.get(endpoint=an_query, token=token).json()["_items"]
-    isotime = datetime.datetime.now(datetime.timezone.utc)
-
-    my_end = 0
-    my_run_id = None
-    for run in analysis_runs:
-        for output in run["files_generated"]:
-            if output["file_name"] == new_record["file_name"]:
-                my_end = parser.parse(run["end_date"])
-                my_run_id = run["_id"]
-
-    # If the time is close enough that the trial might not have cleaned up yet,
-    # wait, then retry.
-    for run in analysis_runs:
-        end = parser.parse(run["end_date"])
-        delta = (isotime - end).total_seconds()
-        if run["_id"] != my_run_id and delta < 30:
-            log_formatted(
-                logging.info,
-                "Another run ended recently, running checks to avoid race condition.",
-                "INFO-CELERY-MAF",
-            )
-            if (
-                my_end > end
-                or my_end == end
-                and min(my_run_id, run["_id"]) == my_run_id
-            ):
-                log_formatted(
-                    logging.info,
-                    "Detecting an older finished run. Sleeping",
-                    "INFO-CELERY-SLEEP",
-                )
-                time.sleep(5)
-                process_maf(path, context)
-                return True
 
-    # Rename and create a new data entry.
-    reformat_maf(new_record, context)
+def process_maf(source: Union[str, BinaryIO], context: RecordContext) -> bool:
+    """
+    Queues a new maf file to be merged into the combined maf. Only the data rows are queued,
+    the merge itself is done by merge_maf_queue.
 
-    # Generate new alias for combined maf.
-    new_record["gs_uri"] = (
-        new_record["gs_uri"].replace(new_record["file_name"], "") + "/combined.maf"
-    )
-    run_subprocess_with_logs(
-        ["gsutil", "mv", path, new_record["gs_uri"]],
-        message="Copying new combined.maf to google bucket: %s" % new_record["gs_uri"],
-    )
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path of the file or binary file object.
+        context {RecordContext} -- Class holding trial, assay, and a copy of the record.
 
-    try:
-        remove(path)
-    except FileNotFoundError:
-        pass
+    Returns:
+        bool -- True if finished without error, else false.
+    """
+    if context.full_record["file_name"] == "combined.maf":
+        return True
 
-    log_formatted(
-        logging.info,
-        "Copying for new combined.maf: %s complete." % new_record["gs_uri"],
-        "FAIR-CELERY-NEWCOMBINEDMAF",
+    combined_uri = combined_maf_uri(context.full_record["gs_uri"])
+    with SpooledTemporaryFile(max_size=DOWNLOAD_SPOOL_LIMIT) as fragment:
+        write_maf_body(source, fragment)
+        get_store(combined_uri).push_pending(
+            combined_uri + ".queue",
+            fragment,
+            {
+                "record_id": context.record,
+                "source_uri": context.full_record["gs_uri"],
+                "sample_ids": context.full_record["sample_ids"],
+            },
+        )
+
+    # The delay lets a burst of uploads pile up so they are merged in one cycle.
+    merge_maf_queue.apply_async(
+        (context.trial, context.assay, combined_uri), countdown=MAF_MERGE_DELAY
     )
+    return True
+
+
+def create_combined_maf(
+    context: RecordContext, combined_uri: str, sample_ids: List[str], token: str
+) -> bool:
+    """
+    Creates the record for a new combined maf, based on the record of its first maf.
+
+    Arguments:
+        context {RecordContext} -- Trial, assay and id of the first maf's record.
+        combined_uri {str} -- Location of the new combined maf.
+        sample_ids {List[str]} -- Samples in the combined maf.
+        token {str} -- JWT
 
+    Returns:
+        bool -- True if succeeds, else false.
+    """
     try:
+        first_maf = EVE_FETCHER.get(
+            endpoint="data?where=%s" % json.dumps({"_id": context.record}), token=token
+        ).json()["_items"][0]
+        new_record = reformat_maf(first_maf, context)
+        new_record["gs_uri"] = combined_uri
+        new_record["sample_ids"] = sample_ids
+        new_record["number_of_samples"] = len(sample_ids)
         EVE_FETCHER.post(endpoint="data_edit", token=token, json=new_record, code=201)
+        log_formatted(
+            logging.info,
+            "Created new combined.maf: %s" % combined_uri,
+            "FAIR-CELERY-NEWCOMBINEDMAF",
+        )
         return True
     except RuntimeError as rte:
         log_formatted(
@@ -241,82 +394,181 @@ def create_new_maf(path: str, context: RecordContext, token: str) -> bool:
         return False
 
 
-def process_maf(path: str, context: RecordContext) -> bool:
+def merge_pending_mafs(
+    trial: str, assay: str, combined_uri: str, pending: List[Tuple[str, dict]], token: str
+) -> bool:
     """
-    Processes a new maf file to update the combined maf.
+    Merges every queued maf into the combined maf in one compose cycle, then makes a single
+    update to the combined maf's record. Must only be called while holding the lease.
+
+    The samples being merged are queued again first, as an empty entry that is deleted once
+    the record lists them. A cycle that fails after the mafs were appended therefore leaves
+    nothing to append again, but the next one still adds their samples to the record.
 
     Arguments:
-        path {str} -- On disk path of the file.
-        context {RecordContext} -- Class holding trial, assay, and a copy of the record.
+        trial {str} -- Trial id.
+        assay {str} -- Assay id.
+        combined_uri {str} -- Location of the combined maf.
+        pending {List[Tuple[str, dict]]} -- Queued fragments and their metadata.
+        token {str} -- JWT
 
     Returns:
         bool -- True if finished without error, else false.
     """
-    if context.full_record["file_name"] == "combined.maf":
-        return True
-
-    token = process_file.token["access_token"]
-    # Check if a combined maf already exists.
-    query_string = "data?where=%s" % json.dumps(
-        {"trial": context.trial, "assay": context.assay, "file_name": "combined.maf"}
+    store = get_store(combined_uri)
+    query_string = combined_maf_query(trial, assay)
+    first_metadata = pending[0][1]
+    sample_ids = list(
+        dict.fromkeys(
+            sample_id for _, metadata in pending for sample_id in metadata["sample_ids"]
+        )
     )
-
     extant_combined_maf = EVE_FETCHER.get(endpoint=query_string, token=token).json()[
         "_items"
     ]
+    carry_uri = store.push_pending(
+        combined_uri + ".queue",
+        BytesIO(),
+        {
+            "record_id": first_metadata["record_id"],
+            "source_uri": None,
+            "sample_ids": sample_ids,
+        },
+    )
 
-    if not extant_combined_maf:
-        create_new_maf(path, context, token)
-        return True
+    # A combined maf without a record was started by a cycle that failed, so it is
+    # appended to rather than overwritten.
+    if store.fingerprint(combined_uri) is None:
+        # The first maf keeps its headers and becomes the start of the combined maf.
+        first_uri, first_source = next(
+            (uri, metadata["source_uri"])
+            for uri, metadata in pending
+            if metadata["source_uri"]
+        )
+        store.copy(first_source, combined_uri)
+        store.delete(first_uri)
+        pending = [entry for entry in pending if entry[0] != first_uri]
+    store.concat(combined_uri, [uri for uri, _ in pending])
 
-    combined_maffile = extant_combined_maf[0]
-    maf_gs_uri = combined_maffile["gs_uri"]
-    combined_file_name = str(uuid4())
-    run_subprocess_with_logs(
-        ["gsutil", "mv", maf_gs_uri, combined_file_name],
-        message="Copying combined maf file %s" % maf_gs_uri,
-    )
+    if extant_combined_maf:
+        log_formatted(
+            logging.info,
+            "Merged %s mafs into combined.maf: %s" % (len(pending), combined_uri),
+            "FAIR-CELERY-COMBINEDMAF",
+        )
+        recorded = add_combined_samples(
+            query_string, extant_combined_maf[0], sample_ids, token
+        )
+    else:
+        recorded = create_combined_maf(
+            RecordContext(trial, assay, first_metadata["record_id"]),
+            combined_uri,
+            sample_ids,
+            token,
+        )
+    if recorded:
+        store.delete(carry_uri)
+    return recorded
 
-    # Combine mafs.
-    combine_mafs(path, combined_file_name)
 
-    # Overwrite old file.
-    run_subprocess_with_logs(
-        ["gsutil", "mv", combined_file_name, maf_gs_uri],
-        message="Overwriting old combined.maf: %s" % maf_gs_uri,
-    )
-    log_formatted(
-        logging.info,
-        "Overwriting old combined.maf: %s" % maf_gs_uri,
-        "FAIR-CELERY-COMBINEDMAF",
-    )
-    new_sample_ids = combined_maffile["sample_ids"] + context.full_record["sample_ids"]
+@APP.task(base=AuthorizedTask, bind=True)
+def merge_maf_queue(self, trial: str, assay: str, combined_uri: str) -> int:
+    """
+    Drains the queue of mafs waiting to be merged into a combined maf. Only the holder of
+    the combined maf's lease merges. Any other call returns straight away, as the holder
+    checks the queue again after releasing the lease and picks up what arrived meanwhile.
+    A failed merge leaves its mafs queued and the task is retried.
 
-    # Patch data to include new samples.
-    try:
-        EVE_FETCHER.patch(
-            endpoint="data_edit",
-            item_id=combined_maffile["_id"],
-            _etag=combined_maffile["_etag"],
-            json={
-                "sample_ids": new_sample_ids,
-                "number_of_samples": len(new_sample_ids),
-            },
-            token=token,
-        )
-        return True
-    except RuntimeError as rte:
-        if "412" in str(rte):
-            time.sleep(5)
-            process_maf(path, context)
+    Arguments:
+        trial {str} -- Trial id.
+        assay {str} -- Assay id.
+        combined_uri {str} -- Location of the combined maf.
+
+    Returns:
+        int -- Number of mafs merged by this call.
+    """
+    store = get_store(combined_uri)
+    queue_uri = combined_uri + ".queue"
+    lease_uri = combined_uri + ".lease"
+    merged = 0
+
+    while store.list_pending(queue_uri):
+        lease = store.acquire_lease(lease_uri, MAF_LEASE_TTL)
+        if not lease:
+            break
+        try:
+            pending = store.list_pending(queue_uri)
+            if pending and not merge_pending_mafs(
+                trial, assay, combined_uri, pending, self.token["access_token"]
+            ):
+                raise RuntimeError("The combined.maf record was not updated")
+            merged += len(pending)
+        except (RuntimeError, OSError, GoogleAPIError) as err:
+            log_formatted(
+                logging.error,
+                "Failed to merge mafs into %s, retrying: %s" % (combined_uri, str(err)),
+                "ERROR-CELERY-COMBINEDMAF",
+            )
+            raise self.retry(exc=err, countdown=MAF_MERGE_DELAY)
+        finally:
+            store.release_lease(lease_uri, lease)
+
+    return merged
+
+
+def add_combined_samples(
+    query_string: str, combined_maffile: dict, sample_ids: List[str], token: str
+) -> bool:
+    """
+    Patches the combined maf record to include new samples. On an etag conflict the record
+    is fetched again and the patch retried, the file itself is not touched again. Samples
+    the record already lists are not added twice.
+
+    Arguments:
+        query_string {str} -- Query that finds the combined maf record.
+        combined_maffile {dict} -- Combined maf record as last fetched.
+        sample_ids {List[str]} -- Samples that were appended.
+        token {str} -- JWT
+
+    Returns:
+        bool -- True if the record was updated, else false.
+    """
+    for _ in range(MAF_PATCH_ATTEMPTS):
+        new_sample_ids = combined_maffile["sample_ids"] + [
+            sample_id
+            for sample_id in sample_ids
+            if sample_id not in combined_maffile["sample_ids"]
+        ]
+        try:
+            EVE_FETCHER.patch(
+                endpoint="data_edit",
+                item_id=combined_maffile["_id"],
+                _etag=combined_maffile["_etag"],
+                json={
+                    "sample_ids": new_sample_ids,
+                    "number_of_samples": len(new_sample_ids),
+                },
+                token=token,
+            )
             return True
+        except RuntimeError as rte:
+            if "412" not in str(rte):
+                log_formatted(
+                    logging.error,
+                    "Failed to edit combined.maf: %s" % str(rte),
+                    "ERROR-CELERY-PATCH",
+                )
+                return False
+            combined_maffile = EVE_FETCHER.get(
+                endpoint=query_string, token=token
+            ).json()["_items"][0]
 
-        log_formatted(
-            logging.error,
-            "Failed to edit combined.maf: %s" % str(rte),
-            "ERROR-CELERY-PATCH",
-        )
-        return False
+    log_formatted(
+        logging.error,
+        "Gave up editing combined.maf after %s etag conflicts" % MAF_PATCH_ATTEMPTS,
+        "ERROR-CELERY-PATCH",
+    )
+    return False
 
 
 def log_record_upload(records: List[dict], endpoint: str) -> None:
@@ -379,20 +631,94 @@ def report_validation_issues(response: dict, records: List[dict]) -> List[dict]:
     return new_upload
 
 
-def update_child_list(record_response: dict, endpoint: str, parent_id: str) -> dict:
+def patch_children(parent_id: str, new_children: List[dict]) -> bool:
+    """
+    Adds children to a data record's child list with a single patch. On an etag conflict the
+    parent is fetched again and the new children merged into its current list.
+
+    Arguments:
+        parent_id {str} -- id of parent record.
+        new_children {List[dict]} -- Child entries to add.
+
+    Returns:
+        bool -- True if the child list was updated, else false, also when the parent does
+            not exist.
+    """
+    query = "data?where=%s" % json.dumps({"_id": parent_id})
+    for _ in range(CHILD_LINK_ATTEMPTS):
+        parent = None
+        try:
+            parent = EVE_FETCHER.get(
+                endpoint=query, token=process_file.token["access_token"]
+            ).json()["_items"][0]
+            known = set(str(child["_id"]) for child in parent["children"])
+            EVE_FETCHER.patch(
+                endpoint="data_edit",
+                item_id=str(parent["_id"]),
+                json={
+                    "children": parent["children"]
+                    + [
+                        child
+                        for child in new_children
+                        if str(child["_id"]) not in known
+                    ]
+                },
+                _etag=parent["_etag"],
+                token=process_file.token["access_token"],
+            )
+            return True
+        except IndexError:
+            log_formatted(
+                logging.error,
+                "Parent %s was not found" % parent_id,
+                "ERROR-CELERY-GET",
+            )
+            return False
+        except RuntimeError as code_error:
+            if not parent:
+                log_formatted(
+                    logging.error,
+                    "Error fetching parent %s" % str(code_error),
+                    "ERROR-CELERY-GET",
+                )
+                return False
+            if "412" not in str(code_error):
+                log_formatted(
+                    logging.error,
+                    "Error updating child list of parent: %s" % str(code_error),
+                    "ERROR-CELERY-PATCH-FAIR",
+                )
+                return False
+
+    log_formatted(
+        logging.error,
+        "Gave up updating child list of %s after %s etag conflicts"
+        % (parent_id, CHILD_LINK_ATTEMPTS),
+        "ERROR-CELERY-PATCH-FAIR",
+    )
+    return False
+
+
+CHILD_LINKS = ChildLinkAggregator(
+    patch_children, CHILD_LINK_WINDOW, CHILD_LINK_MAX, CHILD_LINK_JOURNAL_DIR
+)
+CHILD_LINKS.flush_on_shutdown()
+
+
+def update_child_list(
+    record_response: dict, endpoint: str, parent_id: str
+) -> List[dict]:
     """
-    Adds item to a record's child list.
+    Queues newly created records to be added to their parent's child list. Links are
+    flushed in batches, one patch per parent.
 
     Arguments:
         record_response {dict} -- Response to POST of new child.
         endpoint {str} -- Resource endpoint of record.
         parent_id {str} -- id of parent record.
 
-    Raises:
-        RuntimeError -- [description]
-
     Returns:
-        dict -- HTTP response to patch.
+        List[dict] -- Child entries that were queued.
     """
     records = None
 
@@ -405,35 +731,8 @@ def update_child_list(record_response: dict, endpoint: str, parent_id: str) -> d
     for record in records:
         new_children.append({"_id": record["_id"], "resource": endpoint})
 
-    try:
-        # Get etag of parent.
-        parent = EVE_FETCHER.get(
-            endpoint="data?where=%s" % json.dumps({"_id": parent_id}),
-            token=process_file.token["access_token"],
-        ).json()
-
-        # Update parent record.
-        return EVE_FETCHER.patch(
-            endpoint="data_edit",
-            item_id=str(parent["_items"][0]["_id"]),
-            json={"children": parent["_items"][0]["children"] + new_children},
-            _etag=parent["_items"][0]["_etag"],
-            token=process_file.token["access_token"],
-        )
-    except RuntimeError as code_error:
-        if not parent:
-            log_formatted(
-                logging.error,
-                "Error fetching parent %s" % str(code_error),
-                "ERROR-CELERY-GET",
-            )
-        else:
-            log_formatted(
-                logging.error,
-                "Error updating child list of parent: %s" % str(code_error),
-                "ERROR-CELERY-PATCH-FAIR",
-            )
-        return None
+    CHILD_LINKS.add(parent_id, new_children)
+    return new_children
 
 
 # This is a dictionary of all the currently supported filetypes for storage in
@@ -441,79 +740,59 @@ def update_child_list(record_response: dict, endpoint: str, parent_id: str) -> d
 # filename, 'func' being the function used to create the mongo object and
 # the key indicating the API endpoint the records are posted to. The mongo key
 # indicates whether or not the filetype should be converted to mongo records.
-PROC = {
-    "olink": {"re": r"olink.*npx", "func": process_olink_npx, "mongo": True},
-    "olink_meta": {
-        "re": r"olink.*biorepository",
-        "func": process_clinical_metadata,
-        "mongo": True,
-    },
-    "maf": {"re": r".maf$", "func": process_maf, "mongo": False},
-}
+PROC = ProcessorRegistry()
+PROC.register(
+    "olink_long",
+    [r"olink.*npx.*\.(?:csv|tsv|txt)$"],
+    process_olink_long,
+    endpoint="olink",
+)
+PROC.register("olink", [r"olink.*npx"], process_olink_npx)
+PROC.register("olink_meta", [r"olink.*biorepository"], process_clinical_metadata)
+PROC.register("maf", [r".maf$"], process_maf, mongo=False, resource_class="io")
+if TABLE_PATTERNS:
+    PROC.register("table", TABLE_PATTERNS, process_table, stream=True)
 
 
-@APP.task(base=AuthorizedTask)
-def process_file(rec: dict, pro: str) -> bool:
+def upload_records(
+    records: List[dict], endpoint: str, parent_id: str, children: List[dict] = None
+) -> bool:
     """
-    Worker process that handles processing an individual file.
+    Posts a batch of records to the API and ties them to their parent. If the batch fails
+    schema validation, the validation errors are uploaded instead.
 
     Arguments:
-        rec {dict} -- A record item to be processed.
-        pro {str} -- Key in the processing dictionary that the filetype
-        corresponds to.
+        records {List[dict]} -- Records to upload.
+        endpoint {str} -- API endpoint the records are posted to.
+        parent_id {str} -- id of the data record the records were generated from.
+
+    Keyword Arguments:
+        children {List[dict]} -- If given, child entries of the uploaded records are
+            appended to it. (default: {None})
 
     Returns:
-        boolean -- True if completed without error, else false.
+        bool -- True if the records were uploaded, else false.
     """
-    temp_file_name = str(uuid4())
-    gs_args = ["gsutil", "cp", rec["gs_uri"], temp_file_name]
-    subprocess.run(gs_args)
-    records = None
     response = None
-
-    try:
-        # Use a random filename as tasks are executing in parallel.
-        if PROC[pro]["mongo"]:
-            records = PROC[pro]["func"](
-                temp_file_name,
-                RecordContext(
-                    rec["trial"]["$oid"], rec["assay"]["$oid"], rec["_id"]["$oid"]
-                ),
-            )
-        else:
-            PROC[pro]["func"](
-                temp_file_name,
-                RecordContext(
-                    rec["trial"]["$oid"], rec["assay"]["$oid"], rec["_id"]["$oid"], rec
-                ),
-            )
-        remove(temp_file_name)
-    except OSError:
-        pass
-
-    if not PROC[pro]["mongo"]:
-        return True
-
-    if not records:
-        return False
-
     try:
         # First try a normal upload
         response = EVE_FETCHER.post(
-            endpoint=pro,
+            endpoint=endpoint,
             token=process_file.token["access_token"],
             code=201,
             json=records,
         )
 
-        update_child_list(response.json(), pro, rec["_id"]["$oid"])
+        new_children = update_child_list(response.json(), endpoint, parent_id)
+        if children is not None:
+            children.extend(new_children)
 
         # Simplify handling later
         if not isinstance(records, (list,)):
             records = [records]
 
         # Record uploads.
-        log_record_upload(records, pro)
+        log_record_upload(records, endpoint)
         return True
     except RuntimeError as rte:
         # Catch unexpected error codes.
@@ -542,15 +821,15 @@ def process_file(rec: dict, pro: str) -> bool:
         try:
             # Try to upload just the errors.
             errors = EVE_FETCHER.post(
-                endpoint=pro,
+                endpoint=endpoint,
                 token=process_file.token["access_token"],
                 code=201,
                 json=new_upload,
             )
 
             # Still update parent to tie to error documents.
-            update_child_list(errors.json(), pro, rec["_id"]["$oid"])
-            log_record_upload(new_upload, pro)
+            update_child_list(errors.json(), endpoint, parent_id)
+            log_record_upload(new_upload, endpoint)
         except RuntimeError as rte:
             # If that fails, something on my end is wrong.
             log = "Upload of validation errors failed. %s" % str(rte)
@@ -558,6 +837,196 @@ def process_file(rec: dict, pro: str) -> bool:
     return False
 
 
+def upload_paged(
+    records: Iterable[dict], endpoint: str, parent_id: str, children: List[dict] = None
+) -> bool:
+    """
+    Uploads a stream of records in pages of TABLE_PAGE_SIZE as they are produced, so that
+    neither the worker nor a single request ever has to hold the whole table.
+
+    Arguments:
+        records {Iterable[dict]} -- Records, typically a generator.
+        endpoint {str} -- API endpoint the records are posted to.
+        parent_id {str} -- id of the data record the records were generated from.
+
+    Keyword Arguments:
+        children {List[dict]} -- If given, child entries of the uploaded records are
+            appended to it. (default: {None})
+
+    Returns:
+        bool -- True if every page was uploaded, else false.
+    """
+    all_uploaded = True
+    pages = 0
+    for page in paginate(records, TABLE_PAGE_SIZE):
+        pages += 1
+        if not upload_records(page, endpoint, parent_id, children):
+            all_uploaded = False
+
+    log_formatted(
+        logging.info,
+        "Uploaded %s pages to %s for record %s" % (pages, endpoint, parent_id),
+        "INFO-CELERY-UPLOAD",
+    )
+    return all_uploaded and pages > 0
+
+
+def result_cache_key(store, processor: Processor, rec: dict) -> Optional[str]:
+    """
+    Builds the result cache key of a file from its processor, content hash, trial and
+    assay.
+
+    Arguments:
+        store {Union[GCSStore, LocalStore]} -- Store holding the file.
+        processor {Processor} -- Processor the file is matched to.
+        rec {dict} -- The data record of the file.
+
+    Returns:
+        Optional[str] -- Cache key, None if the file has no content hash.
+    """
+    fingerprint = store.fingerprint(rec["gs_uri"])
+    if not fingerprint:
+        return None
+    return RESULT_CACHE.key(
+        processor.name,
+        processor.version,
+        fingerprint,
+        rec["trial"]["$oid"],
+        rec["assay"]["$oid"],
+    )
+
+
+def link_cached_result(cache_key: str, processor: Processor, rec: dict) -> bool:
+    """
+    Links a record to the records already produced from a file with the same content, in
+    the same trial and assay. An entry whose records were deleted since is discarded, and
+    the file is processed again.
+
+    Arguments:
+        cache_key {str} -- Result cache key of the file.
+        processor {Processor} -- Processor the file is matched to.
+        rec {dict} -- The data record being processed.
+
+    Returns:
+        bool -- True if a cached result was found and linked, else false.
+    """
+    cached = RESULT_CACHE.get(cache_key)
+    if not cached or not cached.get("children"):
+        return False
+
+    child_ids = [str(child["_id"]) for child in cached["children"]]
+    try:
+        found = set(
+            str(child["_id"])
+            for child in iter_where_in(
+                EVE_FETCHER,
+                processor.endpoint,
+                process_file.token["access_token"],
+                "_id",
+                child_ids,
+                fields=["_id"],
+            )
+        )
+    except RuntimeError as rte:
+        log_formatted(
+            logging.error,
+            "Error checking cached records of %s: %s" % (rec["gs_uri"], str(rte)),
+            "ERROR-CELERY-GET",
+        )
+        return False
+    if not found.issuperset(child_ids):
+        log_formatted(
+            logging.info,
+            "Discarding cached result of %s, %s of its records are gone"
+            % (rec["gs_uri"], len(set(child_ids) - found)),
+            "INFO-CELERY-PROCESSING",
+        )
+        RESULT_CACHE.discard(cache_key)
+        return False
+
+    CHILD_LINKS.add(rec["_id"]["$oid"], cached["children"])
+    log_formatted(
+        logging.info,
+        "Reused %s %s records for unchanged file %s"
+        % (len(cached["children"]), processor.endpoint, rec["gs_uri"]),
+        "INFO-CELERY-PROCESSING",
+    )
+    return True
+
+
+@APP.task(base=AuthorizedTask)
+def process_file(rec: dict, pro: str) -> bool:
+    """
+    Worker process that handles processing an individual file.
+
+    Arguments:
+        rec {dict} -- A record item to be processed.
+        pro {str} -- Name of the registered processor the filetype corresponds to.
+
+    Returns:
+        boolean -- True if completed without error, else false.
+    """
+    store = get_store(rec["gs_uri"])
+    processor = PROC[pro]
+    cache_key = None
+    try:
+        if processor.mongo and RESULT_CACHE:
+            cache_key = result_cache_key(store, processor, rec)
+            if cache_key and link_cached_result(cache_key, processor, rec):
+                return True
+
+        with store.open_for_read(rec["gs_uri"], DOWNLOAD_SPOOL_LIMIT) as source:
+            if not processor.mongo:
+                processor.func(
+                    source,
+                    RecordContext(
+                        rec["trial"]["$oid"],
+                        rec["assay"]["$oid"],
+                        rec["_id"]["$oid"],
+                        rec,
+                    ),
+                )
+                return True
+
+            context = RecordContext(
+                rec["trial"]["$oid"], rec["assay"]["$oid"], rec["_id"]["$oid"]
+            )
+            # Streaming processors parse as the upload consumes their rows, so they run
+            # here. Other CPU bound parsing runs in the pool, leaving this process to the
+            # network.
+            if processor.stream:
+                records = processor.func(source, context, stream=True)
+            elif processor.resource_class == "cpu":
+                records = CPU_POOL.run(processor.func, source, context)
+            else:
+                records = processor.func(source, context)
+
+            if not records:
+                return False
+
+            children = []
+            # Streamed records are uploaded page by page while the download is open.
+            if isinstance(records, GeneratorType):
+                uploaded = upload_paged(
+                    records, processor.endpoint, rec["_id"]["$oid"], children
+                )
+            else:
+                uploaded = upload_records(
+                    records, processor.endpoint, rec["_id"]["$oid"], children
+                )
+
+        if uploaded and cache_key:
+            RESULT_CACHE.put(cache_key, {"children": children})
+        return uploaded
+    except OSError as err:
+        log_formatted(
+            logging.error,
+            "Error processing file %s: %s" % (rec["gs_uri"], str(err)),
+            "ERROR-CELERY-PROCESSING",
+        )
+        return False
+
+
 @APP.task
 def postprocessing(records: List[dict]) -> None:
     """
@@ -572,14 +1041,16 @@ def postprocessing(records: List[dict]) -> None:
     for rec in records:
         message = "Processing: " + rec["file_name"]
         logging.info({"message": message, "category": "FAIR-CELERY-PROCESSING"})
-        for pro in PROC:
-            if re.search(PROC[pro]["re"], rec["file_name"], re.IGNORECASE):
-                log_formatted(
-                    logging.info,
-                    "Match found for " + rec["file_name"],
-                    "INFO-CELERY-PROCESSING",
-                )
-                # If a match is found, add to job queue
-                tasks.append(process_file.s(rec, pro))
+        processor = PROC.match(rec["file_name"])
+        if processor:
+            log_formatted(
+                logging.info,
+                "Match found for %s: %s" % (rec["file_name"], processor.name),
+                "INFO-CELERY-PROCESSING",
+            )
+            # If a match is found, add to the queue for the processor's resource class.
+            tasks.append(
+                process_file.s(rec, processor.name).set(queue=processor.queue)
+            )
 
     execute_in_parallel(tasks)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Registry of the processors that post-process uploaded files. Every processor declares the
+file name patterns it handles, whether it is CPU or IO bound, and the queue its tasks are
+sent to.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import re
+from typing import Callable, Dict, Iterator, List, NamedTuple, Optional, Pattern
+
+from framework.tasks.variables import PROCESSING_QUEUES
+
+
+class Processor(NamedTuple):
+    """
+    Describes one kind of post-processing.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    name: str
+    patterns: List[str]
+    func: Callable
+    mongo: bool
+    resource_class: str
+    queue: str
+    endpoint: str
+    version: str
+    stream: bool
+
+
+class ProcessorRegistry:
+    """
+    Ordered collection of processors. All patterns are compiled into a single expression so
+    matching a file name is one regex call no matter how many processors are registered.
+    When several processors match, the one registered first wins.
+    """
+
+    def __init__(self):
+        self._processors = {}  # type: Dict[str, Processor]
+        self._matcher = None  # type: Optional[Pattern]
+
+    def register(
+        self,
+        name: str,
+        patterns: List[str],
+        func: Callable,
+        mongo: bool = True,
+        resource_class: str = "cpu",
+        endpoint: str = None,
+        version: str = "1",
+        stream: bool = False,
+    ) -> Processor:
+        """
+        Adds a processor to the registry.
+
+        Arguments:
+            name {str} -- Processor name, must be a valid identifier.
+            patterns {List[str]} -- Regular expressions searched for in the file name.
+            func {Callable} -- Function called with the file and a RecordContext.
+
+        Keyword Arguments:
+            mongo {bool} -- True if func returns records to upload. (default: {True})
+            resource_class {str} -- "cpu" or "io", picks the queue. (default: {"cpu"})
+            endpoint {str} -- API endpoint records are posted to. (default: {name})
+            version {str} -- Bump when the records produced for a file change, so cached
+                results are not reused. (default: {"1"})
+            stream {bool} -- True if func accepts stream=True and then returns a generator
+                of records, which are uploaded page by page. (default: {False})
+
+        Raises:
+            ValueError -- If the name is taken or the resource class is unknown.
+
+        Returns:
+            Processor -- The registered processor.
+        """
+        if name in self._processors:
+            raise ValueError("Processor %s is already registered" % name)
+        if resource_class not in PROCESSING_QUEUES:
+            raise ValueError("Unknown resource class %s" % resource_class)
+
+        processor = Processor(
+            name,
+            list(patterns),
+            func,
+            mongo,
+            resource_class,
+            PROCESSING_QUEUES[resource_class],
+            endpoint or name,
+            version,
+            stream,
+        )
+        self._processors[name] = processor
+        self._matcher = None
+        return processor
+
+    @property
+    def matcher(self) -> Pattern:
+        """
+        Compiled expression with one lookahead per processor, in registration order. Each
+        lookahead captures into a group named after its processor.
+
+        Returns:
+            Pattern -- Compiled expression.
+        """
+        if self._matcher is None:
+            self._matcher = re.compile(
+                "|".join(
+                    "(?=.*?(?P<%s>%s))" % (name, "|".join(processor.patterns))
+                    for name, processor in self._processors.items()
+                ),
+                re.IGNORECASE | re.DOTALL,
+            )
+        return self._matcher
+
+    def match(self, file_name: str) -> Optional[Processor]:
+        """
+        Finds the processor for a file.
+
+        Arguments:
+            file_name {str} -- Name of the file.
+
+        Returns:
+            Optional[Processor] -- The first registered processor that matches, else None.
+        """
+        if not self._processors:
+            return None
+        found = self.matcher.match(file_name)
+        if not found:
+            return None
+        return self._processors[found.lastgroup]
+
+    def __getitem__(self, name: str) -> Processor:
+        return self._processors[name]
+
+    def __contains__(self, name: str) -> bool:
+        return name in self._processors
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._processors)
+
+    def __len__(self) -> int:
+        return len(self._processors)
@@ -0,0 +1,155 @@
+#!/usr/bin/env python
+"""
+On-disk cache of processing results, keyed by processor and file content, so a file whose
+bytes have already been processed can be linked to the existing records instead of being
+parsed again.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import hashlib
+import json
+import logging
+import os
+from typing import Optional
+from uuid import uuid4
+
+
+class DiskResultCache:
+    """
+    Stores one small JSON document per key in a directory. Entries are evicted least
+    recently used first, by modification time, once the directory grows past max_bytes.
+    Several processes may share the directory: writes are atomic renames and eviction
+    tolerates files disappearing underneath it.
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        """
+        Constructor.
+
+        Arguments:
+            directory {str} -- Directory the entries are kept in, created on first write.
+            max_bytes {int} -- Size the directory is trimmed back to after a write.
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+
+    @staticmethod
+    def key(
+        processor: str, version: str, fingerprint: str, trial: str, assay: str
+    ) -> str:
+        """
+        Builds the cache key for a file. Results are only shared within a trial and assay,
+        as the records they point to belong to one.
+
+        Arguments:
+            processor {str} -- Processor name.
+            version {str} -- Processor version, bumped when its output changes.
+            fingerprint {str} -- Content hash of the file.
+            trial {str} -- Trial id of the file.
+            assay {str} -- Assay id of the file.
+
+        Returns:
+            str -- Cache key.
+        """
+        fields = (processor, version, fingerprint, trial, assay)
+        return hashlib.sha1("\n".join(fields).encode("utf-8")).hexdigest()
+
+    def entry_path(self, key: str) -> str:
+        """
+        Path of the file holding an entry.
+
+        Arguments:
+            key {str} -- Cache key.
+
+        Returns:
+            str -- Path of the entry.
+        """
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key: str) -> Optional[dict]:
+        """
+        Looks up an entry and marks it as recently used.
+
+        Arguments:
+            key {str} -- Cache key.
+
+        Returns:
+            Optional[dict] -- The cached value, None on a miss or an unreadable entry.
+        """
+        path = self.entry_path(key)
+        try:
+            with open(path, "r") as entry:
+                value = json.load(entry)
+            os.utime(path)
+            return value
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as err:
+            logging.warning(
+                {
+                    "message": "Discarding unreadable cache entry %s: %s" % (path, str(err)),
+                    "category": "WARNING-CELERY-PROCESSING",
+                }
+            )
+            self.discard(key)
+            return None
+
+    def put(self, key: str, value: dict) -> None:
+        """
+        Stores an entry, then evicts old entries if the cache is over its size limit.
+
+        Arguments:
+            key {str} -- Cache key.
+            value {dict} -- JSON serializable value.
+        """
+        os.makedirs(self.directory, exist_ok=True)
+        temp_path = os.path.join(self.directory, "%s.tmp" % uuid4())
+        with open(temp_path, "w") as entry:
+            json.dump(value, entry)
+        os.replace(temp_path, self.entry_path(key))
+        self.evict()
+
+    def discard(self, key: str) -> None:
+        """
+        Removes an entry if it exists.
+
+        Arguments:
+            key {str} -- Cache key.
+        """
+        try:
+            os.remove(self.entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def evict(self) -> int:
+        """
+        Deletes least recently used entries until the cache fits in max_bytes.
+
+        Returns:
+            int -- Number of entries deleted.
+        """
+        entries = []
+        total = 0
+        for name in os.listdir(self.directory):
+            if not name.endswith(".json"):
+                continue
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+            total += stat.st_size
+
+        evicted = 0
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+                evicted += 1
+            except FileNotFoundError:
+                pass
+            total -= size
+        return evicted
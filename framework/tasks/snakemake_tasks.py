@@ -11,7 +11,7 @@ import logging
 import os
 import re
 import subprocess
-from typing import List, NamedTuple, Tuple
+from typing import List, NamedTuple, Optional, Tuple
 
 from cidc_utils.requests import SmartFetch
 from cidc_utils.loghandler.stack_driver_handler import send_mail, log_formatted
@@ -21,10 +21,23 @@ from snakemake import snakemake
 from framework.celery.celery import APP
 from framework.tasks.administrative_tasks import get_authorized_users, manage_bucket_acl
 from framework.tasks.authorized_task import AuthorizedTask
+from framework.tasks.eve_query import iter_where
 from framework.tasks.storage_tasks import run_subprocess_with_logs
 from framework.tasks.parallelize_tasks import execute_in_parallel
-from framework.tasks.variables import EVE_URL, GOOGLE_BUCKET_NAME, SENDGRID_API_KEY
-from framework.tasks.analysis_tasks import set_record_processed, check_processed
+from framework.tasks.variables import (
+    EVE_URL,
+    GOOGLE_BUCKET_NAME,
+    SENDGRID_API_KEY,
+    WORKFLOW_BRANCH,
+    WORKFLOW_FETCH_INTERVAL,
+    WORKFLOW_MIRROR_DIR,
+)
+from framework.tasks.workflow_mirror import WorkflowCheckout, checkout_workflow
+from framework.tasks.analysis_tasks import (
+    check_processed,
+    patched_records,
+    set_record_processed,
+)
 
 EVE = SmartFetch(EVE_URL)
 FILE_EXTENSION_DICT = {"fa": "FASTQ", "fa.gz": "FASTQ", "fq.gz": "FASTQ"}
@@ -84,12 +97,10 @@ def check_for_runs(token: str) -> Tuple[List[dict], List[dict]]:
     try:
         # Only return assays that have a workflow associated with them
         assay_query = {"workflow_location": {"$ne": "null"}}
-        assay_query_string = "assays?where=%s" % json.dumps(assay_query)
 
         # Contains a list of all the running assays and their inputs
-        assay_response = EVE.get(
-            token=token, endpoint=assay_query_string, code=200
-        ).json()["_items"]
+        fields = ["non_static_inputs", "assay_name", "workflow_location"]
+        assay_response = list(iter_where(EVE, "assays", token, assay_query, fields))
         sought_mappings = [
             item
             for sublist in [x["non_static_inputs"] for x in assay_response]
@@ -148,30 +159,34 @@ def find_valid_runs(record_response: dict, assay_dict: dict) -> List[Tuple[dict,
     return valid_runs
 
 
-def clone_snakemake(git_url: str, folder_name: str) -> str:
+def clone_snakemake(git_url: str, folder_name: str) -> WorkflowCheckout:
     """
-    Clones snakemake location and returns the path of the Snakefile.
+    Checks the snakemake workflow out of the worker's mirror of its repository.
 
     Arguments:
         git_url {str} -- GitHub URL for snakemake workflow.
         folder_name {str} -- Name of the folder to create.
 
     Returns:
-        str -- Snakefile path.
-    """
-    run_subprocess_with_logs(
-        [
-            "git",
-            "clone",
-            "--single-branch",
-            "--branch",
-            "jason",
+        WorkflowCheckout -- Snakefile path, and the commit checked out, None if the
+            checkout failed.
+    """
+    try:
+        return checkout_workflow(
+            WORKFLOW_MIRROR_DIR,
             git_url,
+            WORKFLOW_BRANCH,
             folder_name,
-        ],
-        "cloning snakemake",
-    )
-    return folder_name + "/Snakefile"
+            WORKFLOW_FETCH_INTERVAL,
+        )
+    except (subprocess.CalledProcessError, OSError) as err:
+        log_formatted(
+            logging.error,
+            "Checking out %s failed: %s"
+            % (git_url, getattr(err, "stderr", None) or str(err)),
+            "ERROR-CELERY-SNAKEMAKE",
+        )
+        return WorkflowCheckout(folder_name + "/Snakefile", None)
 
 
 def run_snakefile(
@@ -505,7 +520,9 @@ def upload_results(valid_run: dict, outputs: List[str], token: str) -> List[dict
         return None
 
 
-def add_inputs(run_id: str, inputs: List[dict], token) -> str:
+def add_inputs(
+    run_id: str, inputs: List[dict], token, workflow_commit: Optional[str] = None
+) -> str:
     """
     Updates the analysis record with the inputs.
 
@@ -514,18 +531,21 @@ def add_inputs(run_id: str, inputs: List[dict], token) -> str:
         inputs {List[dict]} -- List of files used.
         token {str} -- JWT
 
+    Keyword Arguments:
+        workflow_commit {Optional[str]} -- Commit of the workflow the run uses.
+            (default: {None})
+
     Returns:
         str -- Updated _etag.
     """
     try:
         results = EVE.get(endpoint="analysis", item_id=run_id, token=token).json()
         etag = results["_etag"]
+        payload = {"files_used": inputs}
+        if workflow_commit:
+            payload["workflow_commit"] = workflow_commit
         return EVE.patch(
-            endpoint="analysis",
-            item_id=run_id,
-            _etag=etag,
-            token=token,
-            json={"files_used": inputs},
+            endpoint="analysis", item_id=run_id, _etag=etag, token=token, json=payload
         ).json()["_etag"]
     except RuntimeError as rte:
         log_formatted(
@@ -632,24 +652,34 @@ def execute_workflow(valid_run: Tuple[dict, dict]):
     logging.info(
         {"message": "Setting files to processed", "category": "INFO-CELERY-SNAKEMAKE"}
     )
-    set_record_processed(records, True, token)
+    claimed = set_record_processed(records, True, token)
+    if not all(outcome.ok for outcome in claimed):
+        # Release the records this run did flag, so another run can use them.
+        set_record_processed(patched_records(claimed), False, token)
+        logging.error(
+            {
+                "message": "Could not set all input files to processed, run aborted",
+                "category": "ERROR-CELERY-SNAKEMAKE",
+            }
+        )
+        return False
 
     # reference shortcuts
     aggregation_res = valid_run[0]["_id"]
     cimac_sample_id: str = aggregation_res["sample_ids"][0]
     run_id: str = str(analysis_response["_id"])
 
-    snakemake_file = clone_snakemake(valid_run[1]["workflow_location"], run_id)
+    checkout = clone_snakemake(valid_run[1]["workflow_location"], run_id)
     analysis_response["files_used"] = create_input_json(
         valid_run[0]["records"], run_id, cimac_sample_id
     )
     analysis_response["_etag"] = add_inputs(
-        run_id, analysis_response["files_used"], token
+        run_id, analysis_response["files_used"], token, checkout.commit
     )
 
     # Run Snakefile.
     try:
-        workflow_dag, problem = run_snakefile(snakemake_file, workdir=run_id)
+        workflow_dag, problem = run_snakefile(checkout.snakefile, workdir=run_id)
         if problem:
             logging.error(
                 {
@@ -657,8 +687,7 @@ def execute_workflow(valid_run: Tuple[dict, dict]):
                     "category": "ERROR-CELERY-SNAKEMAKE",
                 }
             )
-            records, all_free = check_processed(valid_run[0]["records"], token)
-            set_record_processed(records, False, token)
+            set_record_processed(patched_records(claimed), False, token)
             error_str = str(problem)
             logging.error({"message": error_str, "category": "ERROR-CELERY-SNAKEMAKE"})
             send_mail(
@@ -676,6 +705,7 @@ def execute_workflow(valid_run: Tuple[dict, dict]):
             "Uncaught Snakemake Exception: %s. Run has failed." % str(excp),
             "ERROR-CELERY-SNAKEMAKE",
         )
+        set_record_processed(patched_records(claimed), False, token)
         problem = str(excp)
     finally:
         update_analysis(
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+"""
+Local index of valid gene symbols. The HUGO refresh writes every symbol and synonym to a
+sorted array on disk, and workers memory-map the current version to validate symbols
+without asking the API. The refresh also keeps a snapshot of the symbols it published to
+the API, so the next refresh only has to send the difference.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import hashlib
+import json
+import logging
+import os
+import threading
+from typing import Iterable, List, Optional, Set
+from uuid import uuid4
+
+import numpy as np
+
+CURRENT_FILE = "CURRENT"
+# Versions kept on disk, so workers still mapping an older one are not left dangling.
+KEEP_VERSIONS = 2
+SNAPSHOT_FILE = "published.json"
+
+
+class SymbolIndex:
+    """
+    Sorted array of UTF-8 encoded symbols, searched with binary search.
+    """
+
+    def __init__(self, symbols: np.ndarray, version: str = None):
+        """
+        Constructor.
+
+        Arguments:
+            symbols {np.ndarray} -- Sorted, unique byte string array.
+
+        Keyword Arguments:
+            version {str} -- Name of the file the index was loaded from. (default: {None})
+        """
+        self.symbols = symbols
+        self.version = version
+
+    @classmethod
+    def build(cls, symbols: Iterable[str]) -> "SymbolIndex":
+        """
+        Builds an index from symbols in any order, with repeats.
+
+        Arguments:
+            symbols {Iterable[str]} -- Symbols.
+
+        Returns:
+            SymbolIndex -- The index.
+        """
+        encoded = [symbol.encode("utf-8") for symbol in set(symbols)]
+        width = max([len(symbol) for symbol in encoded] or [1])
+        return cls(np.unique(np.array(encoded, dtype="S%s" % width)))
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def missing(self, symbols: List[str]) -> List[str]:
+        """
+        Finds the symbols that are not in the index.
+
+        Arguments:
+            symbols {List[str]} -- Symbols to check.
+
+        Returns:
+            List[str] -- Symbols not found, in the order given.
+        """
+        if not symbols:
+            return []
+        width = self.symbols.dtype.itemsize
+        encoded = [symbol.encode("utf-8") for symbol in symbols]
+        # Longer symbols would be truncated by the array's width, and can't be present.
+        fits = np.array([len(symbol) <= width for symbol in encoded])
+        queries = np.array(encoded, dtype=self.symbols.dtype)
+        positions = np.searchsorted(self.symbols, queries)
+        found = np.zeros(len(symbols), dtype=bool)
+        inside = positions < len(self.symbols)
+        found[inside] = self.symbols[positions[inside]] == queries[inside]
+        found &= fits
+        return [symbol for symbol, present in zip(symbols, found) if not present]
+
+    def save(self, directory: str) -> str:
+        """
+        Writes the index as a new version and makes it the current one. The array and the
+        pointer are both written to temporary files and renamed into place, so readers see
+        either the old version or the new one.
+
+        Arguments:
+            directory {str} -- Index directory.
+
+        Returns:
+            str -- File name of the new version.
+        """
+        os.makedirs(directory, exist_ok=True)
+        version = "symbols-%s.npy" % uuid4().hex
+        temp_path = os.path.join(directory, "%s.tmp" % version)
+        with open(temp_path, "wb") as array_file:
+            np.save(array_file, self.symbols)
+        os.replace(temp_path, os.path.join(directory, version))
+
+        pointer_path = os.path.join(directory, "%s.%s.tmp" % (CURRENT_FILE, uuid4().hex))
+        with open(pointer_path, "w") as pointer:
+            pointer.write(version)
+        os.replace(pointer_path, os.path.join(directory, CURRENT_FILE))
+        self.version = version
+        remove_old_versions(directory, version)
+        return version
+
+
+def remove_old_versions(directory: str, current: str) -> None:
+    """
+    Deletes all but the newest KEEP_VERSIONS index files.
+
+    Arguments:
+        directory {str} -- Index directory.
+        current {str} -- File name of the current version, never deleted.
+    """
+    versions = []
+    for name in os.listdir(directory):
+        if name.startswith("symbols-") and name.endswith(".npy") and name != current:
+            try:
+                versions.append((os.stat(os.path.join(directory, name)).st_mtime, name))
+            except FileNotFoundError:
+                pass
+    for _, name in sorted(versions, reverse=True)[KEEP_VERSIONS - 1 :]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def read_current(directory: str) -> Optional[str]:
+    """
+    Reads the name of the current index version.
+
+    Arguments:
+        directory {str} -- Index directory.
+
+    Returns:
+        Optional[str] -- File name, None if no index was published.
+    """
+    try:
+        with open(os.path.join(directory, CURRENT_FILE)) as pointer:
+            return pointer.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+class SymbolIndexLoader:
+    """
+    Keeps the current index of a directory mapped in memory, and switches to a new version
+    the first time it is asked for the index after a refresh published one.
+    """
+
+    def __init__(self, directory: str):
+        """
+        Constructor.
+
+        Arguments:
+            directory {str} -- Index directory.
+        """
+        self.directory = directory
+        self._index = None  # type: Optional[SymbolIndex]
+        self._lock = threading.Lock()
+
+    def current(self) -> Optional[SymbolIndex]:
+        """
+        Returns the current index, loading it if a new version was published.
+
+        Returns:
+            Optional[SymbolIndex] -- The index, None if none was published or it can't be
+                read.
+        """
+        version = read_current(self.directory)
+        with self._lock:
+            if version is None:
+                return self._index
+            if self._index is not None and self._index.version == version:
+                return self._index
+            try:
+                symbols = np.load(os.path.join(self.directory, version), mmap_mode="r")
+                self._index = SymbolIndex(symbols, version)
+            except (OSError, ValueError) as err:
+                logging.warning(
+                    {
+                        "message": "Could not load gene symbol index %s: %s"
+                        % (version, str(err)),
+                        "category": "WARNING-CELERY-HUGO",
+                    }
+                )
+            return self._index
+
+
+def symbols_checksum(symbols: List[str]) -> str:
+    """
+    Checksum of a list of symbols, in the order given.
+
+    Arguments:
+        symbols {List[str]} -- Symbols.
+
+    Returns:
+        str -- Hex encoded SHA-256 digest.
+    """
+    return hashlib.sha256("\n".join(symbols).encode("utf-8")).hexdigest()
+
+
+def save_snapshot(path: str, symbols: Iterable[str]) -> None:
+    """
+    Writes the set of symbols published to the API, sorted and with a checksum. The file is
+    written to a temporary name and renamed into place.
+
+    Arguments:
+        path {str} -- Snapshot file.
+        symbols {Iterable[str]} -- Published symbols.
+    """
+    ordered = sorted(set(symbols))
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    temp_path = "%s.%s.tmp" % (path, uuid4().hex)
+    with open(temp_path, "w") as snapshot:
+        json.dump(
+            {"checksum": symbols_checksum(ordered), "symbols": ordered}, snapshot
+        )
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str) -> Optional[Set[str]]:
+    """
+    Reads the set of symbols published to the API.
+
+    Arguments:
+        path {str} -- Snapshot file.
+
+    Returns:
+        Optional[Set[str]] -- Published symbols, None if there is no snapshot or it fails
+            its checksum.
+    """
+    try:
+        with open(path) as snapshot:
+            contents = json.load(snapshot)
+        symbols = contents["symbols"]
+        if symbols_checksum(symbols) == contents["checksum"]:
+            return set(symbols)
+        error = "checksum mismatch"
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        error = str(err)
+    logging.warning(
+        {
+            "message": "Ignoring corrupt gene symbol snapshot %s: %s" % (path, error),
+            "category": "WARNING-CELERY-HUGO",
+        }
+    )
+    return None
+
+
+def remove_snapshot(path: str) -> None:
+    """
+    Deletes the snapshot, if there is one.
+
+    Arguments:
+        path {str} -- Snapshot file.
+    """
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+"""
+Coalesces gene symbol lookups. Validations arriving within a short window of each other
+share one deduplicated lookup, and the answers are kept for a while so that files with the
+same assays don't look the same symbols up again.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, Iterable, List, Optional, Set
+
+
+class SymbolCache:
+    """
+    Remembers whether symbols are valid for ttl seconds, dropping the oldest entries past
+    max_size. Not thread safe, callers hold a lock.
+    """
+
+    def __init__(self, ttl: float, max_size: int):
+        """
+        Constructor.
+
+        Arguments:
+            ttl {float} -- Seconds an answer is kept.
+            max_size {int} -- Most symbols kept.
+        """
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # type: OrderedDict
+
+    def get(self, symbol: str) -> Optional[bool]:
+        """
+        Looks a symbol up.
+
+        Arguments:
+            symbol {str} -- Symbol.
+
+        Returns:
+            Optional[bool] -- Whether it is valid, None if unknown or expired.
+        """
+        entry = self._entries.get(symbol)
+        if entry is None:
+            return None
+        valid, expires = entry
+        if expires <= time.monotonic():
+            del self._entries[symbol]
+            return None
+        return valid
+
+    def put(self, answers: Dict[str, bool]) -> None:
+        """
+        Stores answers.
+
+        Arguments:
+            answers {Dict[str, bool]} -- Validity by symbol.
+        """
+        if self.ttl <= 0 or self.max_size <= 0:
+            return
+        expires = time.monotonic() + self.ttl
+        for symbol, valid in answers.items():
+            self._entries.pop(symbol, None)
+            self._entries[symbol] = (valid, expires)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+
+class Batch:
+    """
+    Symbols collected during one window, and the outcome of their lookup.
+    """
+
+    def __init__(self):
+        self.symbols = set()  # type: Set[str]
+        self.done = threading.Event()
+        self.found = set()  # type: Set[str]
+        self.error = None  # type: Optional[Exception]
+
+
+class SymbolBatcher:
+    """
+    The first caller to need a lookup opens a batch and waits window seconds for others to
+    add their symbols, then looks them all up at once and shares the answer. Callers whose
+    symbols are all cached don't wait.
+    """
+
+    def __init__(
+        self,
+        lookup: Callable[[List[str]], Iterable[str]],
+        window: float,
+        ttl: float,
+        max_size: int,
+    ):
+        """
+        Constructor.
+
+        Arguments:
+            lookup {Callable[[List[str]], Iterable[str]]} -- Called with unique symbols,
+                returns those that are valid.
+            window {float} -- Seconds a batch stays open.
+            ttl {float} -- Seconds answers are cached.
+            max_size {int} -- Most symbols cached.
+        """
+        self.lookup = lookup
+        self.window = window
+        self.cache = SymbolCache(ttl, max_size)
+        self.lookups = 0
+        self._lock = threading.Lock()
+        self._batch = None  # type: Optional[Batch]
+
+    def missing(self, symbols: List[str]) -> List[str]:
+        """
+        Finds the symbols that are not valid.
+
+        Arguments:
+            symbols {List[str]} -- Symbols to check.
+
+        Raises:
+            RuntimeError -- If the lookup of the batch failed.
+
+        Returns:
+            List[str] -- Invalid symbols, in the order given.
+        """
+        answers = {}  # type: Dict[str, bool]
+        with self._lock:
+            for symbol in set(symbols):
+                valid = self.cache.get(symbol)
+                if valid is not None:
+                    answers[symbol] = valid
+            unknown = set(symbols) - set(answers)
+            leader = False
+            if unknown:
+                batch = self._batch
+                if batch is None:
+                    batch = self._batch = Batch()
+                    leader = True
+                batch.symbols |= unknown
+
+        if unknown:
+            if leader:
+                self._run(batch)
+            batch.done.wait()
+            if batch.error is not None:
+                raise batch.error
+            answers.update({symbol: symbol in batch.found for symbol in unknown})
+
+        return [symbol for symbol in symbols if not answers[symbol]]
+
+    def _run(self, batch: Batch) -> None:
+        """
+        Waits for the window to pass, closes the batch and looks its symbols up.
+
+        Arguments:
+            batch {Batch} -- The batch this caller opened.
+        """
+        try:
+            if self.window > 0:
+                time.sleep(self.window)
+            with self._lock:
+                self._batch = None
+                symbols = sorted(batch.symbols)
+            self.lookups += 1
+            batch.found = set(self.lookup(symbols))
+            with self._lock:
+                self.cache.put({symbol: symbol in batch.found for symbol in symbols})
+        except Exception as err:
+            batch.error = err
+        finally:
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            batch.done.set()
@@ -0,0 +1,303 @@
+#!/usr/bin/env python
+"""
+Columnar parser engine for tab delimited tables. Reads the file in large blocks with pandas
+and emits typed records instead of strings.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import logging
+import re
+import warnings
+from typing import BinaryIO, Dict, Generator, List, Optional, Set, Tuple, Union
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import infer_dtype
+from pandas.errors import EmptyDataError, ParserError, ParserWarning
+
+from framework.tasks.object_store import binary_file
+
+CASTS = {"int": np.int64, "float": np.float64, "bool": bool}
+# Name of the column that catches a field past the last header. Headers are split on tabs,
+# so no header can have it.
+OVERFLOW = "\t"
+# A cell holding a number written with leading zeros, such as a sample id.
+ZERO_PADDED = re.compile(rb'(?:^|\t)"?[-+]?0[0-9]', re.MULTILINE)
+SCAN_BYTES = 1024 * 1024
+
+
+def read_header(source: Union[str, BinaryIO]) -> Tuple[List[str], int]:
+    """
+    Finds the header row of a table, skipping leading comment lines.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
+
+    Returns:
+        Tuple[List[str], int] -- Cleaned column headers, number of lines before the header.
+    """
+    skipped = 0
+    with binary_file(source) as table:
+        for raw_line in table:
+            line = raw_line.decode("utf-8")
+            if line[0] != "#":
+                return (
+                    [
+                        header.strip().replace('"', "").replace(".", "")
+                        for header in line.split("\t")
+                    ],
+                    skipped,
+                )
+            skipped += 1
+    return [], skipped
+
+
+def rewound(source: Union[str, BinaryIO]) -> Union[str, BinaryIO]:
+    """
+    Moves a file object back to its start so it can be read again. Paths are returned as is.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or binary file object.
+
+    Returns:
+        Union[str, BinaryIO] -- The same source, ready to be read from the start.
+    """
+    if not isinstance(source, str):
+        source.seek(0)
+    return source
+
+
+def zero_padded_columns(source: Union[str, BinaryIO], skipped: int) -> Set[int]:
+    """
+    Finds the columns with a number written with leading zeros anywhere in the file. Those
+    are identifiers, and are read as strings so the zeros are kept.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or seekable binary file object.
+        skipped {int} -- Number of lines before the first row of values.
+
+    Returns:
+        Set[int] -- Positions of the columns.
+    """
+    columns = set()  # type: Set[int]
+    with binary_file(rewound(source)) as table:
+        for _ in range(skipped):
+            table.readline()
+        while True:
+            # Whole lines only, so every match can be placed in its column.
+            chunk = table.read(SCAN_BYTES) + table.readline()
+            if not chunk:
+                return columns
+            for match in ZERO_PADDED.finditer(chunk):
+                line_start = chunk.rfind(b"\n", 0, match.start()) + 1
+                columns.add(chunk.count(b"\t", line_start, match.start() + 1))
+
+
+def column_type(column: pd.Series) -> str:
+    """
+    Maps the dtype pandas inferred for a block of a column to a record type.
+
+    Arguments:
+        column {pd.Series} -- Block of a column.
+
+    Returns:
+        str -- One of "int", "float", "bool" or "str".
+    """
+    kind = column.dtype.kind
+    if kind in "iu":
+        return "int"
+    if kind == "f":
+        return "float"
+    if kind == "b" or infer_dtype(column, skipna=True) == "boolean":
+        return "bool"
+    return "str"
+
+
+def widen(established: str, found: str) -> str:
+    """
+    Picks a type that fits both the type a column was given and the type of a later block.
+
+    Arguments:
+        established {str} -- Type the column has so far.
+        found {str} -- Type inferred for the new block.
+
+    Returns:
+        str -- Type for the rest of the column.
+    """
+    if established == found:
+        return established
+    if {established, found} == {"int", "float"}:
+        return "float"
+    return "str"
+
+
+def column_values(column: pd.Series, col_type: str) -> list:
+    """
+    Converts a block of a column to python objects of a type, mapping empty cells to None.
+
+    Arguments:
+        column {pd.Series} -- Block of a column.
+        col_type {str} -- Column type.
+
+    Returns:
+        list -- Typed values in row order.
+    """
+    missing = column.isnull().values
+    present = column[~missing] if missing.any() else column
+    if col_type == "str":
+        values = present.astype(str).str.strip().tolist()
+    else:
+        values = present.astype(CASTS[col_type]).tolist()
+    if not missing.any():
+        return values
+
+    filled = [None] * len(column)
+    for index, value in zip(np.flatnonzero(~missing), values):
+        filled[index] = value
+    return filled
+
+
+def block_columns(
+    block: pd.DataFrame, headers: List[str], types: Dict[str, Optional[str]]
+) -> List[list]:
+    """
+    Converts every column of a block, widening a column's type for the rest of the file if
+    the block does not fit it.
+
+    Arguments:
+        block {pd.DataFrame} -- Block of rows.
+        headers {List[str]} -- Column names, in order.
+        types {Dict[str, Optional[str]]} -- Column types so far, None before the first
+            block. Updated in place.
+
+    Raises:
+        IndexError -- If a row has more values than there are headers.
+
+    Returns:
+        List[list] -- One list of typed values per column.
+    """
+    if block[OVERFLOW].notnull().any():
+        raise IndexError("A row has more values than there are headers")
+
+    columns = []
+    for header in headers:
+        column = block[header]
+        if types[header] is None:
+            types[header] = column_type(column)
+        elif not column.isnull().all():
+            widened = widen(types[header], column_type(column))
+            if widened != types[header]:
+                logging.warning(
+                    {
+                        "message": "Column %s widened from %s to %s"
+                        % (header, types[header], widened),
+                        "category": "WARNING-CELERY-PROCESSING",
+                    }
+                )
+                types[header] = widened
+        columns.append(column_values(column, types[header]))
+    return columns
+
+
+def read_blocks(
+    source: Union[str, BinaryIO], skiprows: int, options: dict
+) -> Generator[pd.DataFrame, None, None]:
+    """
+    Reads blocks of rows with pandas, failing on rows pandas would cut short.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or seekable binary file object.
+        skiprows {int} -- Number of lines before the first row to read.
+        options {dict} -- Other read_csv arguments, with nrows or chunksize.
+
+    Raises:
+        ParserWarning -- If a row has values past the overflow column.
+
+    Returns:
+        Generator[pd.DataFrame, None, None] -- Blocks, in order.
+    """
+    with warnings.catch_warnings():
+        # Pandas drops values past the overflow column with only a warning.
+        warnings.simplefilter("error", ParserWarning)
+        reader = pd.read_csv(rewound(source), skiprows=skiprows, **options)
+    if isinstance(reader, pd.DataFrame):
+        yield reader
+        return
+    while True:
+        with warnings.catch_warnings():
+            warnings.simplefilter("error", ParserWarning)
+            block = next(reader, None)
+        if block is None:
+            return
+        yield block
+
+
+def iter_typed_records(
+    source: Union[str, BinaryIO], block_rows: int = 100000
+) -> Generator[dict, None, None]:
+    """
+    Parses a tab delimited table in blocks of rows, yielding one typed dict per row. Column
+    types are inferred from the first block, and string columns are kept as strings when
+    the rest of the file is read. Columns with numbers written with leading zeros are
+    string columns throughout.
+
+    Arguments:
+        source {Union[str, BinaryIO]} -- Path to file or seekable binary file object.
+
+    Keyword Arguments:
+        block_rows {int} -- Number of rows parsed at a time. (default: {100000})
+
+    Raises:
+        IndexError -- If a row has more values than there are headers. Short rows are
+            padded with missing values.
+
+    Returns:
+        Generator[dict, None, None] -- Generator of records.
+    """
+    headers, skipped = read_header(rewound(source))
+    if not headers:
+        return
+
+    padded = zero_padded_columns(source, skipped + 1)
+    options = {
+        "sep": "\t",
+        "header": None,
+        "names": headers + [OVERFLOW],
+        # Without this pandas would make the first column the index of rows with one
+        # value too many, shifting every value over.
+        "index_col": False,
+        "dtype": {headers[i]: str for i in padded if i < len(headers)},
+        "skipinitialspace": True,
+        "keep_default_na": False,
+        "na_values": [""],
+    }
+    types = dict.fromkeys(headers)  # type: Dict[str, Optional[str]]
+    try:
+        first_block = next(
+            read_blocks(source, skipped + 1, dict(options, nrows=block_rows))
+        )
+        for row in zip(*block_columns(first_block, headers, types)):
+            yield dict(zip(headers, row))
+        if len(first_block) < block_rows:
+            return
+        del first_block
+
+        options["dtype"] = {header: str for header in headers if types[header] == "str"}
+        blocks = read_blocks(
+            source, skipped + 1 + block_rows, dict(options, chunksize=block_rows)
+        )
+        for block in blocks:
+            for row in zip(*block_columns(block, headers, types)):
+                yield dict(zip(headers, row))
+    except EmptyDataError:
+        # No rows left after the header or the first block.
+        return
+    except (ParserError, ParserWarning) as err:
+        logging.error(
+            {
+                "message": "Header and value length mismatch! %s" % str(err),
+                "category": "ERROR-CELERY-PROCESSING",
+            }
+        )
+        raise IndexError(str(err))
@@ -5,7 +5,8 @@ Sets some variables when the module is first run
 __author__ = "Lloyd McCarthy"
 __license__ = "MIT"
 
-from os import environ as env
+from os import environ as env, path
+from tempfile import gettempdir
 from dotenv import load_dotenv, find_dotenv
 
 ENV_FILE = find_dotenv()
@@ -28,6 +29,83 @@ LOGSTORE = env.get("LOGSTORE")
 MANAGEMENT_API = env.get("MANAGEMENT_API")
 RABBIT_MQ_URI = None
 SENDGRID_API_KEY = env.get("SENDGRID_API_KEY")
+# Number of rows posted per request when a processor streams its records.
+TABLE_PAGE_SIZE = int(env.get("TABLE_PAGE_SIZE", "1000"))
+# Comma separated file name patterns of tables whose rows are uploaded to the "table"
+# endpoint, streamed page by page. Tables are only processed once patterns are set.
+TABLE_PATTERNS = [
+    pattern for pattern in env.get("TABLE_PATTERNS", "").split(",") if pattern
+]
+# Parser used by process_table ("typed" or "python") and its block size in rows.
+TABLE_ENGINE = env.get("TABLE_ENGINE", "python")
+TABLE_BLOCK_ROWS = int(env.get("TABLE_BLOCK_ROWS", "100000"))
+# Files up to this many bytes are downloaded into memory, larger ones to a temporary file.
+DOWNLOAD_SPOOL_LIMIT = int(env.get("DOWNLOAD_SPOOL_LIMIT", str(64 * 1024 * 1024)))
+# Seconds processed records wait before being linked to their parent, and the number of
+# buffered links that forces an early flush. A window of 0 links every record immediately.
+CHILD_LINK_WINDOW = float(env.get("CHILD_LINK_WINDOW", "5"))
+CHILD_LINK_MAX = int(env.get("CHILD_LINK_MAX", "500"))
+# Directory buffered links are journaled in until they are saved. Links left behind by a
+# worker process that died are replayed by the next one to start on the same host.
+CHILD_LINK_JOURNAL_DIR = env.get(
+    "CHILD_LINK_JOURNAL_DIR", path.join(gettempdir(), "cidc-child-links")
+)
+# Directory and size limit, in bytes, of the cache of processing results. A limit of 0
+# turns the cache off.
+RESULT_CACHE_DIR = env.get(
+    "RESULT_CACHE_DIR", path.join(gettempdir(), "cidc-result-cache")
+)
+RESULT_CACHE_MAX_BYTES = int(env.get("RESULT_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+# Directory of the local gene symbol index. Workers validate against it once a HUGO
+# refresh has published one there, so it should be on a volume shared with the refresh.
+SYMBOL_INDEX_DIR = env.get(
+    "SYMBOL_INDEX_DIR", path.join(gettempdir(), "cidc-symbol-index")
+)
+# Seconds gene symbol validations wait for others to share an API lookup with, and seconds
+# and number of symbols the answers are cached for. Unused once a symbol index exists.
+SYMBOL_BATCH_WINDOW = float(env.get("SYMBOL_BATCH_WINDOW", "0.05"))
+SYMBOL_CACHE_TTL = float(env.get("SYMBOL_CACHE_TTL", "600"))
+SYMBOL_CACHE_MAX = int(env.get("SYMBOL_CACHE_MAX", "50000"))
+# Symbols dropped from HUGO that may stay in the API's collection before a refresh rebuilds
+# it. Single symbols can't be deleted, as any deletion drops the whole collection.
+HUGO_MAX_STALE_SYMBOLS = int(env.get("HUGO_MAX_STALE_SYMBOLS", "1000"))
+# Records whose processed flag is patched at once, and times a patch is retried after the
+# record changed underneath it.
+RECORD_PATCH_CONCURRENCY = int(env.get("RECORD_PATCH_CONCURRENCY", "8"))
+RECORD_PATCH_CONFLICT_RETRIES = int(env.get("RECORD_PATCH_CONFLICT_RETRIES", "2"))
+# Largest request body, in bytes, and most requests at once when posting documents in bulk.
+BULK_UPLOAD_MAX_BYTES = int(env.get("BULK_UPLOAD_MAX_BYTES", str(1024 * 1024)))
+BULK_UPLOAD_IN_FLIGHT = int(env.get("BULK_UPLOAD_IN_FLIGHT", "4"))
+# Directory of the HUGO download, kept until a refresh succeeds so interrupted transfers can
+# resume, and of the metadata of the last file refreshed from.
+HUGO_CACHE_DIR = env.get(
+    "HUGO_CACHE_DIR", path.join(gettempdir(), "cidc-hugo-cache")
+)
+# Layout of olink NPX results: "legacy" for one dict per assay and sample, "columnar" for
+# parallel arrays per assay with the sample ids stored once on the record.
+NPX_RESULT_LAYOUT = env.get("NPX_RESULT_LAYOUT", "legacy")
+# Processes per worker that CPU bound processors run in, files each of them handles before
+# being replaced, and seconds a file may take. 0 processes runs processors in the worker.
+CPU_POOL_PROCESSES = int(env.get("CPU_POOL_PROCESSES", "1"))
+CPU_POOL_MAX_TASKS = int(env.get("CPU_POOL_MAX_TASKS", "20"))
+CPU_POOL_TIMEOUT = float(env.get("CPU_POOL_TIMEOUT", "900"))
+# Celery queues post-processing tasks are routed to, by processor resource class.
+PROCESSING_QUEUES = {
+    "cpu": env.get("PROCESSING_CPU_QUEUE", "processing_cpu"),
+    "io": env.get("PROCESSING_IO_QUEUE", "processing_io"),
+}
+# Seconds a maf waits in the merge queue before a merge is attempted, and seconds after
+# which an abandoned merge lease is broken.
+MAF_MERGE_DELAY = int(env.get("MAF_MERGE_DELAY", "10"))
+MAF_LEASE_TTL = int(env.get("MAF_LEASE_TTL", "600"))
+
+# Directory of the bare mirrors Snakemake workflows are checked out from, the branch runs
+# use, and seconds within which a mirror is used without fetching again.
+WORKFLOW_MIRROR_DIR = env.get(
+    "WORKFLOW_MIRROR_DIR", path.join(gettempdir(), "cidc-workflow-mirrors")
+)
+WORKFLOW_BRANCH = env.get("WORKFLOW_BRANCH", "jason")
+WORKFLOW_FETCH_INTERVAL = float(env.get("WORKFLOW_FETCH_INTERVAL", "30"))
 
 if not env.get("IN_CLOUD"):
     EVE_URL = "http://localhost:5000"
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+"""
+Checks Snakemake workflows out of worker-local bare mirrors. Each repository is mirrored
+once per worker and brought up to date with a fetch, and every run gets a detached
+worktree of the mirror pinned to the commit it resolved, so concurrent runs of the same
+workflow share one object store.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import fcntl
+import hashlib
+import logging
+import os
+import shutil
+import subprocess
+import time
+from typing import List, NamedTuple, Optional
+
+
+class WorkflowCheckout(NamedTuple):
+    """
+    A workflow checked out for a run.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    snakefile: str
+    commit: Optional[str]
+
+
+def run_git(args: List[str], git_dir: Optional[str] = None) -> str:
+    """
+    Runs a git command.
+
+    Arguments:
+        args {List[str]} -- Arguments after "git".
+
+    Keyword Arguments:
+        git_dir {Optional[str]} -- Repository the command applies to. (default: {None})
+
+    Raises:
+        subprocess.CalledProcessError -- If git exits with an error.
+
+    Returns:
+        str -- Standard output, stripped.
+    """
+    command = ["git"] + (["--git-dir", git_dir] if git_dir else []) + args
+    result = subprocess.run(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    return result.stdout.strip()
+
+
+def mirror_path(directory: str, git_url: str) -> str:
+    """
+    Path of the mirror of a repository.
+
+    Arguments:
+        directory {str} -- Directory the mirrors are kept in.
+        git_url {str} -- Repository URL.
+
+    Returns:
+        str -- Path of the bare repository.
+    """
+    name = hashlib.sha1(git_url.encode("utf-8")).hexdigest()
+    return os.path.join(directory, name + ".git")
+
+
+def update_mirror(mirror: str, git_url: str, fetch_interval: float) -> None:
+    """
+    Creates the mirror, or fetches into it unless it was fetched within fetch_interval
+    seconds. Callers hold the mirror's lock.
+
+    Arguments:
+        mirror {str} -- Path of the bare repository.
+        git_url {str} -- Repository URL.
+        fetch_interval {float} -- Seconds a fetch is considered fresh.
+
+    Raises:
+        subprocess.CalledProcessError -- If the clone or fetch fails.
+    """
+    stamp = os.path.join(mirror, "FETCH_HEAD")
+    if not os.path.isdir(mirror):
+        logging.info(
+            {
+                "message": "Mirroring workflow %s" % git_url,
+                "category": "INFO-CELERY-SNAKEMAKE",
+            }
+        )
+        temp_path = "%s.%s.tmp" % (mirror, os.getpid())
+        shutil.rmtree(temp_path, ignore_errors=True)
+        run_git(["clone", "--mirror", "--quiet", git_url, temp_path])
+        os.replace(temp_path, mirror)
+        open(stamp, "a").close()
+        return
+    if os.path.isfile(stamp) and time.time() - os.path.getmtime(stamp) < fetch_interval:
+        return
+    run_git(["fetch", "--prune", "--quiet", "origin"], git_dir=mirror)
+    os.utime(stamp, None)
+
+
+def checkout_workflow(
+    directory: str, git_url: str, branch: str, folder_name: str, fetch_interval: float
+) -> WorkflowCheckout:
+    """
+    Checks the head of a branch out into a folder, as a detached worktree of the mirror.
+
+    Arguments:
+        directory {str} -- Directory the mirrors are kept in.
+        git_url {str} -- Repository URL.
+        branch {str} -- Branch to check out.
+        folder_name {str} -- Folder to create, must not exist.
+        fetch_interval {float} -- Seconds a fetch is considered fresh.
+
+    Raises:
+        subprocess.CalledProcessError -- If a git command fails.
+
+    Returns:
+        WorkflowCheckout -- Snakefile path and the commit checked out.
+    """
+    os.makedirs(directory, exist_ok=True)
+    mirror = mirror_path(directory, git_url)
+    with open(mirror + ".lock", "w") as lock:
+        # Fetches and worktree bookkeeping write to the mirror, so they take turns.
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        update_mirror(mirror, git_url, fetch_interval)
+        revision = branch + "^{commit}"
+        commit = run_git(["rev-parse", "--verify", revision], git_dir=mirror)
+        # Forget the worktrees of runs whose folders were removed.
+        run_git(["worktree", "prune"], git_dir=mirror)
+        worktree = os.path.abspath(folder_name)
+        run_git(["worktree", "add", "--detach", worktree, commit], git_dir=mirror)
+    return WorkflowCheckout(os.path.join(folder_name, "Snakefile"), commit)
@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+"""
+Index of a worksheet's cells built in a single pass, so that labels can be located by their
+text instead of by rescanning the sheet for every lookup.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from openpyxl.cell.read_only import EMPTY_CELL
+
+
+def normalize(value: object) -> str:
+    """
+    Normalized text of a cell value, used as the index key.
+
+    Arguments:
+        value {object} -- Cell value.
+
+    Returns:
+        str -- Lowercased text, empty for falsy values.
+    """
+    return str(value).lower() if value else ""
+
+
+class WorksheetIndex:
+    """
+    Maps the normalized text of every non empty cell to its positions, and positions to
+    cells. Positions are (row, column), 1 based, in row major order.
+    """
+
+    def __init__(self, worksheet):
+        """
+        Constructor, reads every row of the worksheet once.
+
+        Arguments:
+            worksheet {Worksheet} -- Worksheet, may come from a read-only workbook.
+        """
+        self.cells = {}  # type: Dict[Tuple[int, int], object]
+        self.positions = defaultdict(list)  # type: Dict[str, List[Tuple[int, int]]]
+        self.max_row = 0
+        self.max_column = 0
+        for row_index, row in enumerate(worksheet.iter_rows(), 1):
+            for column_index, cell in enumerate(row, 1):
+                if cell.value is None:
+                    continue
+                self.cells[(row_index, column_index)] = cell
+                if cell.value:
+                    self.positions[normalize(cell.value)].append((row_index, column_index))
+                self.max_row = row_index
+                self.max_column = max(self.max_column, column_index)
+
+    def find(self, text: str, column: Optional[int] = None) -> List[Tuple[int, int]]:
+        """
+        Positions of the cells whose normalized text equals the given text.
+
+        Arguments:
+            text {str} -- Text to look for, compared case insensitively.
+
+        Keyword Arguments:
+            column {Optional[int]} -- Only return cells in this column. (default: {None})
+
+        Returns:
+            List[Tuple[int, int]] -- (row, column) positions, in row major order.
+        """
+        found = self.positions.get(text.lower(), [])
+        if column is None:
+            return list(found)
+        return [position for position in found if position[1] == column]
+
+    def cell(self, row: int, column: int):
+        """
+        Gets a cell.
+
+        Arguments:
+            row {int} -- Row index, 1 based.
+            column {int} -- Column index, 1 based.
+
+        Returns:
+            Union[Cell, EmptyCell] -- The cell, EMPTY_CELL if it holds no value.
+        """
+        return self.cells.get((row, column), EMPTY_CELL)
+
+    def value(self, row: int, column: int) -> object:
+        """
+        Gets the value of a cell.
+
+        Arguments:
+            row {int} -- Row index, 1 based.
+            column {int} -- Column index, 1 based.
+
+        Returns:
+            object -- The value, None for empty cells.
+        """
+        return self.cell(row, column).value
+
+    def text(self, row: int, column: int) -> str:
+        """
+        Gets the normalized text of a cell.
+
+        Arguments:
+            row {int} -- Row index, 1 based.
+            column {int} -- Column index, 1 based.
+
+        Returns:
+            str -- Lowercased text, empty for empty cells.
+        """
+        return normalize(self.value(row, column))
+
+    def iter_rows(
+        self, min_row: int, min_col: int, max_col: int, max_row: Optional[int] = None
+    ) -> Iterator[tuple]:
+        """
+        Iterates over a block of cells, like Worksheet.iter_rows.
+
+        Arguments:
+            min_row {int} -- First row, 1 based.
+            min_col {int} -- First column, 1 based.
+            max_col {int} -- Last column, inclusive.
+
+        Keyword Arguments:
+            max_row {Optional[int]} -- Last row, inclusive. (default: {the last row with a
+                value})
+
+        Returns:
+            Iterator[tuple] -- One tuple of cells per row.
+        """
+        for row in range(min_row, (max_row or self.max_row) + 1):
+            yield tuple(self.cell(row, column) for column in range(min_col, max_col + 1))
@@ -2,4 +2,4 @@
 
 gcloud auth activate-service-account --key-file=../auth/.google_auth.json
 cp /root/.kube/config /config
-celery -A framework.celery.celery worker --concurrency=10 --loglevel=info -E --beat
\ No newline at end of file
+celery -A framework.celery.celery worker --concurrency=10 --loglevel=info -E --beat ${CELERY_QUEUES:+-Q $CELERY_QUEUES}
\ No newline at end of file
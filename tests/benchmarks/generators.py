@@ -0,0 +1,340 @@
+#!/usr/bin/env python
+"""
+Synthetic data for the benchmarks. Every generator is seeded, so the same arguments always
+produce the same file.
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import random
+from collections import defaultdict
+from typing import Dict, List
+
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Color, Font, PatternFill
+
+from framework.tasks.process_npx import (
+    MANIFEST_HEADERS,
+    RECEIVER_ADDRESS,
+    SAMPLE_DESCRIPTION,
+    SENDER_ADDRESS,
+    SHIPPER_INFO,
+    SHIPPING_DETAILS,
+)
+
+SEED = 20181001
+MAF_COLUMNS = [
+    "Hugo_Symbol",
+    "Entrez_Gene_Id",
+    "Center",
+    "NCBI_Build",
+    "Chromosome",
+    "Start_Position",
+    "End_Position",
+    "Strand",
+    "Variant_Classification",
+    "Variant_Type",
+    "Reference_Allele",
+    "Tumor_Seq_Allele1",
+    "Tumor_Seq_Allele2",
+    "Tumor_Sample_Barcode",
+    "Matched_Norm_Sample_Barcode",
+    "t_depth",
+    "t_ref_count",
+    "t_alt_count",
+]
+GENE_INFO_HEADER = (
+    "#tax_id\tGeneID\tSymbol\tLocusTag\tSynonyms\tdbXrefs\tchromosome\tmap_location\t"
+    "description\ttype_of_gene\tSymbol_from_nomenclature_authority\t"
+    "Full_name_from_nomenclature_authority\tNomenclature_status\tOther_designations\t"
+    "Modification_date\tFeature_type"
+)
+
+
+def gene_symbols(count: int) -> List[str]:
+    """
+    Makes distinct gene-like symbols.
+
+    Arguments:
+        count {int} -- Number of symbols.
+
+    Returns:
+        List[str] -- Symbols.
+    """
+    return ["G%s%05d" % (chr(65 + i % 26), i) for i in range(count)]
+
+
+def write_table(path: str, rows: int, columns: int = 10) -> str:
+    """
+    Writes a tab delimited expression table: a comment line, a header row, then one gene
+    column and numeric sample columns.
+
+    Arguments:
+        path {str} -- Output path.
+        rows {int} -- Number of data rows.
+
+    Keyword Arguments:
+        columns {int} -- Number of sample columns. (default: {10})
+
+    Returns:
+        str -- The path.
+    """
+    rng = random.Random(SEED)
+    with open(path, "w") as table:
+        table.write("#synthetic expression table\n")
+        table.write(
+            "\t".join(["Gene"] + ["Sample.%s" % i for i in range(columns)]) + "\n"
+        )
+        for row in range(rows):
+            table.write(
+                "G%07d\t%s\n"
+                % (
+                    row,
+                    "\t".join("%.4f" % rng.uniform(0, 20) for _ in range(columns)),
+                )
+            )
+    return path
+
+
+def write_maf(path: str, rows: int) -> str:
+    """
+    Writes a maf with version and comment lines, a column header and data rows.
+
+    Arguments:
+        path {str} -- Output path.
+        rows {int} -- Number of variants.
+
+    Returns:
+        str -- The path.
+    """
+    rng = random.Random(SEED)
+    bases = "ACGT"
+    with open(path, "w") as maf:
+        maf.write("#version 2.4\n#synthetic\n")
+        maf.write("\t".join(MAF_COLUMNS) + "\n")
+        for row in range(rows):
+            start = rng.randint(1, 2 * 10 ** 8)
+            ref = rng.choice(bases)
+            alt = rng.choice(bases.replace(ref, ""))
+            depth = rng.randint(20, 400)
+            alt_count = rng.randint(1, depth)
+            maf.write(
+                "\t".join(
+                    [
+                        "G%05d" % (row % 20000),
+                        str(row % 20000),
+                        "bench",
+                        "GRCh38",
+                        "chr%s" % (row % 22 + 1),
+                        str(start),
+                        str(start),
+                        "+",
+                        "Missense_Mutation",
+                        "SNP",
+                        ref,
+                        ref,
+                        alt,
+                        "TUMOR%s" % (row % 50),
+                        "NORMAL%s" % (row % 50),
+                        str(depth),
+                        str(depth - alt_count),
+                        str(alt_count),
+                    ]
+                )
+                + "\n"
+            )
+    return path
+
+
+def write_npx_workbook(path: str, samples: int, assays: int) -> str:
+    """
+    Writes an olink NPX workbook laid out the way process_olink_npx expects: the assay
+    definition rows, one row per sample, the LOD and missing data frequency rows, and plate
+    and QC columns. About one value in twenty is flagged as a QC failure with a font color
+    and one in ten as below LOD with a fill.
+
+    Arguments:
+        path {str} -- Output path, should end in .xlsx.
+        samples {int} -- Number of samples.
+        assays {int} -- Number of assays.
+
+    Returns:
+        str -- The path.
+    """
+    rng = random.Random(SEED)
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    qc_font = Font(color=Color(rgb="FFFF0000"))
+    lod_fill = PatternFill(
+        fill_type="solid", fgColor=Color(rgb="FFC0C0C0"), bgColor=Color(rgb="FFC0C0C0")
+    )
+    symbols = gene_symbols(assays)
+    padding = [None, None]
+
+    sheet.append(["NPX data", "NPX Manager 1.0"])
+    sheet.append(["Panel"] + ["Olink INFLAMMATION"] * assays + padding)
+    sheet.append(["Assay"] + symbols + ["Plate ID", "QC Warning"])
+    sheet.append(["Uniprot ID"] + ["P%05d" % i for i in range(assays)] + padding)
+    sheet.append(["OlinkID"] + ["OID%05d" % i for i in range(assays)] + padding)
+    for sample in range(samples):
+        row = ["SAMPLE%05d" % sample]
+        for _ in range(assays):
+            cell = WriteOnlyCell(sheet, value=round(rng.uniform(-1, 12), 3))
+            draw = rng.random()
+            if draw < 0.05:
+                cell.font = qc_font
+            elif draw < 0.15:
+                cell.fill = lod_fill
+            row.append(cell)
+        sheet.append(row + ["PLATE%s" % (sample // 88), "Pass"])
+    sheet.append(["LOD"] + [round(rng.uniform(0, 2), 3) for _ in range(assays)] + padding)
+    sheet.append(["Missing Data freq."] + ["0%"] * assays + padding)
+    workbook.save(path)
+    return path
+
+
+def write_npx_long(path: str, samples: int, assays: int, delimiter: str = ";") -> str:
+    """
+    Writes an olink NPX export in long format, one row per sample and assay, with the same
+    values and flag rates as write_npx_workbook.
+
+    Arguments:
+        path {str} -- Output path.
+        samples {int} -- Number of samples.
+        assays {int} -- Number of assays.
+
+    Keyword Arguments:
+        delimiter {str} -- Column delimiter. (default: {";"})
+
+    Returns:
+        str -- The path.
+    """
+    rng = random.Random(SEED)
+    symbols = gene_symbols(assays)
+    lods = [round(rng.uniform(0, 2), 3) for _ in range(assays)]
+    columns = [
+        "SampleID",
+        "Index",
+        "OlinkID",
+        "UniProt",
+        "Assay",
+        "MissingFreq",
+        "Panel",
+        "Panel_Version",
+        "PlateID",
+        "QC_Warning",
+        "LOD",
+        "NPX",
+        "Normalization",
+    ]
+    with open(path, "w") as export:
+        export.write(delimiter.join(columns) + "\n")
+        for sample in range(samples):
+            for assay in range(assays):
+                export.write(
+                    delimiter.join(
+                        [
+                            "SAMPLE%05d" % sample,
+                            str(sample + 1),
+                            "OID%05d" % assay,
+                            "P%05d" % assay,
+                            symbols[assay],
+                            "0",
+                            "Olink INFLAMMATION",
+                            "v.3021",
+                            "PLATE%s" % (sample // 88),
+                            "Warning" if rng.random() < 0.05 else "Pass",
+                            str(lods[assay]),
+                            str(round(rng.uniform(-1, 12), 3)),
+                            "Intensity",
+                        ]
+                    )
+                    + "\n"
+                )
+    return path
+
+
+def write_clinical_metadata(path: str, samples: int) -> str:
+    """
+    Writes an olink biorepository workbook laid out the way process_clinical_metadata
+    expects. The sheet is padded with a blank cell in the first row so it is as wide as it
+    is long.
+
+    Arguments:
+        path {str} -- Output path, should end in .xlsx.
+        samples {int} -- Number of sample rows.
+
+    Returns:
+        str -- The path.
+    """
+    header_row = 16
+    width = max(header_row + samples + 1, 12)
+    grid = defaultdict(dict)  # type: Dict[int, Dict[int, str]]
+
+    def put_fields(fields: dict, column: int, first_row: int) -> None:
+        for offset, label in enumerate(fields):
+            grid[first_row + offset][column] = label.capitalize()
+            grid[first_row + offset][column + 1] = "%s value" % fields[label]
+
+    put_fields(MANIFEST_HEADERS, 1, 1)
+    put_fields(SHIPPER_INFO, 1, 8)
+    put_fields(SENDER_ADDRESS, 2, 12)
+    put_fields(SHIPPING_DETAILS, 4, 1)
+    put_fields(RECEIVER_ADDRESS, 5, 5)
+    grid[1][width] = " "
+
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet()
+    for row in range(1, header_row):
+        values = [None] * max(grid[row], default=0)
+        for column, value in grid[row].items():
+            values[column - 1] = value
+        sheet.append(values)
+    sheet.append([header.title() for header in SAMPLE_DESCRIPTION])
+    for sample in range(samples):
+        sheet.append(["%s %s" % (header, sample) for header in SAMPLE_DESCRIPTION])
+    workbook.save(path)
+    return path
+
+
+def gene_info_text(genes: int) -> str:
+    """
+    Makes the text of an NCBI gene_info file, decompressed.
+
+    Arguments:
+        genes {int} -- Number of genes.
+
+    Returns:
+        str -- File contents.
+    """
+    rng = random.Random(SEED)
+    symbols = gene_symbols(genes)
+    lines = [GENE_INFO_HEADER]
+    for gene_id, symbol in enumerate(symbols):
+        synonyms = "|".join(
+            "%sS%s" % (symbol, i) for i in range(rng.randint(0, 3))
+        ) or "-"
+        lines.append(
+            "\t".join(
+                [
+                    "9606",
+                    str(gene_id),
+                    symbol,
+                    "-",
+                    synonyms,
+                    "HGNC:HGNC:%s" % gene_id,
+                    str(gene_id % 22 + 1),
+                    "1q1",
+                    "synthetic gene",
+                    "protein-coding",
+                    symbol,
+                    "synthetic gene",
+                    "O",
+                    "-",
+                    "20181001",
+                    "-",
+                ]
+            )
+        )
+    return "\n".join(lines)
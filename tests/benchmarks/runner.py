@@ -0,0 +1,414 @@
+#!/usr/bin/env python
+"""
+Benchmarks for the post-processing hot paths. Each case is timed on its own, then run once
+more under tracemalloc for its peak memory, and the results can be written to or compared
+against a JSON baseline.
+
+    python -m tests.benchmarks.runner --scale small --output baseline.json
+    python -m tests.benchmarks.runner --scale small --compare baseline.json
+"""
+__author__ = "Lloyd McCarthy"
+__license__ = "MIT"
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import tracemalloc
+from typing import Callable, Dict, List, NamedTuple
+from unittest.mock import patch
+
+from framework.tasks.data_classes import RecordContext
+from framework.tasks.hugo_tasks import build_gene_collection
+from framework.tasks.process_npx import (
+    process_clinical_metadata,
+    process_olink_long,
+    process_olink_npx,
+)
+from framework.tasks.processing_tasks import combine_mafs, process_table
+from tests.benchmarks.generators import (
+    gene_info_text,
+    write_clinical_metadata,
+    write_maf,
+    write_npx_long,
+    write_npx_workbook,
+    write_table,
+)
+
+# Sizes per scale: table and maf rows, NPX (samples, assays), metadata samples, genes.
+SCALES = {
+    "small": {
+        "table_rows": [1000, 100000],
+        "maf_rows": [1000, 100000],
+        "npx": [(10, 92), (96, 92)],
+        "metadata_samples": [10, 100],
+        "genes": [60000],
+    },
+    "full": {
+        "table_rows": [1000, 100000, 1000000, 10000000],
+        "maf_rows": [1000, 100000, 1000000, 10000000],
+        "npx": [(10, 92), (96, 92), (1000, 368), (5000, 1000)],
+        "metadata_samples": [10, 100, 1000, 5000],
+        "genes": [60000],
+    },
+}
+CONTEXT = RecordContext(trial="trial", assay="assay", record="record")
+# Allowed slowdown or memory growth against a baseline before a case counts as a
+# regression.
+DEFAULT_TOLERANCE = 0.25
+
+
+class Case(NamedTuple):
+    """
+    One benchmark: a function to run on a prepared input, and how many units it handles.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    name: str
+    units: int
+    unit: str
+    run: Callable[[], object]
+    setup: Callable[[], None]
+
+
+class Measurement(NamedTuple):
+    """
+    Result of a benchmark case.
+
+    Arguments:
+        NamedTuple {typing.NamedTuple} -- Instance of the typing module's NamedTuple
+    """
+
+    name: str
+    units: int
+    unit: str
+    wall_seconds: float
+    peak_bytes: int
+    throughput: float
+
+
+def no_setup() -> None:
+    """
+    Setup for cases whose input is not changed by running them.
+    """
+    return None
+
+
+def consume(records) -> int:
+    """
+    Exhausts a list or generator of records.
+
+    Arguments:
+        records {Iterable[dict]} -- Records.
+
+    Returns:
+        int -- Number of records.
+    """
+    count = 0
+    for _ in records:
+        count += 1
+    return count
+
+
+def measure(case: Case, repeat: int = 3) -> Measurement:
+    """
+    Times a case, keeping the best of several runs, then runs it once more under tracemalloc
+    for its peak memory.
+
+    Arguments:
+        case {Case} -- Benchmark case.
+
+    Keyword Arguments:
+        repeat {int} -- Number of timed runs. (default: {3})
+
+    Returns:
+        Measurement -- Results.
+    """
+    best = None
+    for _ in range(repeat):
+        case.setup()
+        start = time.perf_counter()
+        case.run()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    case.setup()
+    tracemalloc.start()
+    try:
+        case.run()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return Measurement(
+        case.name, case.units, case.unit, best, peak, case.units / best if best else 0.0
+    )
+
+
+def build_cases(scale: str, workdir: str) -> List[Case]:
+    """
+    Generates the input files for a scale and builds the cases that use them.
+
+    Arguments:
+        scale {str} -- Key in SCALES.
+        workdir {str} -- Directory for generated files.
+
+    Returns:
+        List[Case] -- Benchmark cases.
+    """
+    sizes = SCALES[scale]
+    cases = []
+
+    for rows in sizes["table_rows"]:
+        path = write_table(os.path.join(workdir, "table_%s.tsv" % rows), rows)
+        for engine in ("python", "typed"):
+            cases.append(
+                Case(
+                    "process_table[%s,%s]" % (engine, rows),
+                    rows,
+                    "rows",
+                    lambda path=path, engine=engine: consume(
+                        process_table(path, CONTEXT, stream=True, engine=engine)
+                    ),
+                    no_setup,
+                )
+            )
+
+    for rows in sizes["maf_rows"]:
+        path = write_maf(os.path.join(workdir, "new_%s.maf" % rows), rows)
+        seed_maf = write_maf(os.path.join(workdir, "seed_%s.maf" % rows), 10)
+        combined = os.path.join(workdir, "combined_%s.maf" % rows)
+        cases.append(
+            Case(
+                "combine_mafs[%s]" % rows,
+                rows,
+                "rows",
+                lambda path=path, combined=combined: combine_mafs(path, combined),
+                lambda seed_maf=seed_maf, combined=combined: shutil.copyfile(
+                    seed_maf, combined
+                ),
+            )
+        )
+
+    for samples, assays in sizes["npx"]:
+        path = write_npx_workbook(
+            os.path.join(workdir, "npx_%s_%s.xlsx" % (samples, assays)), samples, assays
+        )
+        cases.append(
+            Case(
+                "process_olink_npx[%sx%s]" % (samples, assays),
+                samples * assays,
+                "values",
+                lambda path=path: run_binary(process_olink_npx, path),
+                no_setup,
+            )
+        )
+        path = write_npx_long(
+            os.path.join(workdir, "npx_%s_%s.csv" % (samples, assays)), samples, assays
+        )
+        cases.append(
+            Case(
+                "process_olink_long[%sx%s]" % (samples, assays),
+                samples * assays,
+                "values",
+                lambda path=path: run_binary(process_olink_long, path),
+                no_setup,
+            )
+        )
+
+    for samples in sizes["metadata_samples"]:
+        path = write_clinical_metadata(
+            os.path.join(workdir, "biorepository_%s.xlsx" % samples), samples
+        )
+        cases.append(
+            Case(
+                "process_clinical_metadata[%s]" % samples,
+                samples,
+                "samples",
+                lambda path=path: run_binary(process_clinical_metadata, path),
+                no_setup,
+            )
+        )
+
+    for genes in sizes["genes"]:
+        text = gene_info_text(genes)
+        cases.append(
+            Case(
+                "build_gene_collection[%s]" % genes,
+                genes,
+                "genes",
+                lambda text=text: build_gene_collection(text),
+                no_setup,
+            )
+        )
+
+    return cases
+
+
+def run_binary(processor: Callable, path: str) -> object:
+    """
+    Runs a processor on an open file, the way process_file calls it.
+
+    Arguments:
+        processor {Callable} -- Processor function.
+        path {str} -- Input path.
+
+    Returns:
+        object -- Whatever the processor returns.
+    """
+    with open(path, "rb") as source:
+        return processor(source, CONTEXT)
+
+
+def run_benchmarks(scale: str, repeat: int = 3) -> Dict[str, dict]:
+    """
+    Runs every case of a scale. Gene symbol validation is stubbed out so that NPX parsing
+    is measured without calls to the API.
+
+    Arguments:
+        scale {str} -- Key in SCALES.
+
+    Keyword Arguments:
+        repeat {int} -- Number of timed runs per case. (default: {3})
+
+    Returns:
+        Dict[str, dict] -- Measurements by case name.
+    """
+    results = {}
+    workdir = tempfile.mkdtemp(prefix="cidc-bench-")
+    logging.disable(logging.CRITICAL)
+    try:
+        with patch(
+            "framework.tasks.process_npx.check_symbols_valid", return_value=None
+        ):
+            for case in build_cases(scale, workdir):
+                results[case.name] = measure(case, repeat)._asdict()
+    finally:
+        logging.disable(logging.NOTSET)
+        shutil.rmtree(workdir, ignore_errors=True)
+    return results
+
+
+def save_baseline(path: str, scale: str, results: Dict[str, dict]) -> None:
+    """
+    Writes results to a JSON baseline.
+
+    Arguments:
+        path {str} -- Output path.
+        scale {str} -- Scale the results were produced at.
+        results {Dict[str, dict]} -- Measurements by case name.
+    """
+    with open(path, "w") as baseline:
+        json.dump(
+            {
+                "scale": scale,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "results": results,
+            },
+            baseline,
+            indent=2,
+            sort_keys=True,
+        )
+
+
+def compare(
+    baseline: Dict[str, dict],
+    results: Dict[str, dict],
+    tolerance: float = DEFAULT_TOLERANCE,
+) -> List[str]:
+    """
+    Finds the cases that got slower or used more memory than the baseline allows.
+
+    Arguments:
+        baseline {Dict[str, dict]} -- Baseline measurements by case name.
+        results {Dict[str, dict]} -- New measurements by case name.
+
+    Keyword Arguments:
+        tolerance {float} -- Allowed relative growth. (default: {DEFAULT_TOLERANCE})
+
+    Returns:
+        List[str] -- One description per regression.
+    """
+    regressions = []
+    for name, result in sorted(results.items()):
+        if name not in baseline:
+            continue
+        for metric in ("wall_seconds", "peak_bytes"):
+            before = baseline[name][metric]
+            after = result[metric]
+            if before and after > before * (1 + tolerance):
+                regressions.append(
+                    "%s %s went from %s to %s (+%.0f%%)"
+                    % (name, metric, before, after, 100 * (after / before - 1))
+                )
+    return regressions
+
+
+def report(results: Dict[str, dict]) -> str:
+    """
+    Formats results as a table.
+
+    Arguments:
+        results {Dict[str, dict]} -- Measurements by case name.
+
+    Returns:
+        str -- Table, one line per case.
+    """
+    lines = ["%-40s %12s %12s %16s" % ("case", "seconds", "peak MiB", "throughput")]
+    for name, result in results.items():
+        lines.append(
+            "%-40s %12.4f %12.1f %10.0f %s/s"
+            % (
+                name,
+                result["wall_seconds"],
+                result["peak_bytes"] / 2 ** 20,
+                result["throughput"],
+                result["unit"],
+            )
+        )
+    return "\n".join(lines)
+
+
+def main(argv: List[str] = None) -> int:
+    """
+    Command line entry point.
+
+    Keyword Arguments:
+        argv {List[str]} -- Arguments, defaults to sys.argv. (default: {None})
+
+    Returns:
+        int -- Exit status, 1 if a regression was found.
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split("\n")[1])
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="Write results to this JSON baseline.")
+    parser.add_argument("--compare", help="Compare results against this JSON baseline.")
+    parser.add_argument("--tolerance", type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(args.scale, args.repeat)
+    print(report(results))
+    if args.output:
+        save_baseline(args.output, args.scale, results)
+
+    if args.compare:
+        with open(args.compare) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        regressions = compare(baseline, results, args.tolerance)
+        for regression in regressions:
+            print("REGRESSION: %s" % regression)
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
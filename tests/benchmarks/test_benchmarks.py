@@ -0,0 +1,50 @@
+"""
+Benchmarks of the post-processing hot paths. They only run when RUN_BENCHMARKS is set:
+
+    RUN_BENCHMARKS=1 BENCHMARK_SCALE=small BENCHMARK_OUTPUT=baseline.json pytest tests/benchmarks
+    RUN_BENCHMARKS=1 BENCHMARK_BASELINE=baseline.json pytest tests/benchmarks
+"""
+import json
+import os
+
+import pytest
+
+from tests.benchmarks.runner import compare, report, run_benchmarks, save_baseline
+
+
+def test_compare():
+    """
+    Test that only growth past the tolerance counts as a regression.
+    """
+    baseline = {
+        "fast": {"wall_seconds": 1.0, "peak_bytes": 100},
+        "lean": {"wall_seconds": 1.0, "peak_bytes": 100},
+    }
+    results = {
+        "fast": {"wall_seconds": 1.2, "peak_bytes": 100},
+        "lean": {"wall_seconds": 0.5, "peak_bytes": 200},
+        "new": {"wall_seconds": 9.0, "peak_bytes": 900},
+    }
+    regressions = compare(baseline, results, 0.25)
+    assert len(regressions) == 1
+    assert regressions[0].startswith("lean peak_bytes")
+
+
+@pytest.mark.skipif(
+    not os.environ.get("RUN_BENCHMARKS"), reason="Set RUN_BENCHMARKS to run benchmarks"
+)
+def test_benchmarks():
+    """
+    Runs the benchmarks, optionally saving and comparing baselines.
+    """
+    scale = os.environ.get("BENCHMARK_SCALE", "small")
+    results = run_benchmarks(scale)
+    print(report(results))
+
+    if os.environ.get("BENCHMARK_OUTPUT"):
+        save_baseline(os.environ["BENCHMARK_OUTPUT"], scale, results)
+
+    if os.environ.get("BENCHMARK_BASELINE"):
+        with open(os.environ["BENCHMARK_BASELINE"]) as baseline_file:
+            baseline = json.load(baseline_file)["results"]
+        assert not compare(baseline, results)
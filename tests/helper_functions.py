@@ -4,7 +4,19 @@ Helper methods for unit tests.
 """
 __author__="Lloyd McCarthy"
 __license__="MIT"
+import base64
+import hashlib
+import json
+import zlib
 from typing import NamedTuple
+from urllib.parse import parse_qs
+
+from google.api_core.exceptions import (
+    BadRequest,
+    NotFound,
+    PreconditionFailed,
+    ServiceUnavailable,
+)
 
 
 class FakeFetcher(object):
@@ -100,3 +112,404 @@ class FakeClient(object):
             FakeBucket -- Fake google bucket.
         """
         return FakeBucket(bucket_name)
+
+
+class FakeConnection(object):
+    """
+    Simulates the data socket of an FTP transfer.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self, data: bytes, block_size: int = 7, fail_after: int = None):
+        """
+        Constructor
+
+        Arguments:
+            data {bytes} -- Bytes sent over the connection.
+
+        Keyword Arguments:
+            block_size {int} -- Most bytes returned by one recv. (default: {7})
+            fail_after {int} -- Bytes sent before the connection resets. (default: {None})
+        """
+        self.data = data
+        self.block_size = block_size
+        self.fail_after = fail_after
+        self.closed = False
+
+    def recv(self, size: int) -> bytes:
+        """
+        Returns the next bytes of the transfer, at most block_size of them.
+
+        Arguments:
+            size {int} -- Bytes requested.
+
+        Returns:
+            bytes -- Data, empty once the transfer is complete.
+        """
+        size = min(size, self.block_size)
+        if self.fail_after is not None:
+            if self.fail_after <= 0:
+                raise ConnectionResetError("Connection reset by peer")
+            size = min(size, self.fail_after)
+            self.fail_after -= size
+        block = self.data[:size]
+        self.data = self.data[len(block) :]
+        return block
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.closed = True
+
+
+class FakeFTP(object):
+    """
+    Local stand-in for ftplib.FTP serving files from a dictionary. Pass
+    lambda host: fake_ftp wherever an FTP class is expected.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(
+        self, files: dict, modified: str = "20180805000000", fail_after: int = None
+    ):
+        """
+        Constructor
+
+        Arguments:
+            files {dict} -- File contents, bytes, by name.
+
+        Keyword Arguments:
+            modified {str} -- MDTM timestamp of every file. (default: {"20180805000000"})
+            fail_after {int} -- Bytes a transfer sends before its connection resets.
+                (default: {None})
+        """
+        self.files = files
+        self.modified = modified
+        self.fail_after = fail_after
+        self.commands = []
+        self.connections = []
+        self.closed = False
+
+    def login(self):
+        """
+        Anonymous login.
+        """
+        self.commands.append("USER anonymous")
+        return "230 Login successful."
+
+    def cwd(self, directory: str):
+        """
+        Changes directory.
+
+        Arguments:
+            directory {str} -- Directory.
+        """
+        self.commands.append("CWD %s" % directory)
+        return "250 OK"
+
+    def voidcmd(self, command: str):
+        """
+        Sends a command expecting a success response.
+
+        Arguments:
+            command {str} -- Command.
+        """
+        self.commands.append(command)
+        return "200 OK"
+
+    def sendcmd(self, command: str) -> str:
+        """
+        Sends a command, only MDTM is supported.
+
+        Arguments:
+            command {str} -- Command.
+
+        Returns:
+            str -- Response.
+        """
+        self.commands.append(command)
+        return "213 %s" % self.modified
+
+    def size(self, file_name: str) -> int:
+        """
+        Gets the size of a file.
+
+        Arguments:
+            file_name {str} -- Name of file.
+
+        Returns:
+            int -- Size in bytes.
+        """
+        self.commands.append("SIZE %s" % file_name)
+        return len(self.files[file_name])
+
+    def transfercmd(self, command: str, rest: int = None) -> FakeConnection:
+        """
+        Starts a transfer.
+
+        Arguments:
+            command {str} -- RETR command.
+
+        Keyword Arguments:
+            rest {int} -- Offset to start from. (default: {None})
+
+        Returns:
+            FakeConnection -- Data connection.
+        """
+        self.commands.append(command if rest is None else "%s REST %s" % (command, rest))
+        connection = FakeConnection(
+            self.files[command.split(" ", 1)[1]][rest or 0 :], fail_after=self.fail_after
+        )
+        self.connections.append(connection)
+        return connection
+
+    def voidresp(self):
+        """
+        Reads the response that ends a transfer.
+        """
+        return "226 Transfer complete."
+
+    def close(self):
+        """
+        Closes the connection.
+        """
+        self.closed = True
+
+
+class PagedFetcher(object):
+    """
+    Stands in for SmartFetch, serving a collection in pages like Eve does. Supports where
+    clauses made of $in conditions, and projections.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self, items: list, page_size: int, fail_on_page: int = None):
+        """
+        Constructor
+
+        Arguments:
+            items {list} -- Documents of the collection.
+            page_size {int} -- Items per page.
+
+        Keyword Arguments:
+            fail_on_page {int} -- Page whose request fails. (default: {None})
+        """
+        self.items = items
+        self.page_size = page_size
+        self.fail_on_page = fail_on_page
+        self.endpoints = []
+
+    def get(self, endpoint: str, token: str) -> FakeFetcher:
+        """
+        Serves one page of the items matching the where clause.
+        """
+        self.endpoints.append(endpoint)
+        resource, _, query = endpoint.partition("?")
+        params = parse_qs(query)
+        page = int(params.get("page", ["1"])[0])
+        if page == self.fail_on_page:
+            raise RuntimeError("Request failed with status code 500")
+        items = self.items
+        if "where" in params:
+            for field, condition in json.loads(params["where"][0]).items():
+                items = [item for item in items if item[field] in condition["$in"]]
+        if "projection" in params:
+            fields = set(json.loads(params["projection"][0])) | {"_id", "_etag"}
+            items = [
+                {key: value for key, value in item.items() if key in fields}
+                for item in items
+            ]
+        start = (page - 1) * self.page_size
+        response = {"_items": items[start : start + self.page_size], "_links": {}}
+        if start + self.page_size < len(items):
+            next_query = dict((key, value[0]) for key, value in params.items())
+            next_query["page"] = str(page + 1)
+            response["_links"]["next"] = {
+                "href": "%s?%s"
+                % (
+                    resource,
+                    "&".join("%s=%s" % pair for pair in next_query.items()),
+                )
+            }
+        return FakeFetcher(response)
+
+
+class MemoryBlob(object):
+    """
+    Simulates a GCS blob handle over a MemoryBucket. Like the real client, a handle's
+    properties are only refreshed by reload and by the calls that write the object.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self, bucket, name: str):
+        """
+        Constructor
+
+        Arguments:
+            bucket {MemoryBucket} -- Bucket holding the object.
+            name {str} -- Object name.
+        """
+        self.bucket = bucket
+        self.name = name
+        self.generation = None
+        self.component_count = None
+        self.content_type = None
+        self.metadata = None
+        self.size = None
+        self.md5_hash = None
+        self.crc32c = None
+
+    def _stored(self) -> dict:
+        stored = self.bucket.objects.get(self.name)
+        if stored is None:
+            raise NotFound(self.name)
+        return stored
+
+    def _check(self, if_generation_match: int = None) -> None:
+        if if_generation_match is None:
+            return
+        stored = self.bucket.objects.get(self.name)
+        if (stored["generation"] if stored else 0) != if_generation_match:
+            raise PreconditionFailed(self.name)
+
+    def _load(self, stored: dict) -> None:
+        self.generation = stored["generation"]
+        self.component_count = stored["component_count"]
+        self.content_type = stored["content_type"]
+        self.metadata = dict(stored["metadata"]) if stored["metadata"] else None
+        self.size = len(stored["data"])
+        # Like GCS, composite objects only have a crc32c.
+        digest = hashlib.md5(stored["data"]).digest()
+        self.md5_hash = None if self.component_count else base64.b64encode(digest).decode()
+        self.crc32c = zlib.crc32(stored["data"])
+
+    def _store(self, data: bytes, component_count: int = None) -> None:
+        self.bucket.generations += 1
+        stored = {
+            "data": data,
+            "generation": self.bucket.generations,
+            "component_count": component_count,
+            "content_type": self.content_type,
+            "metadata": dict(self.metadata) if self.metadata else None,
+        }
+        self.bucket.objects[self.name] = stored
+        self._load(stored)
+
+    def reload(self) -> None:
+        self._load(self._stored())
+
+    def upload_from_string(self, data, if_generation_match: int = None) -> None:
+        self._check(if_generation_match)
+        self._store(data.encode() if isinstance(data, str) else data)
+
+    def upload_from_file(
+        self,
+        handle,
+        rewind: bool = False,
+        content_type: str = None,
+        if_generation_match: int = None,
+    ) -> None:
+        if rewind:
+            handle.seek(0)
+        self._check(if_generation_match)
+        self.content_type = content_type or self.content_type
+        self._store(handle.read())
+
+    def download_as_string(self) -> bytes:
+        return self._stored()["data"]
+
+    def download_to_file(self, handle, if_generation_match: int = None) -> None:
+        self._check(if_generation_match)
+        handle.write(self._stored()["data"])
+
+    def delete(self, if_generation_match: int = None) -> None:
+        self._stored()
+        self._check(if_generation_match)
+        del self.bucket.objects[self.name]
+
+    def compose(self, sources: list, if_generation_match: int = None) -> None:
+        """
+        Concatenates sources into this object. The bucket's lose_compose-th compose is
+        applied, then fails as if its response had been lost.
+        """
+        self._check(if_generation_match)
+        parts = [source._stored() for source in sources]
+        component_count = sum(part["component_count"] or 1 for part in parts)
+        if component_count > 1024:
+            raise BadRequest("Too many components")
+        self.bucket.composes += 1
+        if self.bucket.composes == self.bucket.lose_compose:
+            # Applied, but this handle never hears back.
+            handle = MemoryBlob(self.bucket, self.name)
+            handle.content_type, handle.metadata = self.content_type, self.metadata
+            handle._store(b"".join(part["data"] for part in parts), component_count)
+            raise ServiceUnavailable("Connection lost")
+        self._store(b"".join(part["data"] for part in parts), component_count)
+
+
+class MemoryBucket(object):
+    """
+    Simulates a GCS bucket, holding objects in a dictionary.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self, name: str):
+        """
+        Constructor
+
+        Arguments:
+            name {str} -- Bucket name.
+        """
+        self.name = name
+        self.objects = {}
+        self.generations = 0
+        self.composes = 0
+        self.lose_compose = None
+
+    def blob(self, name: str) -> MemoryBlob:
+        return MemoryBlob(self, name)
+
+    def get_blob(self, name: str) -> MemoryBlob:
+        if name not in self.objects:
+            return None
+        blob = self.blob(name)
+        blob.reload()
+        return blob
+
+    def list_blobs(self, prefix: str = "") -> list:
+        return [
+            self.get_blob(name) for name in sorted(self.objects) if name.startswith(prefix)
+        ]
+
+    def copy_blob(self, blob: MemoryBlob, destination, name: str) -> MemoryBlob:
+        copied = destination.blob(name)
+        stored = blob._stored()
+        copied.content_type = stored["content_type"]
+        copied._store(stored["data"], stored["component_count"])
+        return copied
+
+
+class MemoryClient(object):
+    """
+    Simulates a GCS client whose buckets live in memory.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self):
+        self.buckets = {}
+
+    def bucket(self, name: str) -> MemoryBucket:
+        return self.buckets.setdefault(name, MemoryBucket(name))
@@ -0,0 +1,137 @@
+"""
+Tests for the analysis_tasks module.
+"""
+import threading
+import time
+from unittest.mock import patch
+
+from framework.tasks.analysis_tasks import (
+    RecordPatch,
+    check_processed,
+    patched_records,
+    pooled_session,
+    set_record_processed,
+)
+from tests.helper_functions import PagedFetcher
+
+
+class FakeResponse(object):
+    """
+    Response with a status code and a JSON body.
+    """
+
+    def __init__(self, status_code: int, body: dict = None):
+        self.status_code = status_code
+        self.body = body or {}
+
+    def json(self) -> dict:
+        return self.body
+
+
+class FakeRecordSession(object):
+    """
+    Stands in for requests.Session, holding records whose ETag changes on every patch.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(self, etags: dict, broken: tuple = ()):
+        """
+        Constructor
+
+        Arguments:
+            etags {dict} -- Current ETag by record id.
+
+        Keyword Arguments:
+            broken {tuple} -- Ids of records whose patches get a 500. (default: {()})
+        """
+        self.etags = etags
+        self.broken = broken
+        self.processed = {}
+        self.gets = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def patch(self, url: str, json: dict, headers: dict) -> FakeResponse:
+        """
+        Patches a record if its ETag matches.
+        """
+        record_id = url.rsplit("/", 1)[1]
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+        time.sleep(0.01)
+        with self.lock:
+            self.in_flight -= 1
+            if record_id in self.broken:
+                return FakeResponse(500)
+            if headers["If-Match"] != self.etags[record_id]:
+                return FakeResponse(412)
+            self.etags[record_id] += "+"
+            self.processed[record_id] = json["processed"]
+            return FakeResponse(200, {"_etag": self.etags[record_id]})
+
+    def get(self, url: str, headers: dict) -> FakeResponse:
+        """
+        Reads a record.
+        """
+        record_id = url.rsplit("/", 1)[1]
+        self.gets.append(record_id)
+        return FakeResponse(200, {"_id": record_id, "_etag": self.etags[record_id]})
+
+
+def test_set_record_processed():
+    """
+    Test concurrent patches, ETag conflicts and per record outcomes.
+    """
+    etags = {"r%s" % i: "e%s" % i for i in range(20)}
+    records = [{"_id": record_id, "_etag": etag} for record_id, etag in etags.items()]
+    # Someone else changed r3 since it was read.
+    etags["r3"] = "changed"
+    session = FakeRecordSession(dict(etags), broken=("r7",))
+
+    with patch(
+        "framework.tasks.analysis_tasks.pooled_session", return_value=session
+    ), patch("framework.tasks.analysis_tasks.RECORD_PATCH_CONCURRENCY", 4):
+        outcomes = set_record_processed(records, True, "t")
+
+    assert [outcome.record_id for outcome in outcomes] == list(etags)
+    assert outcomes[3] == RecordPatch("r3", True, 200, "changed+")
+    assert outcomes[7] == RecordPatch("r7", False, 500, None)
+    assert session.gets == ["r3"]
+    assert 1 < session.most_in_flight <= 4
+    assert sorted(session.processed) == sorted(set(etags) - {"r7"})
+
+    # Undo exactly what was patched, with the new ETags.
+    claimed = patched_records(outcomes)
+    assert len(claimed) == 19
+    with patch(
+        "framework.tasks.analysis_tasks.pooled_session", return_value=session
+    ):
+        undone = set_record_processed(claimed, False, "t")
+    assert all(outcome.ok for outcome in undone)
+    assert session.gets == ["r3"]
+    assert not any(session.processed.values())
+    assert set_record_processed([], True, "t") == []
+
+
+def test_pooled_session():
+    """
+    Test that the session is reused within a process.
+    """
+    assert pooled_session() is pooled_session()
+
+
+def test_check_processed():
+    """
+    Test that records on every page of the response are checked.
+    """
+    data = [{"_id": "r%s" % i, "processed": i == 30} for i in range(40)]
+    fetcher = PagedFetcher(data, 4)
+    with patch("framework.tasks.analysis_tasks.EVE_FETCHER", fetcher):
+        records, all_free = check_processed(data[20:35], "t")
+    assert [record["_id"] for record in records] == ["r%s" % i for i in range(20, 35)]
+    assert not all_free
+    assert len(fetcher.endpoints) == 4
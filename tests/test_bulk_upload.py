@@ -0,0 +1,155 @@
+"""
+Tests for the bulk_upload module.
+"""
+import json
+import threading
+import time
+
+import requests
+
+from framework.tasks.bulk_upload import BulkUploader, UploadTally
+
+
+class FakeResponse(object):
+    """
+    Response with a status code and text.
+    """
+
+    def __init__(self, status_code: int, text: str = ""):
+        self.status_code = status_code
+        self.text = text
+
+
+class FakeSession(object):
+    """
+    Stands in for requests.Session, recording the documents of accepted posts.
+
+    Arguments:
+        object {[type]} -- [description]
+    """
+
+    def __init__(
+        self,
+        max_body: int = None,
+        failures: int = 0,
+        status: int = 503,
+        latency: float = 0,
+    ):
+        """
+        Constructor
+
+        Keyword Arguments:
+            max_body {int} -- Bodies larger than this get a 413. (default: {None})
+            failures {int} -- Posts that fail before any succeeds. (default: {0})
+            status {int} -- Status of the failures, None to raise. (default: {503})
+            latency {float} -- Seconds each post takes. (default: {0})
+        """
+        self.max_body = max_body
+        self.failures = failures
+        self.status = status
+        self.latency = latency
+        self.received = []
+        self.bodies = []
+        self.in_flight = 0
+        self.most_in_flight = 0
+        self.lock = threading.Lock()
+
+    def post(self, url: str, data: bytes, headers: dict) -> FakeResponse:
+        """
+        Posts a chunk.
+        """
+        with self.lock:
+            self.in_flight += 1
+            self.most_in_flight = max(self.most_in_flight, self.in_flight)
+            self.bodies.append(len(data))
+        try:
+            time.sleep(self.latency)
+            with self.lock:
+                if self.max_body is not None and len(data) > self.max_body:
+                    return FakeResponse(413)
+                if self.failures:
+                    self.failures -= 1
+                    if self.status is None:
+                        raise requests.ConnectionError("Connection refused")
+                    return FakeResponse(self.status, "Service Unavailable")
+                assert headers["Authorization"] == "Bearer t"
+                self.received.extend(json.loads(data.decode("utf-8")))
+                return FakeResponse(201)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+
+DOCUMENTS = [{"symbol": "SYMBOL%s" % i} for i in range(2000)]
+
+
+def uploader(session: FakeSession, **kwargs) -> BulkUploader:
+    """
+    Builds an uploader for tests, without retry delays.
+    """
+    options = {"max_bytes": 4096, "min_bytes": 512, "retry_delay": 0}
+    options.update(kwargs)
+    return BulkUploader("http://eve/gene_symbols", "t", session=session, **options)
+
+
+def test_upload():
+    """
+    Test that every document is posted once, within the byte and concurrency limits.
+    """
+    session = FakeSession(latency=0.002)
+    tally = uploader(session, max_in_flight=3).upload(DOCUMENTS)
+    assert tally.complete
+    assert tally == UploadTally(2000, 2000, 0, tally.requests, 0)
+    assert sorted(session.received, key=str) == sorted(DOCUMENTS, key=str)
+    assert max(session.bodies) <= 4096
+    assert session.most_in_flight <= 3
+    assert uploader(session).upload([]) == UploadTally(0, 0, 0, 0, 0)
+
+
+def test_upload_adapts_chunk_size():
+    """
+    Test that chunks grow while responses are fast and shrink when they are slow.
+    """
+    fast = uploader(FakeSession(), max_in_flight=1)
+    fast.upload(DOCUMENTS)
+    assert fast.budget == 4096
+
+    slow = uploader(FakeSession(latency=0.01), max_in_flight=1, target_latency=0.001)
+    slow.upload(DOCUMENTS[:200])
+    assert slow.budget == 512
+
+
+def test_upload_splits_large_chunks():
+    """
+    Test that chunks rejected as too large are split until they fit.
+    """
+    session = FakeSession(max_body=700)
+    upload = uploader(session)
+    tally = upload.upload(DOCUMENTS[:300])
+    assert tally.complete and tally.retries == 0
+    assert sorted(session.received, key=str) == sorted(DOCUMENTS[:300], key=str)
+    assert upload.budget <= upload.max_bytes < 1024
+
+    # A single document that is too large can't be split.
+    tally = uploader(FakeSession(max_body=10)).upload(DOCUMENTS[:1])
+    assert tally == UploadTally(1, 0, 1, 1, 0)
+    assert not tally.complete
+
+
+def test_upload_retries():
+    """
+    Test that server and connection errors are retried, up to max_retries times.
+    """
+    for status in [503, None]:
+        session = FakeSession(failures=2, status=status)
+        tally = uploader(session, max_in_flight=1).upload(DOCUMENTS[:100])
+        assert tally.complete and tally.retries == 2
+        assert sorted(session.received, key=str) == sorted(DOCUMENTS[:100], key=str)
+
+    session = FakeSession(failures=100)
+    tally = uploader(session, max_retries=2).upload(DOCUMENTS[:10])
+    assert tally == UploadTally(10, 0, 10, 3, 2)
+
+    # Client errors are not retried.
+    tally = uploader(FakeSession(failures=1, status=422)).upload(DOCUMENTS[:10])
+    assert tally == UploadTally(10, 0, 10, 1, 0)
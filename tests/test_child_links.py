@@ -0,0 +1,113 @@
+"""
+Tests for the child_links module.
+"""
+import os
+import time
+
+from framework.tasks.child_links import ChildLinkAggregator
+
+
+def recorder(calls, result=True):
+    """
+    Makes a flush function that records what it was called with.
+    """
+
+    def flush_parent(parent_id, links):
+        calls.append((parent_id, [link["_id"] for link in links]))
+        return result
+
+    return flush_parent
+
+
+def test_flush_groups_by_parent():
+    """
+    Test that buffered links are flushed once per parent.
+    """
+    calls = []
+    aggregator = ChildLinkAggregator(recorder(calls), 60, 100)
+    aggregator.add("p1", [{"_id": "a"}])
+    aggregator.add("p2", [{"_id": "b"}])
+    aggregator.add("p1", [{"_id": "c"}, {"_id": "d"}])
+    assert not calls
+    assert aggregator.flush() == 4
+    assert calls == [("p1", ["a", "c", "d"]), ("p2", ["b"])]
+    assert aggregator.flush() == 0
+
+
+def test_flush_triggers():
+    """
+    Test flushing on a zero window, a full buffer and an elapsed window.
+    """
+    calls = []
+    ChildLinkAggregator(recorder(calls), 0, 100).add("p1", [{"_id": "a"}])
+    assert calls == [("p1", ["a"])]
+
+    calls = []
+    aggregator = ChildLinkAggregator(recorder(calls), 60, 2)
+    aggregator.add("p1", [{"_id": "a"}])
+    aggregator.add("p2", [{"_id": "b"}])
+    assert calls == [("p1", ["a"]), ("p2", ["b"])]
+
+    calls = []
+    aggregator = ChildLinkAggregator(recorder(calls), 0.05, 100)
+    aggregator.add("p1", [{"_id": "a"}])
+    deadline = time.time() + 5
+    while not calls and time.time() < deadline:
+        time.sleep(0.01)
+    assert calls == [("p1", ["a"])]
+
+
+def test_failed_flush():
+    """
+    Test that links the flush function could not save are not counted.
+    """
+    calls = []
+    aggregator = ChildLinkAggregator(recorder(calls, result=False), 60, 100)
+    aggregator.add("p1", [{"_id": "a"}])
+    assert aggregator.flush() == 0
+    assert calls == [("p1", ["a"])]
+
+
+def test_flush_survives_a_failing_parent():
+    """
+    Test that a parent whose flush raises doesn't stop the others from being flushed.
+    """
+    calls = []
+
+    def flush_parent(parent_id, links):
+        calls.append(parent_id)
+        if parent_id == "p1":
+            raise IndexError("list index out of range")
+        return True
+
+    aggregator = ChildLinkAggregator(flush_parent, 60, 100)
+    aggregator.add("p1", [{"_id": "a"}])
+    aggregator.add("p2", [{"_id": "b"}, {"_id": "c"}])
+    assert aggregator.flush() == 2
+    assert calls == ["p1", "p2"]
+
+
+def test_journal_replay(tmp_path):
+    """
+    Test that links a process didn't save are replayed, and that held journals aren't.
+    """
+    journal_dir = str(tmp_path / "links")
+    calls = []
+    # A process that was killed with links buffered.
+    killed = ChildLinkAggregator(recorder(calls), 60, 100, journal_dir)
+    killed.add("p1", [{"_id": "a"}])
+    killed.add("p2", [{"_id": "b"}])
+    # A process whose flush failed.
+    failing = ChildLinkAggregator(recorder(calls, result=False), 60, 100, journal_dir)
+    failing.add("p3", [{"_id": "c"}])
+    assert failing.flush() == 0
+    assert len(os.listdir(journal_dir)) == 2
+
+    replaying = ChildLinkAggregator(recorder(calls), 60, 100, journal_dir)
+    # The killed process still holds its journal.
+    assert replaying.replay() == 1
+    killed._journal.close()
+    assert replaying.replay() == 2
+    assert replaying.flush() == 3
+    assert calls[1:] == [("p3", ["c"]), ("p1", ["a"]), ("p2", ["b"])]
+    assert os.listdir(journal_dir) == []
@@ -0,0 +1,81 @@
+"""
+Tests for the cpu_pool module.
+"""
+import os
+import time
+from io import BytesIO
+
+import pytest
+
+from framework.tasks.cpu_pool import CpuPool, pool_source
+from framework.tasks.data_classes import RecordContext
+
+CONTEXT = RecordContext(trial="123", assay="456", record="foo")
+
+
+def read_source(source, context):
+    """
+    Processor returning what it was given.
+    """
+    return source.read(), context.record
+
+
+def hang(source, context):
+    """
+    Processor that never finishes in time.
+    """
+    time.sleep(60)
+
+
+def crash(source, context):
+    """
+    Processor whose process dies.
+    """
+    os._exit(1)
+
+
+def test_pool_source(tmp_path):
+    """
+    Test that files are described by contents or path.
+    """
+    assert pool_source(BytesIO(b"abc")) == ("bytes", b"abc")
+    path = tmp_path / "file.bin"
+    path.write_bytes(b"abc")
+    with open(str(path), "rb") as source:
+        assert pool_source(source) == ("path", str(path))
+
+
+def test_inline():
+    """
+    Test that a pool with no processes runs processors in the caller.
+    """
+    pool = CpuPool(0, 1, 1, [])
+    result = pool.run(lambda source, context: source.read(), BytesIO(b"abc"), CONTEXT)
+    assert result == b"abc"
+
+
+def test_pool():
+    """
+    Test results, unpicklable processors, timeouts and dead pool processes.
+    """
+    pool = CpuPool(1, 5, 1, ["json"])
+    try:
+        assert pool.run(read_source, BytesIO(b"abc"), CONTEXT) == (b"abc", "foo")
+
+        start = time.monotonic()
+        with pytest.raises(TypeError):
+            pool.run(lambda source, context: None, BytesIO(b"abc"), CONTEXT)
+        assert time.monotonic() - start < 1
+
+        start = time.monotonic()
+        with pytest.raises(TimeoutError):
+            pool.run(hang, BytesIO(b"abc"), CONTEXT)
+        assert time.monotonic() - start < 5
+
+        with pytest.raises(ChildProcessError):
+            pool.run(crash, BytesIO(b"abc"), CONTEXT)
+
+        # The pool recovers from both.
+        assert pool.run(read_source, BytesIO(b"def"), CONTEXT) == (b"def", "foo")
+    finally:
+        pool.close()
@@ -0,0 +1,95 @@
+"""
+Tests for the eve_query module.
+"""
+import json
+import time
+from urllib.parse import quote, urlsplit
+
+import pytest
+
+from framework.tasks.eve_query import (
+    chunk_values,
+    iter_items,
+    iter_where_in,
+    query_endpoint,
+)
+from tests.helper_functions import PagedFetcher
+
+
+ITEMS = [{"_id": "id%s" % i, "n": i} for i in range(25)]
+
+
+def test_iter_items():
+    """
+    Test that every page is read, with and without prefetching.
+    """
+    for prefetch in [True, False]:
+        fetcher = PagedFetcher(ITEMS, 10)
+        assert list(iter_items(fetcher, "data", "t", prefetch)) == ITEMS
+        assert fetcher.endpoints == ["data", "data?page=2", "data?page=3"]
+
+    fetcher = PagedFetcher(ITEMS, 10)
+    items = iter_items(fetcher, "data", "t")
+    assert next(items) == ITEMS[0]
+    # The second page is fetched while the first is consumed.
+    for _ in range(100):
+        if len(fetcher.endpoints) > 1:
+            break
+        time.sleep(0.01)
+    assert fetcher.endpoints == ["data", "data?page=2"]
+
+    with pytest.raises(RuntimeError):
+        list(iter_items(PagedFetcher(ITEMS, 10, fail_on_page=3), "data", "t"))
+
+
+def test_chunk_values():
+    """
+    Test that $in clauses are split to stay within the length limit.
+    """
+    values = ["value-%s" % i for i in range(200)]
+    chunks = list(chunk_values({"trial": "t"}, "_id", values, max_length=300))
+    assert len(chunks) > 1
+    assert [value for chunk in chunks for value in chunk] == values
+    for chunk in chunks:
+        where = json.dumps({"trial": "t", "_id": {"$in": chunk}})
+        assert len(quote(where)) <= 300
+    # A value longer than the limit still gets a query of its own.
+    assert list(chunk_values({}, "_id", ["x" * 400, "y"], max_length=300)) == [
+        ["x" * 400],
+        ["y"],
+    ]
+
+
+def test_iter_where_in():
+    """
+    Test that chunked, paged $in queries return every match once.
+    """
+    fetcher = PagedFetcher(ITEMS, 4)
+    wanted = ["id%s" % i for i in range(0, 25, 2)] + ["id0", "missing"]
+    results = list(
+        iter_where_in(fetcher, "data", "t", "_id", wanted, max_length=120)
+    )
+    assert sorted(item["n"] for item in results) == list(range(0, 25, 2))
+    queries = set(
+        urlsplit(endpoint).query.split("&page")[0] for endpoint in fetcher.endpoints
+    )
+    assert len(queries) > 1
+    assert len(fetcher.endpoints) > len(queries)
+
+
+def test_projection():
+    """
+    Test that only the requested fields are asked for, on every page.
+    """
+    assert query_endpoint("accounts", {"a": 1}) == 'accounts?where={"a": 1}'
+    assert query_endpoint("accounts", {"a": 1}, ["email"]) == (
+        'accounts?where={"a": 1}&projection={"email": 1}'
+    )
+
+    items = [dict(item, _etag="e", extra="x" * 100) for item in ITEMS]
+    fetcher = PagedFetcher(items, 10)
+    wanted = [item["_id"] for item in items]
+    results = list(iter_where_in(fetcher, "data", "t", "_id", wanted, fields=["n"]))
+    assert results == [{"_id": item["_id"], "_etag": "e", "n": item["n"]} for item in items]
+    assert len(fetcher.endpoints) == 3
+    assert all("projection" in endpoint for endpoint in fetcher.endpoints)
@@ -2,7 +2,30 @@
 Testing for hugo tasks
 """
 from unittest.mock import patch
-from framework.tasks.hugo_tasks import check_symbols_valid, build_gene_collection
+import gzip
+
+import pytest
+
+from framework.tasks.bulk_upload import UploadTally
+from framework.tasks.hugo_tasks import (
+    HUGO_FILE_NAME,
+    build_gene_collection,
+    check_symbols_valid,
+    decompress_lines,
+    iter_cached_ftp_blocks,
+    lookup_symbols,
+    refresh_hugo_defs,
+    remote_file_info,
+    RemoteFile,
+)
+from framework.tasks.symbol_index import (
+    SNAPSHOT_FILE,
+    SymbolIndex,
+    SymbolIndexLoader,
+    load_snapshot,
+)
+from framework.tasks.symbol_validation import SymbolBatcher
+from tests.helper_functions import FakeFetcher, FakeFTP
 
 
 def test_build_gene_collection():
@@ -18,6 +41,54 @@ def test_build_gene_collection():
         + "20180805	-"
     )
     assert len(build_gene_collection(tsv)) == 5
+    assert len(build_gene_collection(iter(tsv.split("\n")))) == 5
+
+
+def test_decompress_lines():
+    """
+    Test that lines are rebuilt across block boundaries and gzip members.
+    """
+    data = gzip.compress(b"one\ntwo\nthr") + gzip.compress(b"ee\nfour\n")
+    blocks = [data[i : i + 5] for i in range(0, len(data), 5)]
+    assert list(decompress_lines(blocks)) == ["one", "two", "three", "four"]
+
+
+def test_iter_cached_ftp_blocks(tmp_path):
+    """
+    Test streaming a file through a local copy, and resuming an interrupted transfer.
+    """
+    data = bytes(range(256)) * 4
+    part_path = str(tmp_path / "genes.gz.part")
+    ftp = FakeFTP({"genes.gz": data}, fail_after=300)
+    remote = remote_file_info(ftp, "genes.gz")
+    assert remote == RemoteFile("genes.gz", 1024, "20180805000000")
+
+    received = b""
+    stream = iter_cached_ftp_blocks(ftp, remote, part_path, block_size=64)
+    received += next(stream)
+    # Blocks are handed on while most of the file is still to be transferred.
+    assert ftp.connections[0].data
+    with pytest.raises(ConnectionResetError):
+        for block in stream:
+            received += block
+    assert received == data[:300]
+
+    ftp = FakeFTP({"genes.gz": data})
+    assert b"".join(iter_cached_ftp_blocks(ftp, remote, part_path, 64)) == data
+    assert ftp.commands == ["TYPE I", "RETR genes.gz REST 300"]
+    assert ftp.connections[0].closed
+    with open(part_path, "rb") as part:
+        assert part.read() == data
+
+    # A different version of the file starts over.
+    ftp = FakeFTP({"genes.gz": data}, modified="20190101000000")
+    remote = remote_file_info(ftp, "genes.gz")
+    assert b"".join(iter_cached_ftp_blocks(ftp, remote, part_path, 64)) == data
+    assert ftp.commands[-1] == "RETR genes.gz"
+
+    ftp = FakeFTP({"genes.gz": data[:1000]})
+    with pytest.raises(IOError):
+        list(iter_cached_ftp_blocks(ftp, remote, part_path + "2", 64))
 
 
 # def test_check_symbol_valid():
@@ -40,3 +111,198 @@ def test_build_gene_collection():
 #         ):
 #             result = check_symbols_valid(["FOO", "BAR", "ABC", "DEF"])
 #             assert not result
+
+
+def test_check_symbols_valid_local_index(tmp_path):
+    """
+    Test that symbols are validated against the local index without calling the API.
+    """
+    SymbolIndex.build(["FOO", "BAR"]).save(str(tmp_path))
+    with patch(
+        "framework.tasks.hugo_tasks.SYMBOL_INDEX", SymbolIndexLoader(str(tmp_path))
+    ), patch("framework.tasks.hugo_tasks.EVE.get") as get:
+        assert check_symbols_valid(["FOO", "BAR", "FOO"]) is None
+        error = check_symbols_valid(["FOO", "BAZ"])
+    assert error["explanation"] == "Found invalid gene symbols: BAZ"
+    get.assert_not_called()
+
+
+def test_check_symbols_valid_api(tmp_path):
+    """
+    Test the API lookup used before an index is published.
+    """
+    batcher = SymbolBatcher(lookup_symbols, 0, 60, 100)
+    with patch(
+        "framework.tasks.hugo_tasks.SYMBOL_INDEX", SymbolIndexLoader(str(tmp_path))
+    ), patch("framework.tasks.hugo_tasks.SYMBOL_BATCHER", batcher), patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.hugo_tasks.EVE.get",
+        return_value=FakeFetcher({"_items": [{"symbol": "FOO"}]}),
+    ) as get:
+        assert check_symbols_valid(["FOO", "FOO"]) is None
+        error = check_symbols_valid(["FOO", "BAZ"])
+        # Both symbols are cached now.
+        assert check_symbols_valid(["BAZ", "FOO"])
+    assert error["explanation"] == "Found invalid gene symbols: BAZ"
+    assert get.call_count == 2
+
+
+def gene_info(*rows: str) -> list:
+    """
+    Builds the lines of a gene_info file.
+
+    Arguments:
+        rows {str} -- Symbol and pipe separated synonyms of each gene.
+
+    Returns:
+        list -- Lines, starting with the header.
+    """
+    lines = ["#tax_id\tGeneID\tSymbol"]
+    for row in rows:
+        symbol, synonyms = row.split(" ")
+        lines.append("\t".join(["9606", "1", symbol, "-", synonyms] + ["-"] * 6))
+    return lines
+
+
+def complete_upload(documents: list) -> UploadTally:
+    """
+    Stands in for BulkUploader.upload, uploading everything.
+
+    Arguments:
+        documents {list} -- Documents.
+
+    Returns:
+        UploadTally -- A complete tally.
+    """
+    return UploadTally(len(documents), len(documents), 0, 1, 0)
+
+
+def run_refresh(
+    tmp_path,
+    lines: list,
+    max_stale: int = 1000,
+    modified: str = "20180805000000",
+    upload=complete_upload,
+) -> dict:
+    """
+    Runs refresh_hugo_defs on the given gene_info lines with the API mocked.
+
+    Arguments:
+        tmp_path {Path} -- Directory for the index, snapshot and download.
+        lines {list} -- Lines of the download.
+
+    Keyword Arguments:
+        max_stale {int} -- HUGO_MAX_STALE_SYMBOLS. (default: {1000})
+        modified {str} -- MDTM timestamp of the download. (default: {"20180805000000"})
+        upload {Callable} -- Stand-in for BulkUploader.upload. (default: {complete_upload})
+
+    Returns:
+        dict -- The mocks of EVE's post, get and delete.
+    """
+    ftp = FakeFTP(
+        {HUGO_FILE_NAME: gzip.compress("\n".join(lines).encode("utf-8"))}, modified
+    )
+    with patch("framework.tasks.hugo_tasks.SYMBOL_INDEX_DIR", str(tmp_path)), patch(
+        "framework.tasks.hugo_tasks.HUGO_CACHE_DIR", str(tmp_path)
+    ), patch(
+        "framework.tasks.hugo_tasks.HUGO_MAX_STALE_SYMBOLS", max_stale
+    ), patch(
+        "framework.tasks.hugo_tasks.FTP", return_value=ftp
+    ), patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.hugo_tasks.BulkUploader.upload", side_effect=upload
+    ) as post, patch(
+        "framework.tasks.hugo_tasks.EVE.get",
+        return_value=FakeFetcher({"_items": [{"_id": "1", "_etag": "e"}]}),
+    ) as get, patch(
+        "framework.tasks.hugo_tasks.EVE.delete"
+    ) as delete:
+        refresh_hugo_defs()
+    assert ftp.closed
+    return {"post": post, "get": get, "delete": delete, "ftp": ftp}
+
+
+def posted(post) -> list:
+    """
+    Symbols sent by a mocked BulkUploader.upload.
+
+    Arguments:
+        post {MagicMock} -- The mock.
+
+    Returns:
+        list -- Symbols, in order of posting.
+    """
+    return [entry["symbol"] for call in post.call_args_list for entry in call[0][0]]
+
+
+def test_refresh_hugo_defs_differential(tmp_path):
+    """
+    Test that the first refresh rebuilds the collection and later ones only post new
+    symbols.
+    """
+    snapshot = str(tmp_path / SNAPSHOT_FILE)
+    calls = run_refresh(tmp_path, gene_info("A1BG A1B|ABG", "TP53 P53|LFS1"))
+    calls["delete"].assert_called_once()
+    assert posted(calls["post"]) == ["A1B", "A1BG", "ABG", "LFS1", "P53", "TP53"]
+    assert load_snapshot(snapshot) == {"A1B", "A1BG", "ABG", "LFS1", "P53", "TP53"}
+
+    # An unchanged file is not downloaded.
+    calls = run_refresh(tmp_path, gene_info("A1BG A1B|ABG", "TP53 P53|LFS1"))
+    assert "RETR %s" % HUGO_FILE_NAME not in calls["ftp"].commands
+    calls["post"].assert_not_called()
+
+    # A new file with the same symbols is downloaded, but nothing is written.
+    calls = run_refresh(
+        tmp_path, gene_info("A1BG A1B|ABG", "TP53 LFS1|P53"), modified="20180806000000"
+    )
+    assert "RETR %s" % HUGO_FILE_NAME in calls["ftp"].commands
+    for name in ["post", "get", "delete"]:
+        calls[name].assert_not_called()
+
+    # A new synonym, and a removed one, which stays in the collection.
+    calls = run_refresh(
+        tmp_path, gene_info("A1BG A1B|ABG", "TP53 P53|BCC7"), modified="20180807000000"
+    )
+    calls["get"].assert_not_called()
+    calls["delete"].assert_not_called()
+    assert posted(calls["post"]) == ["BCC7"]
+    assert "LFS1" in load_snapshot(snapshot)
+
+    # Too many removed symbols trigger a rebuild.
+    calls = run_refresh(
+        tmp_path, gene_info("A1BG A1B|ABG"), max_stale=2, modified="20180808000000"
+    )
+    calls["delete"].assert_called_once()
+    assert posted(calls["post"]) == ["A1B", "A1BG", "ABG"]
+    assert load_snapshot(snapshot) == {"A1B", "A1BG", "ABG"}
+
+
+def test_refresh_hugo_defs_corrupt_snapshot(tmp_path):
+    """
+    Test that a corrupt snapshot or a failed write leads to a rebuild.
+    """
+    snapshot = tmp_path / SNAPSHOT_FILE
+    run_refresh(tmp_path, gene_info("A1BG A1B|ABG"))
+    snapshot.write_text(snapshot.read_text().replace("A1B", "A2B"))
+    calls = run_refresh(tmp_path, gene_info("A1BG A1B|ABG"), modified="20180806000000")
+    calls["delete"].assert_called_once()
+    assert posted(calls["post"]) == ["A1B", "A1BG", "ABG"]
+
+    # One symbol could not be posted.
+    run_refresh(
+        tmp_path,
+        gene_info("A1BG A1B|ABG|XYZ"),
+        modified="20180807000000",
+        upload=lambda documents: UploadTally(1, 0, 1, 4, 3),
+    )
+    assert not snapshot.exists()
+
+    # The failed refresh is not skipped next time.
+    calls = run_refresh(
+        tmp_path, gene_info("A1BG A1B|ABG|XYZ"), modified="20180807000000"
+    )
+    assert posted(calls["post"]) == ["A1B", "A1BG", "ABG", "XYZ"]
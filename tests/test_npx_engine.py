@@ -0,0 +1,162 @@
+"""
+Tests for the npx_engine module.
+"""
+from unittest.mock import patch
+
+import numpy as np
+from openpyxl import Workbook, load_workbook
+from openpyxl.styles import Color, Font, PatternFill
+
+from framework.tasks.data_classes import RecordContext
+from framework.tasks.npx_engine import read_npx_sheet, style_flag_table, style_flags
+from framework.tasks.process_npx import (
+    OLINK_FIRST_COLUMN,
+    columnar_to_legacy,
+    process_olink_npx,
+)
+
+NPX_ROWS = [
+    ["NPX data", "NPX Manager 1.0"],
+    ["Panel", "Olink INFLAMMATION", "Olink INFLAMMATION"],
+    ["Assay", "IL8", "VEGFA", "Plate ID", "QC Warning"],
+    ["Uniprot ID", "P10145", "P15692"],
+    ["OlinkID", "OID00001", "OID00002"],
+    ["S1", 1.5, 2.5, "PLATE1", "Pass"],
+    ["S2", 3.5, None, "PLATE1", "Warning"],
+    ["LOD", 0.5, 0.25],
+    ["Missing Data freq.", "0%", "50%"],
+]
+
+
+def write_workbook(path, rows):
+    """
+    Writes rows to a workbook, giving B6 a font color and C6 a fill.
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    for row in rows:
+        sheet.append(row)
+    sheet["B6"].font = Font(color=Color(rgb="FFFF0000"))
+    sheet["C6"].fill = PatternFill(
+        fill_type="solid", fgColor=Color(rgb="FFC0C0C0"), bgColor=Color(rgb="FFC0C0C0")
+    )
+    workbook.save(path)
+    return path
+
+
+def read_sheet(path):
+    """
+    Parses a workbook with the engine.
+    """
+    workbook = load_workbook(path, read_only=True)
+    try:
+        return read_npx_sheet(workbook.active, OLINK_FIRST_COLUMN)
+    finally:
+        workbook.close()
+
+
+def test_read_npx_sheet(tmp_path):
+    """
+    Test that assays, results and samples are read in one pass.
+    """
+    sheet = read_sheet(write_workbook(str(tmp_path / "npx.xlsx"), NPX_ROWS))
+    assert sheet.version == "NPX Manager 1.0"
+    assert sheet.first_column == OLINK_FIRST_COLUMN
+    assert sheet.has_mdf and sheet.samples_match
+    assert [assay["assay"] for assay in sheet.assays] == ["IL8", "VEGFA"]
+    assert sheet.assays[1]["lod"] == 0.25
+    assert sheet.assays[1]["missing_data_freq"] == "50%"
+    assert sheet.result_sample_ids == ["S1", "S2"]
+    il8, vegfa = [assay["results"] for assay in sheet.assays]
+    assert il8["qc_fail"][0]
+    assert il8["value"].tolist() == [1.5, 3.5]
+    assert vegfa["below_lod"].tolist() == [True, False]
+    assert vegfa["value"][0] == 2.5 and np.isnan(vegfa["value"][1])
+    assert sheet.samples == [
+        {"sample_id": "S1", "qc_status": "Pass", "plate_id": "PLATE1"},
+        {"sample_id": "S2", "qc_status": "Warning", "plate_id": "PLATE1"},
+    ]
+
+
+def test_read_npx_sheet_gap_in_samples(tmp_path):
+    """
+    Test that a blank row between samples is reported instead of misaligning results.
+    """
+    rows = NPX_ROWS[:6] + [[None]] + NPX_ROWS[6:]
+    sheet = read_sheet(write_workbook(str(tmp_path / "npx.xlsx"), rows))
+    assert not sheet.samples_match
+    assert sheet.result_sample_ids == []
+    assert [len(assay["results"]["value"]) for assay in sheet.assays] == [0, 0]
+
+
+def test_process_olink_npx(tmp_path):
+    """
+    Test the record built from an NPX workbook and its validation errors.
+    """
+    context = RecordContext(trial="123", assay="456", record="foo")
+    path = write_workbook(str(tmp_path / "npx.xlsx"), NPX_ROWS)
+    with patch("framework.tasks.process_npx.check_symbols_valid", return_value=None):
+        with open(path, "rb") as source:
+            record = process_olink_npx(source, context)
+    assert record["validation_errors"] == []
+    assert record["ol_panel_type"] == "Olink INFLAMMATION"
+    assert record["npx_m_ver"] == "NPX Manager 1.0"
+    assert len(record["ol_assay"]) == 2
+    assert len(record["samples"]) == 2
+    assert "result_layout" not in record
+    assert record["ol_assay"][1]["results"][1] == {
+        "sample_id": "S2",
+        "value": None,
+        "qc_fail": True,
+        "below_lod": False,
+    }
+
+    path = write_workbook(str(tmp_path / "broken.xlsx"), NPX_ROWS[:4])
+    with patch("framework.tasks.process_npx.check_symbols_valid", return_value=None):
+        with open(path, "rb") as source:
+            record = process_olink_npx(source, context)
+    assert [error["severity"] for error in record["validation_errors"]] == [
+        "WARNING",
+        "CRITICAL",
+    ]
+
+
+def test_style_flag_table(tmp_path):
+    """
+    Test that flags looked up by style id match the ones resolved from each cell's style.
+    """
+    path = write_workbook(str(tmp_path / "npx.xlsx"), NPX_ROWS)
+    workbook = load_workbook(path, read_only=True)
+    try:
+        table = style_flag_table(workbook)
+        cells = [cell for row in workbook.active.iter_rows() for cell in row]
+        styled = [cell for cell in cells if hasattr(cell, "_style_id")]
+        assert styled
+        for cell in styled:
+            assert table[cell._style_id] == style_flags(cell.font, cell.fill)
+        assert len(set(table[cell._style_id] for cell in styled)) > 1
+    finally:
+        workbook.close()
+
+
+def test_columnar_layout(tmp_path):
+    """
+    Test the columnar record and its conversion back to the legacy layout.
+    """
+    context = RecordContext(trial="123", assay="456", record="foo")
+    path = write_workbook(str(tmp_path / "npx.xlsx"), NPX_ROWS)
+    with patch("framework.tasks.process_npx.check_symbols_valid", return_value=None):
+        with open(path, "rb") as source:
+            legacy = process_olink_npx(source, context)
+        with patch("framework.tasks.process_npx.NPX_RESULT_LAYOUT", "columnar"):
+            with open(path, "rb") as source:
+                record = process_olink_npx(source, context)
+    assert record["result_layout"] == "columnar"
+    assert record["result_sample_ids"] == ["S1", "S2"]
+    assert record["ol_assay"][1]["results"] == {
+        "value": [2.5, None],
+        "qc_fail": [True, True],
+        "below_lod": [True, False],
+    }
+    assert columnar_to_legacy(record) == legacy
+    assert columnar_to_legacy(legacy) is legacy
@@ -0,0 +1,89 @@
+"""
+Tests for the npx_long_engine module.
+"""
+from io import BytesIO
+from unittest.mock import patch
+
+import numpy as np
+import pytest
+
+from framework.tasks.data_classes import RecordContext
+from framework.tasks.npx_long_engine import read_npx_long, sniff_delimiter
+from framework.tasks.process_npx import process_olink_npx
+from framework.tasks.processing_tasks import PROC
+from tests.benchmarks.generators import write_npx_long
+
+LONG_NPX = (
+    "SampleID;OlinkID;UniProt;Assay;MissingFreq;Panel;PlateID;QC_Warning;LOD;NPX\n"
+    "S1;OID00001;P10145;IL8;0;Olink INFLAMMATION;PLATE1;Pass;0,5;1,5\n"
+    "S1;OID00002;P15692;VEGFA;0,5;Olink INFLAMMATION;PLATE1;Pass;0,25;0,1\n"
+    "S2;OID00001;P10145;IL8;0;Olink INFLAMMATION;PLATE1;Warning;0,5;3,5\n"
+    "S2;OID00002;P15692;VEGFA;0,5;Olink INFLAMMATION;PLATE1;Warning;0,25;NA\n"
+)
+
+
+def test_sniff_delimiter():
+    """
+    Test that the delimiter is picked from the header line.
+    """
+    assert sniff_delimiter("SampleID;OlinkID;NPX\n") == ";"
+    assert sniff_delimiter("SampleID,OlinkID,NPX\n") == ","
+    assert sniff_delimiter("SampleID\tOlinkID\tNPX\n") == "\t"
+
+
+def test_read_npx_long():
+    """
+    Test that rows are grouped into assays and samples.
+    """
+    sheet, duplicates = read_npx_long(BytesIO(LONG_NPX.encode("utf-8")))
+    assert duplicates == 0
+    assert sheet.result_sample_ids == ["S1", "S2"]
+    assert [assay["assay"] for assay in sheet.assays] == ["IL8", "VEGFA"]
+    assert sheet.assays[1]["lod"] == 0.25
+    assert sheet.assays[1]["missing_data_freq"] == 0.5
+    il8, vegfa = [assay["results"] for assay in sheet.assays]
+    assert il8["value"].tolist() == [1.5, 3.5]
+    assert il8["qc_fail"].tolist() == [False, True]
+    assert vegfa["below_lod"].tolist() == [True, False]
+    assert np.isnan(vegfa["value"][1])
+    assert sheet.samples == [
+        {"sample_id": "S1", "qc_status": "Pass", "plate_id": "PLATE1"},
+        {"sample_id": "S2", "qc_status": "Warning", "plate_id": "PLATE1"},
+    ]
+
+    with pytest.raises(ValueError):
+        read_npx_long(BytesIO(b"SampleID,NPX\nS1,1\n"))
+
+
+def test_process_olink_npx_long(tmp_path):
+    """
+    Test that long format files produce the same kind of record as workbooks.
+    """
+    context = RecordContext(trial="123", assay="456", record="foo")
+    with patch("framework.tasks.process_npx.check_symbols_valid", return_value=None):
+        record = process_olink_npx(BytesIO(LONG_NPX.encode("utf-8")), context)
+        assert record["validation_errors"] == []
+        assert record["ol_panel_type"] == "Olink INFLAMMATION"
+        assert record["ol_assay"][0]["results"][1] == {
+            "sample_id": "S2",
+            "value": 3.5,
+            "qc_fail": True,
+            "below_lod": False,
+        }
+
+        path = write_npx_long(str(tmp_path / "npx.tsv"), 3, 4, delimiter="\t")
+        record = process_olink_npx(path, context)
+        assert len(record["ol_assay"]) == 4
+        assert [len(assay["results"]) for assay in record["ol_assay"]] == [3] * 4
+
+        record = process_olink_npx(BytesIO(b"not,an,export\n"), context)
+        assert record["validation_errors"][0]["severity"] == "CRITICAL"
+
+
+def test_long_format_processor():
+    """
+    Test that long format files are routed to their own processor and the olink endpoint.
+    """
+    assert PROC.match("trial_olink_NPX.csv").name == "olink_long"
+    assert PROC.match("trial_olink_NPX.csv").endpoint == "olink"
+    assert PROC.match("trial_olink_NPX.xlsx").name == "olink"
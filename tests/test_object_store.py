@@ -0,0 +1,265 @@
+"""
+Tests for the object_store module.
+"""
+from io import BytesIO
+from typing import Tuple
+from unittest.mock import MagicMock, patch
+
+import pytest
+from google.api_core.exceptions import PreconditionFailed, ServiceUnavailable
+
+from framework.tasks.object_store import (
+    COMPOSED_THROUGH,
+    GCS_STORE,
+    LOCAL_STORE,
+    GCSStore,
+    get_store,
+    parse_gs_uri,
+)
+from tests.helper_functions import MemoryBlob, MemoryBucket, MemoryClient
+
+
+def test_parse_gs_uri():
+    """
+    Test parse_gs_uri
+    """
+    assert parse_gs_uri("gs://bucket/a/b/combined.maf") == ("bucket", "a/b/combined.maf")
+
+
+def test_get_store():
+    """
+    Test get_store
+    """
+    assert get_store("gs://bucket/foo") is GCS_STORE
+    assert get_store("file:///tmp/foo") is LOCAL_STORE
+    assert get_store("foo/bar") is LOCAL_STORE
+
+
+def test_local_store_append(tmp_path):
+    """
+    Test that the local backend uploads and appends in order.
+    """
+    source = tmp_path / "source"
+    source.write_bytes(b"header\n")
+    fragments = []
+    for i in range(3):
+        fragment = tmp_path / ("fragment%s" % i)
+        fragment.write_text("row%s\n" % i)
+        fragments.append(str(fragment))
+
+    target = "file://%s" % (tmp_path / "out" / "combined.maf")
+    LOCAL_STORE.upload(str(source), target)
+    LOCAL_STORE.append(target, fragments)
+    assert (tmp_path / "out" / "combined.maf").read_bytes() == b"header\nrow0\nrow1\nrow2\n"
+
+    with pytest.raises(FileNotFoundError):
+        LOCAL_STORE.append(str(tmp_path / "missing"), fragments)
+
+
+def test_local_store_queue(tmp_path):
+    """
+    Test queueing files with metadata and draining them with concat.
+    """
+    queue = str(tmp_path / "combined.maf.queue")
+    assert LOCAL_STORE.list_pending(queue) == []
+    for i in range(2):
+        fragment = BytesIO(("row%s\n" % i).encode())
+        LOCAL_STORE.push_pending(queue, fragment, {"sample_ids": ["S%s" % i]})
+
+    pending = LOCAL_STORE.list_pending(queue)
+    assert [metadata for _, metadata in pending] == [
+        {"sample_ids": ["S0"]},
+        {"sample_ids": ["S1"]},
+    ]
+
+    target = tmp_path / "combined.maf"
+    target.write_text("header\n")
+    LOCAL_STORE.concat(str(target), [uri for uri, _ in pending])
+    assert target.read_text() == "header\nrow0\nrow1\n"
+    assert LOCAL_STORE.list_pending(queue) == []
+
+
+def test_local_store_lease(tmp_path):
+    """
+    Test that a lease is exclusive until released or expired.
+    """
+    lease_uri = str(tmp_path / "combined.maf.lease")
+    lease = LOCAL_STORE.acquire_lease(lease_uri, 60)
+    assert lease
+    assert not LOCAL_STORE.acquire_lease(lease_uri, 60)
+    LOCAL_STORE.release_lease(lease_uri, lease)
+    expired = LOCAL_STORE.acquire_lease(lease_uri, -1)
+    assert expired
+    # An expired lease is broken by the next caller, and its holder can't release the
+    # new one.
+    lease = LOCAL_STORE.acquire_lease(lease_uri, 60)
+    assert lease
+    LOCAL_STORE.release_lease(lease_uri, expired)
+    assert not LOCAL_STORE.acquire_lease(lease_uri, 60)
+    LOCAL_STORE.release_lease(lease_uri, lease)
+    assert LOCAL_STORE.acquire_lease(lease_uri, 60)
+
+
+def test_local_store_fingerprint(tmp_path):
+    """
+    Test that the fingerprint follows the file's content.
+    """
+    first = tmp_path / "first.xlsx"
+    first.write_bytes(b"content")
+    second = tmp_path / "second.xlsx"
+    second.write_bytes(b"content")
+    assert LOCAL_STORE.fingerprint(str(first)) == LOCAL_STORE.fingerprint(str(second))
+    assert LOCAL_STORE.fingerprint(str(first)).startswith("md5:")
+    second.write_bytes(b"changed")
+    assert LOCAL_STORE.fingerprint(str(first)) != LOCAL_STORE.fingerprint(str(second))
+    assert LOCAL_STORE.fingerprint(str(tmp_path / "missing")) is None
+
+
+def test_gcs_store_open_for_read():
+    """
+    Test that small objects are read into memory and large ones spooled to a temp file.
+    """
+    blob = MagicMock()
+    blob.size = 4
+    blob.download_as_string.return_value = b"data"
+    blob.download_to_file.side_effect = lambda handle: handle.write(b"data")
+    client = MagicMock()
+    client.bucket.return_value.get_blob.return_value = blob
+    store = GCSStore(client)
+
+    with store.open_for_read("gs://bucket/file", 4) as source:
+        assert isinstance(source, BytesIO)
+        assert source.read() == b"data"
+    with store.open_for_read("gs://bucket/file", 3) as source:
+        assert not isinstance(source, BytesIO)
+        assert source.read() == b"data"
+
+    client.bucket.return_value.get_blob.return_value = None
+    with pytest.raises(FileNotFoundError):
+        store.open_for_read("gs://bucket/missing", 4)
+
+
+def gcs_store_with_fragments(count: int) -> Tuple[GCSStore, MemoryBucket, list]:
+    """
+    Builds a store over an in-memory bucket holding a target and count fragments.
+    """
+    client = MemoryClient()
+    bucket = client.bucket("bucket")
+    bucket.blob("combined").upload_from_string("head\n")
+    uris = []
+    for i in range(count):
+        bucket.blob("pending/%04d" % i).upload_from_string("%s\n" % i)
+        uris.append("gs://bucket/pending/%04d" % i)
+    return GCSStore(client), bucket, uris
+
+
+def expected_rows(count: int) -> bytes:
+    return ("head\n" + "".join("%s\n" % i for i in range(count))).encode()
+
+
+def test_gcs_store_concat():
+    """
+    Test that fragments are composed 31 at a time and deleted once composed.
+    """
+    store, bucket, uris = gcs_store_with_fragments(70)
+    store.concat("gs://bucket/combined", uris)
+    assert bucket.composes == 3
+    assert list(bucket.objects) == ["combined"]
+    combined = bucket.get_blob("combined")
+    assert combined.download_as_string() == expected_rows(70)
+    assert combined.component_count == 71
+    assert combined.metadata == {COMPOSED_THROUGH: uris[-1]}
+
+
+def test_gcs_store_concat_resumes():
+    """
+    Test that a compose whose response was lost isn't repeated by the retry.
+    """
+    store, bucket, uris = gcs_store_with_fragments(70)
+    bucket.lose_compose = 2
+    with pytest.raises(ServiceUnavailable):
+        store.concat("gs://bucket/combined", uris)
+    # The first batch was deleted, the second composed but not deleted.
+    assert len(bucket.objects) == 1 + 70 - 31
+
+    remaining = [uri for uri in uris if parse_gs_uri(uri)[1] in bucket.objects]
+    assert remaining == uris[31:]
+    store.concat("gs://bucket/combined", remaining)
+    assert list(bucket.objects) == ["combined"]
+    assert bucket.get_blob("combined").download_as_string() == expected_rows(70)
+
+
+def test_gcs_store_concat_compacts():
+    """
+    Test that the target is rewritten as one component before reaching the limit.
+    """
+    store, bucket, uris = gcs_store_with_fragments(70)
+    with patch("framework.tasks.object_store.MAX_COMPONENT_COUNT", 40):
+        store.concat("gs://bucket/combined", uris)
+    combined = bucket.get_blob("combined")
+    assert combined.download_as_string() == expected_rows(70)
+    assert combined.component_count == 40
+    assert combined.content_type == "text/plain"
+
+
+def test_gcs_store_concat_conflict():
+    """
+    Test that a target changed by someone else isn't composed onto.
+    """
+    store, bucket, uris = gcs_store_with_fragments(3)
+    target = bucket.blob("combined")
+
+    def reload_then_overwrite():
+        MemoryBlob.reload(target)
+        bucket.blob("combined").upload_from_string("other\n")
+
+    target.reload = reload_then_overwrite
+    store.blob = lambda gs_uri: target if gs_uri.endswith("combined") else (
+        GCSStore.blob(store, gs_uri)
+    )
+    with pytest.raises(PreconditionFailed):
+        store.concat("gs://bucket/combined", uris)
+    assert bucket.get_blob("combined").download_as_string() == b"other\n"
+    assert len(bucket.objects) == 4
+
+
+def test_gcs_store_lease():
+    """
+    Test that a lease object is exclusive until released or expired.
+    """
+    store = GCSStore(MemoryClient())
+    lease_uri = "gs://bucket/combined.maf.lease"
+    lease = store.acquire_lease(lease_uri, 60)
+    assert lease
+    assert not store.acquire_lease(lease_uri, 60)
+    store.release_lease(lease_uri, lease)
+    expired = store.acquire_lease(lease_uri, -1)
+    assert expired
+    lease = store.acquire_lease(lease_uri, 60)
+    assert lease and lease != expired
+    store.release_lease(lease_uri, expired)
+    assert not store.acquire_lease(lease_uri, 60)
+    store.release_lease(lease_uri, lease)
+    assert store.acquire_lease(lease_uri, 60)
+
+
+def test_gcs_store_queue():
+    """
+    Test that queued objects are listed in arrival order with their metadata.
+    """
+    client = MemoryClient()
+    store = GCSStore(client)
+    queue = "gs://bucket/combined.maf.queue"
+    for i in range(3):
+        fragment = BytesIO(("row%s\n" % i).encode())
+        store.push_pending(queue, fragment, {"n": i, "ids": ["S%s" % i]})
+    pending = store.list_pending(queue)
+    assert [metadata for _, metadata in pending] == [
+        {"n": i, "ids": ["S%s" % i]} for i in range(3)
+    ]
+
+    client.bucket("bucket").blob("combined.maf").upload_from_string("header\n")
+    store.concat("gs://bucket/combined.maf", [uri for uri, _ in pending])
+    with store.open_for_read("gs://bucket/combined.maf", 100) as combined:
+        assert combined.read() == b"header\nrow0\nrow1\nrow2\n"
+    assert store.list_pending(queue) == []
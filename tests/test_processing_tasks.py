@@ -1,8 +1,35 @@
 """
 Tests for the processing_tasks module.
 """
-from framework.tasks.processing_tasks import add_record_context
+from io import BytesIO
+from types import GeneratorType
+from unittest.mock import patch
+
+import pytest
+from celery.exceptions import Retry
+
+from tests.helper_functions import FakeFetcher, PagedFetcher
+from framework.tasks.cpu_pool import CpuPool
+from framework.tasks.object_store import LOCAL_STORE
+from framework.tasks.processing_tasks import (
+    add_record_context,
+    combine_mafs,
+    combined_maf_uri,
+    merge_maf_queue,
+    merge_pending_mafs,
+    paginate,
+    patch_children,
+    postprocessing,
+    process_file,
+    process_table,
+)
+from framework.tasks.processor_registry import ProcessorRegistry
+from framework.tasks.result_cache import DiskResultCache
 from framework.tasks.data_classes import RecordContext
+from framework.tasks.variables import MAF_MERGE_DELAY
+
+TABLE = '#comment\nGene\t"Sample.1"\nA1BG\t"1.5"\nTP53\t2\nEGFR\t3\n'
+
 
 def test_add_record_context():
     """
@@ -16,3 +43,422 @@ def test_add_record_context():
         "assay": "456",
         "record_id": "foo"
     }
+
+
+def test_process_table(tmp_path):
+    """
+    Test process_table in list and streaming mode.
+    """
+    path = tmp_path / "table.tsv"
+    path.write_text(TABLE)
+    context = RecordContext(trial="123", assay="456", record="foo")
+    entries = process_table(str(path), context, engine="python")
+    assert len(entries) == 3
+    assert entries[0] == {
+        "Gene": "A1BG",
+        "Sample1": "1.5",
+        "trial": "123",
+        "assay": "456",
+        "record_id": "foo",
+    }
+    streamed = process_table(str(path), context, stream=True, engine="python")
+    assert isinstance(streamed, GeneratorType)
+    assert list(streamed) == entries
+
+
+def test_process_table_typed(tmp_path):
+    """
+    Test the typed engine behind process_table.
+    """
+    path = tmp_path / "table.tsv"
+    path.write_text(TABLE)
+    context = RecordContext(trial="123", assay="456", record="foo")
+    entries = process_table(str(path), context, engine="typed")
+    assert [entry["Sample1"] for entry in entries] == [1.5, 2.0, 3.0]
+    assert entries[0]["Gene"] == "A1BG"
+    assert entries[0]["record_id"] == "foo"
+
+
+def test_process_table_file_object():
+    """
+    Test that both engines read from an open binary file.
+    """
+    context = RecordContext(trial="123", assay="456", record="foo")
+    for engine in ("python", "typed"):
+        source = BytesIO(TABLE.encode())
+        entries = process_table(source, context, engine=engine)
+        assert len(entries) == 3
+        assert entries[0]["Gene"] == "A1BG"
+        assert not source.closed
+
+
+def test_process_file_streams_source(tmp_path):
+    """
+    Test that process_file hands processors an open file instead of a downloaded copy.
+    """
+    path = tmp_path / "data.txt"
+    path.write_bytes(b"payload")
+    received = []
+    record = {
+        "gs_uri": str(path),
+        "trial": {"$oid": "123"},
+        "assay": {"$oid": "456"},
+        "_id": {"$oid": "789"},
+    }
+    registry = ProcessorRegistry()
+    registry.register(
+        "fake",
+        [r"\.txt$"],
+        lambda source, context: received.append(source.read()),
+        mongo=False,
+    )
+    with patch("framework.tasks.processing_tasks.PROC", registry):
+        assert process_file(record, "fake")
+    assert received == [b"payload"]
+    assert sorted(p.name for p in tmp_path.iterdir()) == ["data.txt"]
+
+    record["gs_uri"] = str(tmp_path / "missing.txt")
+    with patch("framework.tasks.processing_tasks.PROC", registry):
+        assert not process_file(record, "fake")
+
+
+def test_process_file_reuses_cached_result(tmp_path):
+    """
+    Test that a file with already processed content in the same trial and assay is linked
+    instead of parsed again, as long as the records it produced still exist.
+    """
+    parsed = []
+    registry = ProcessorRegistry()
+    registry.register(
+        "fake",
+        [r"\.xlsx$"],
+        lambda source, context: parsed.append(context.record)
+        or [{"trial": context.trial, "assay": context.assay}],
+    )
+    records = []
+    for i, trial in enumerate(["123", "123", "789", "123"]):
+        path = tmp_path / ("upload%s.xlsx" % i)
+        path.write_bytes(b"same bytes")
+        records.append(
+            {
+                "gs_uri": str(path),
+                "trial": {"$oid": trial},
+                "assay": {"$oid": "456"},
+                "_id": {"$oid": "rec%s" % i},
+            }
+        )
+    children = PagedFetcher([{"_id": "child1"}, {"_id": "child2"}], 10)
+
+    with patch("framework.tasks.processing_tasks.PROC", registry), patch(
+        "framework.tasks.processing_tasks.CPU_POOL", CpuPool(0, 1, 1, [])
+    ), patch(
+        "framework.tasks.processing_tasks.RESULT_CACHE",
+        DiskResultCache(str(tmp_path / "cache"), 1024),
+    ), patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.post",
+        side_effect=[
+            FakeFetcher({"_items": [{"_id": "child1"}]}),
+            FakeFetcher({"_items": [{"_id": "child2"}]}),
+            FakeFetcher({"_items": [{"_id": "child3"}]}),
+        ],
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get", side_effect=children.get
+    ), patch(
+        "framework.tasks.processing_tasks.CHILD_LINKS.add"
+    ) as link:
+        assert process_file(records[0], "fake")
+        assert process_file(records[1], "fake")
+        # Another trial gets records of its own.
+        assert process_file(records[2], "fake")
+        # Once the cached records are deleted, the file is parsed again.
+        children.items = []
+        assert process_file(records[3], "fake")
+
+    assert parsed == ["rec0", "rec2", "rec3"]
+    assert [call[0] for call in link.call_args_list] == [
+        ("rec0", [{"_id": "child1", "resource": "fake"}]),
+        ("rec1", [{"_id": "child1", "resource": "fake"}]),
+        ("rec2", [{"_id": "child2", "resource": "fake"}]),
+        ("rec3", [{"_id": "child3", "resource": "fake"}]),
+    ]
+
+
+def test_process_file_uploads_streamed_pages(tmp_path):
+    """
+    Test that a streamed table is posted in pages, each linked to the parent.
+    """
+    path = tmp_path / "expression.tsv"
+    path.write_text("Gene\tv\n" + "".join("G%s\t%s\n" % (i, i) for i in range(5)))
+    record = {
+        "gs_uri": str(path),
+        "trial": {"$oid": "123"},
+        "assay": {"$oid": "456"},
+        "_id": {"$oid": "789"},
+    }
+    registry = ProcessorRegistry()
+    registry.register("table", [r"\.tsv$"], process_table, stream=True)
+    posted = []
+
+    def post(endpoint, token, code, json):
+        posted.append((endpoint, [row["Gene"] for row in json]))
+        return FakeFetcher({"_items": [{"_id": row["Gene"]} for row in json]})
+
+    with patch("framework.tasks.processing_tasks.PROC", registry), patch(
+        "framework.tasks.processing_tasks.RESULT_CACHE", None
+    ), patch("framework.tasks.processing_tasks.TABLE_PAGE_SIZE", 2), patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.post", side_effect=post
+    ), patch(
+        "framework.tasks.processing_tasks.CHILD_LINKS.add"
+    ) as link:
+        assert process_file(record, "table")
+
+    assert posted == [
+        ("table", ["G0", "G1"]),
+        ("table", ["G2", "G3"]),
+        ("table", ["G4"]),
+    ]
+    pages = [["G0", "G1"], ["G2", "G3"], ["G4"]]
+    assert [call[0] for call in link.call_args_list] == [
+        ("789", [{"_id": gene, "resource": "table"} for gene in page]) for page in pages
+    ]
+
+
+def test_postprocessing_routes_by_resource_class():
+    """
+    Test that matched files are sent to their processor's queue and others are skipped.
+    """
+    records = [
+        {"file_name": "trial_olink_NPX.xlsx"},
+        {"file_name": "sample.maf"},
+        {"file_name": "reads.fastq"},
+    ]
+    with patch("framework.tasks.processing_tasks.execute_in_parallel") as execute:
+        postprocessing(records)
+    tasks = execute.call_args[0][0]
+    assert [task.args[1] for task in tasks] == ["olink", "maf"]
+    assert [task.options["queue"] for task in tasks] == [
+        "processing_cpu",
+        "processing_io",
+    ]
+
+
+def test_paginate():
+    """
+    Test paginate
+    """
+    pages = list(paginate(({"i": i} for i in range(5)), 2))
+    assert [len(page) for page in pages] == [2, 2, 1]
+    assert not list(paginate(iter([]), 2))
+
+
+def test_combine_mafs(tmp_path):
+    """
+    Test that combine_mafs appends every data row but no headers.
+    """
+    new_maf = tmp_path / "new.maf"
+    new_maf.write_text("#version 2.4\nHugo_Symbol\tChromosome\nTP53\t17\nEGFR\t7\nKRAS\t12\n")
+    combined = tmp_path / "combined.maf"
+    combined.write_text("#version 2.4\nHugo_Symbol\tChromosome\nBRAF\t7\n")
+    combine_mafs(str(new_maf), str(combined))
+    assert combined.read_text() == (
+        "#version 2.4\nHugo_Symbol\tChromosome\nBRAF\t7\nTP53\t17\nEGFR\t7\nKRAS\t12\n"
+    )
+
+
+def queue_mafs(tmp_path, count, start=0):
+    """
+    Writes mafs into tmp_path and queues their bodies for merging.
+    """
+    queue = str(tmp_path / "combined.maf.queue")
+    for i in range(start, count):
+        maf = tmp_path / ("sample%s.maf" % i)
+        maf.write_text("#version 2.4\nHugo_Symbol\tSample\nTP53\tS%s\n" % i)
+        LOCAL_STORE.push_pending(
+            queue,
+            BytesIO(("TP53\tS%s\n" % i).encode()),
+            {"record_id": "rec%s" % i, "source_uri": str(maf), "sample_ids": ["S%s" % i]},
+        )
+    return LOCAL_STORE.list_pending(queue)
+
+
+def test_combined_maf_uri():
+    """
+    Test combined_maf_uri
+    """
+    assert combined_maf_uri("gs://bucket/trial/assay/abc") == (
+        "gs://bucket/trial/assay/combined.maf"
+    )
+
+
+def test_merge_pending_mafs_existing(tmp_path):
+    """
+    Test that queued mafs are appended to an existing combined maf with a single patch.
+    """
+    combined = tmp_path / "combined.maf"
+    combined.write_text("#version 2.4\nHugo_Symbol\tSample\nKRAS\tS9\n")
+    pending = queue_mafs(tmp_path, 3)
+    extant = {"_items": [{"_id": "c1", "_etag": "e1", "sample_ids": ["S9"]}]}
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        return_value=FakeFetcher(extant),
+    ), patch("framework.tasks.processing_tasks.EVE_FETCHER.patch") as eve_patch:
+        assert merge_pending_mafs("t", "a", str(combined), pending, "token")
+
+    assert combined.read_text().endswith("KRAS\tS9\nTP53\tS0\nTP53\tS1\nTP53\tS2\n")
+    eve_patch.assert_called_once()
+    assert eve_patch.call_args[1]["json"]["sample_ids"] == ["S9", "S0", "S1", "S2"]
+
+
+def test_merge_pending_mafs_new(tmp_path):
+    """
+    Test that the first queued maf, with its headers, starts a new combined maf.
+    """
+    combined = tmp_path / "combined.maf"
+    pending = queue_mafs(tmp_path, 2)
+    first_maf = {"_id": "rec0", "file_name": "sample0.maf", "gs_uri": str(combined)}
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        side_effect=[FakeFetcher({"_items": []}), FakeFetcher({"_items": [first_maf]})],
+    ), patch("framework.tasks.processing_tasks.EVE_FETCHER.post") as eve_post:
+        assert merge_pending_mafs("t", "a", str(combined), pending, "token")
+
+    assert combined.read_text() == (
+        "#version 2.4\nHugo_Symbol\tSample\nTP53\tS0\nTP53\tS1\n"
+    )
+    new_record = eve_post.call_args[1]["json"]
+    assert new_record["file_name"] == "combined.maf"
+    assert new_record["sample_ids"] == ["S0", "S1"]
+    assert "_id" not in new_record
+
+
+def test_merge_pending_mafs_keeps_samples_of_failed_patch(tmp_path):
+    """
+    Test that samples appended by a cycle whose patch failed are added by the next one,
+    without appending their rows again.
+    """
+    combined = tmp_path / "combined.maf"
+    combined.write_text("#version 2.4\nHugo_Symbol\tSample\n")
+    pending = queue_mafs(tmp_path, 2)
+    queue = str(combined) + ".queue"
+    extant = {"_items": [{"_id": "c1", "_etag": "e1", "sample_ids": []}]}
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        return_value=FakeFetcher(extant),
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.patch",
+        side_effect=RuntimeError("Status code 500"),
+    ):
+        assert not merge_pending_mafs("t", "a", str(combined), pending, "token")
+
+    carried = LOCAL_STORE.list_pending(queue)
+    assert [metadata["sample_ids"] for _, metadata in carried] == [["S0", "S1"]]
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        return_value=FakeFetcher(extant),
+    ), patch("framework.tasks.processing_tasks.EVE_FETCHER.patch") as eve_patch:
+        assert merge_pending_mafs("t", "a", str(combined), carried, "token")
+
+    assert combined.read_text().endswith("Sample\nTP53\tS0\nTP53\tS1\n")
+    assert eve_patch.call_args[1]["json"]["sample_ids"] == ["S0", "S1"]
+    assert LOCAL_STORE.list_pending(queue) == []
+
+
+def test_merge_pending_mafs_keeps_unrecorded_combined_maf(tmp_path):
+    """
+    Test that a combined maf whose record wasn't created is appended to, not replaced.
+    """
+    combined = tmp_path / "combined.maf"
+    pending = queue_mafs(tmp_path, 2)
+    first_maf = {"_id": "rec0", "file_name": "sample0.maf", "gs_uri": str(combined)}
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        side_effect=[FakeFetcher({"_items": []}), FakeFetcher({"_items": [first_maf]})],
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.post",
+        side_effect=RuntimeError("Status code 500"),
+    ):
+        assert not merge_pending_mafs("t", "a", str(combined), pending, "token")
+
+    pending = queue_mafs(tmp_path, 3, start=2)
+    with patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        side_effect=[FakeFetcher({"_items": []}), FakeFetcher({"_items": [first_maf]})],
+    ), patch("framework.tasks.processing_tasks.EVE_FETCHER.post") as eve_post:
+        assert merge_pending_mafs("t", "a", str(combined), pending, "token")
+
+    assert combined.read_text() == (
+        "#version 2.4\nHugo_Symbol\tSample\nTP53\tS0\nTP53\tS1\nTP53\tS2\n"
+    )
+    assert eve_post.call_args[1]["json"]["sample_ids"] == ["S0", "S1", "S2"]
+
+
+def test_merge_maf_queue_retries(tmp_path):
+    """
+    Test that a failed merge releases the lease and retries the task.
+    """
+    combined = str(tmp_path / "combined.maf")
+    queue_mafs(tmp_path, 1)
+    with patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.processing_tasks.merge_pending_mafs",
+        side_effect=RuntimeError("Status code 503"),
+    ), patch.object(
+        merge_maf_queue, "retry", side_effect=Retry()
+    ) as retry:
+        with pytest.raises(Retry):
+            merge_maf_queue("t", "a", combined)
+
+    assert retry.call_args[1]["countdown"] == MAF_MERGE_DELAY
+    assert LOCAL_STORE.acquire_lease(combined + ".lease", 60)
+    assert len(LOCAL_STORE.list_pending(combined + ".queue")) == 1
+
+
+def test_patch_children_merges_on_conflict():
+    """
+    Test that an etag conflict refetches the parent and merges the new children in.
+    """
+    first = {"_items": [{"_id": "p1", "_etag": "e1", "children": []}]}
+    second = {
+        "_items": [
+            {"_id": "p1", "_etag": "e2", "children": [{"_id": "a", "resource": "olink"}]}
+        ]
+    }
+    new_children = [{"_id": "a", "resource": "olink"}, {"_id": "b", "resource": "olink"}]
+    with patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        side_effect=[FakeFetcher(first), FakeFetcher(second)],
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.patch",
+        side_effect=[RuntimeError("Status code 412"), None],
+    ) as eve_patch:
+        assert patch_children("p1", new_children)
+
+    assert eve_patch.call_count == 2
+    assert eve_patch.call_args[1]["_etag"] == "e2"
+    assert eve_patch.call_args[1]["json"]["children"] == new_children
+
+
+def test_patch_children_missing_parent():
+    """
+    Test that a parent that doesn't exist is a failed update.
+    """
+    with patch(
+        "framework.tasks.authorized_task.get_token",
+        return_value={"access_token": "t", "expires_in": 3600, "time_fetched": 0},
+    ), patch(
+        "framework.tasks.processing_tasks.EVE_FETCHER.get",
+        return_value=FakeFetcher({"_items": []}),
+    ), patch("framework.tasks.processing_tasks.EVE_FETCHER.patch") as eve_patch:
+        assert not patch_children("p1", [{"_id": "a", "resource": "olink"}])
+    eve_patch.assert_not_called()
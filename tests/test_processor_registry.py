@@ -0,0 +1,41 @@
+"""
+Tests for the processor_registry module.
+"""
+import pytest
+
+from framework.tasks.processor_registry import ProcessorRegistry
+
+
+def test_match():
+    """
+    Test matching file names against the registry.
+    """
+    registry = ProcessorRegistry()
+    assert registry.match("anything.maf") is None
+    registry.register("olink", [r"olink.*npx"], print)
+    registry.register("olink_meta", [r"olink.*biorepository"], print)
+    registry.register("table", [r"\.tsv$", r"\.txt$"], print, resource_class="io")
+
+    assert registry.match("Trial_OLINK_npx.xlsx").name == "olink"
+    assert registry.match("olink_biorepository.xlsx").name == "olink_meta"
+    assert registry.match("counts.TXT").name == "table"
+    assert registry.match("reads.fastq") is None
+    # The first registered processor wins, wherever its pattern matches.
+    assert registry.match("olink_biorepository_npx.xlsx").name == "olink"
+    assert list(registry) == ["olink", "olink_meta", "table"]
+
+
+def test_register():
+    """
+    Test the defaults and validation of register.
+    """
+    registry = ProcessorRegistry()
+    processor = registry.register("maf", [r"\.maf$"], print, mongo=False, resource_class="io")
+    assert processor.endpoint == "maf"
+    assert processor.queue == "processing_io"
+    assert registry["maf"] is processor
+    assert "maf" in registry
+    with pytest.raises(ValueError):
+        registry.register("maf", [r"\.maf$"], print)
+    with pytest.raises(ValueError):
+        registry.register("other", [r"\.x$"], print, resource_class="gpu")
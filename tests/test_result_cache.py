@@ -0,0 +1,40 @@
+"""
+Tests for the result_cache module.
+"""
+import os
+
+from framework.tasks.result_cache import DiskResultCache
+
+
+def test_put_get(tmp_path):
+    """
+    Test storing and reading back entries.
+    """
+    cache = DiskResultCache(str(tmp_path / "cache"), 1024)
+    key = cache.key("olink", "1", "md5:abc", "trial", "assay")
+    assert key != cache.key("olink", "2", "md5:abc", "trial", "assay")
+    assert key != cache.key("olink", "1", "md5:abc", "other", "assay")
+    assert cache.get(key) is None
+    cache.put(key, {"children": [{"_id": "a", "resource": "olink"}]})
+    assert cache.get(key) == {"children": [{"_id": "a", "resource": "olink"}]}
+
+    with open(cache.entry_path(key), "w") as entry:
+        entry.write("{not json")
+    assert cache.get(key) is None
+    assert not os.path.exists(cache.entry_path(key))
+
+
+def test_evict_least_recently_used(tmp_path):
+    """
+    Test that the least recently used entries are evicted first.
+    """
+    cache = DiskResultCache(str(tmp_path), 10 ** 6)
+    for i, key in enumerate(["old", "used", "new"]):
+        cache.put(key, {"children": ["x" * 20]})
+        os.utime(cache.entry_path(key), (i, i))
+    cache.get("used")
+
+    cache.max_bytes = 2 * os.path.getsize(cache.entry_path("new"))
+    assert cache.evict() == 1
+    assert cache.get("old") is None
+    assert cache.get("used") and cache.get("new")
@@ -0,0 +1,78 @@
+"""
+Tests for the symbol_index module.
+"""
+import json
+import os
+
+from framework.tasks.symbol_index import (
+    CURRENT_FILE,
+    SymbolIndex,
+    SymbolIndexLoader,
+    load_snapshot,
+    read_current,
+    save_snapshot,
+)
+
+
+def test_missing():
+    """
+    Test lookups, including symbols wider than any in the index.
+    """
+    index = SymbolIndex.build(["TP53", "A1BG", "EGFR", "TP53", "ÄB"])
+    assert len(index) == 4
+    assert index.missing(["EGFR", "ZZZ", "A1BGX", "ÄB", "", "A"]) == [
+        "ZZZ",
+        "A1BGX",
+        "",
+        "A",
+    ]
+    assert index.missing([]) == []
+    assert SymbolIndex.build([]).missing(["TP53"]) == ["TP53"]
+
+
+def test_save_and_reload(tmp_path):
+    """
+    Test that workers switch to a newly published version and old versions are removed.
+    """
+    directory = str(tmp_path)
+    loader = SymbolIndexLoader(directory)
+    assert loader.current() is None
+
+    first = SymbolIndex.build(["TP53"]).save(directory)
+    assert read_current(directory) == first
+    index = loader.current()
+    assert index.version == first and index.missing(["TP53", "EGFR"]) == ["EGFR"]
+    assert loader.current() is index
+
+    for _ in range(3):
+        latest = SymbolIndex.build(["TP53", "EGFR"]).save(directory)
+    assert loader.current().version == latest
+    assert loader.current().missing(["TP53", "EGFR"]) == []
+    assert len([name for name in os.listdir(directory) if name.endswith(".npy")]) == 2
+
+    # A pointer to a broken file keeps the last good index.
+    with open(os.path.join(directory, CURRENT_FILE), "w") as pointer:
+        pointer.write("symbols-missing.npy")
+    assert loader.current().version == latest
+
+
+def test_snapshot(tmp_path):
+    """
+    Test that snapshots round trip, and corrupt ones are ignored.
+    """
+    path = str(tmp_path / "published.json")
+    assert load_snapshot(path) is None
+    save_snapshot(path, ["B", "A", "B"])
+    assert load_snapshot(path) == {"A", "B"}
+
+    with open(path) as snapshot:
+        contents = json.load(snapshot)
+    assert contents["symbols"] == ["A", "B"]
+    contents["symbols"].append("C")
+    with open(path, "w") as snapshot:
+        json.dump(contents, snapshot)
+    assert load_snapshot(path) is None
+
+    with open(path, "w") as snapshot:
+        snapshot.write('{"symbols": ["A"')
+    assert load_snapshot(path) is None
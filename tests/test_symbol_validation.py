@@ -0,0 +1,98 @@
+"""
+Tests for the symbol_validation module.
+"""
+import threading
+import time
+
+import pytest
+
+from framework.tasks.symbol_validation import SymbolBatcher, SymbolCache
+
+VALID = {"TP53", "EGFR", "A1BG", "KRAS"}
+
+
+def recording_lookup(calls: list, delay: float = 0):
+    """
+    Builds a lookup that records the symbols it is called with.
+    """
+
+    def lookup(symbols):
+        calls.append(symbols)
+        time.sleep(delay)
+        return [symbol for symbol in symbols if symbol in VALID]
+
+    return lookup
+
+
+def test_concurrent_calls_share_a_lookup():
+    """
+    Test that validations within the window are answered by one deduplicated lookup.
+    """
+    calls = []
+    batcher = SymbolBatcher(recording_lookup(calls), 0.2, 60, 100)
+    requests = [["TP53", "EGFR", "BAD%s" % (i % 3)] for i in range(20)]
+    results = [None] * len(requests)
+
+    def validate(position):
+        results[position] = batcher.missing(requests[position])
+
+    threads = [threading.Thread(target=validate, args=(i,)) for i in range(20)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert calls == [["BAD0", "BAD1", "BAD2", "EGFR", "TP53"]]
+    assert results == [["BAD%s" % (i % 3)] for i in range(20)]
+
+
+def test_cache():
+    """
+    Test that cached answers are reused until they expire.
+    """
+    calls = []
+    batcher = SymbolBatcher(recording_lookup(calls), 0, 0.2, 100)
+    assert batcher.missing(["TP53", "BAD", "TP53"]) == ["BAD"]
+    assert batcher.missing(["BAD", "TP53"]) == ["BAD"]
+    assert batcher.missing(["KRAS", "TP53"]) == []
+    assert calls == [["BAD", "TP53"], ["KRAS"]]
+    time.sleep(0.25)
+    assert batcher.missing(["TP53"]) == []
+    assert calls[-1] == ["TP53"]
+
+    cache = SymbolCache(60, 2)
+    cache.put({"A": True, "B": False})
+    cache.put({"C": True})
+    assert cache.get("A") is None
+    assert cache.get("B") is False and cache.get("C") is True
+
+
+def test_lookup_error():
+    """
+    Test that a failed lookup reaches every caller of the batch and isn't cached.
+    """
+    calls = []
+
+    def lookup(symbols):
+        calls.append(symbols)
+        raise RuntimeError("503")
+
+    batcher = SymbolBatcher(lookup, 0.1, 60, 100)
+    errors = []
+
+    def validate():
+        try:
+            batcher.missing(["TP53"])
+        except RuntimeError as err:
+            errors.append(err)
+
+    threads = [threading.Thread(target=validate) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(errors) == 5 and len(calls) == 1
+
+    with pytest.raises(RuntimeError):
+        batcher.missing(["TP53"])
+    assert len(calls) == 2
@@ -0,0 +1,94 @@
+"""
+Tests for the table_engine module.
+"""
+import pandas as pd
+import pytest
+
+from framework.tasks.table_engine import column_type, iter_typed_records, widen
+
+
+def test_column_type():
+    """
+    Test column_type
+    """
+    assert column_type(pd.Series([1, -2])) == "int"
+    assert column_type(pd.Series([1, 2.5, None])) == "float"
+    assert column_type(pd.Series([True, None])) == "bool"
+    assert column_type(pd.Series(["1", "x"])) == "str"
+
+
+def test_widen():
+    """
+    Test widen
+    """
+    assert widen("int", "int") == "int"
+    assert widen("int", "float") == "float"
+    assert widen("float", "str") == "str"
+    assert widen("bool", "int") == "str"
+
+
+def test_iter_typed_records(tmp_path):
+    """
+    Test iter_typed_records, including a column that has to be widened in a later block.
+    """
+    path = tmp_path / "table.tsv"
+    path.write_text(
+        "#c\nid\tcount\tflag\tname\n1\t2\tTRUE\t007\n2\t3\tfalse\tb \n3\t4.5\ttrue\t10\n"
+    )
+    records = list(iter_typed_records(str(path), block_rows=2))
+    assert records == [
+        {"id": 1, "count": 2, "flag": True, "name": "007"},
+        {"id": 2, "count": 3, "flag": False, "name": "b"},
+        {"id": 3, "count": 4.5, "flag": True, "name": "10"},
+    ]
+    assert isinstance(records[0]["id"], int)
+
+
+def test_iter_typed_records_missing(tmp_path):
+    """
+    Test that empty cells become None and that empty tables yield nothing.
+    """
+    path = tmp_path / "table.tsv"
+    path.write_text("a\tb\n1.5\t\n\tx\n")
+    assert list(iter_typed_records(str(path))) == [
+        {"a": 1.5, "b": None},
+        {"a": None, "b": "x"},
+    ]
+    path.write_text("a\tb\n")
+    assert not list(iter_typed_records(str(path)))
+
+
+def test_iter_typed_records_mismatch(tmp_path):
+    """
+    Test that rows longer than the header raise IndexError, wherever they are.
+    """
+    path = tmp_path / "table.tsv"
+    for table in [
+        "a\tb\n1\t2\n1\t2\t3\n",
+        "id\tv\nA\t1\t9\n",
+        "a\tb\n1\t2\t\t4\n",
+    ]:
+        path.write_text(table)
+        with pytest.raises(IndexError):
+            list(iter_typed_records(str(path)))
+    # A trailing tab is not a value.
+    path.write_text("a\tb\n1\t2\t\n")
+    assert list(iter_typed_records(str(path))) == [{"a": 1, "b": 2}]
+
+
+def test_iter_typed_records_leading_zeros(tmp_path):
+    """
+    Test that columns with identifiers written with leading zeros are read as text, even
+    when the first identifier is in a later block.
+    """
+    path = tmp_path / "table.tsv"
+    path.write_text("id\tv\n00123\t1\n00124\t2\n125\t3\n")
+    assert list(iter_typed_records(str(path))) == [
+        {"id": "00123", "v": 1},
+        {"id": "00124", "v": 2},
+        {"id": "125", "v": 3},
+    ]
+    path.write_text("id\tv\n1\t1\n2\t2\n007\t3\n")
+    records = list(iter_typed_records(str(path), 2))
+    assert [record["id"] for record in records] == ["1", "2", "007"]
+    assert [record["v"] for record in records] == [1, 2, 3]
@@ -0,0 +1,69 @@
+"""
+Tests for the workflow_mirror module.
+"""
+import os
+import subprocess
+import threading
+
+import pytest
+
+from framework.tasks.workflow_mirror import checkout_workflow, mirror_path, run_git
+
+
+def commit_snakefile(repo: str, content: str) -> str:
+    """
+    Commits a Snakefile to the jason branch of a repository and returns the commit.
+    """
+    with open(os.path.join(repo, "Snakefile"), "w") as snakefile:
+        snakefile.write(content)
+    git = ["git", "-C", repo, "-c", "user.name=t", "-c", "user.email=t@t"]
+    subprocess.run(git + ["add", "Snakefile"], check=True)
+    subprocess.run(git + ["commit", "-q", "-m", content], check=True)
+    return run_git(["-C", repo, "rev-parse", "HEAD"])
+
+
+def test_checkout_workflow(tmpdir, monkeypatch):
+    """
+    Test that runs share one mirror and get worktrees pinned to the fetched commit.
+    """
+    origin = str(tmpdir.join("origin"))
+    subprocess.run(["git", "init", "-q", origin], check=True)
+    subprocess.run(
+        ["git", "-C", origin, "symbolic-ref", "HEAD", "refs/heads/jason"], check=True
+    )
+    first = commit_snakefile(origin, "rule a:")
+    mirrors = str(tmpdir.join("mirrors"))
+    monkeypatch.chdir(str(tmpdir))
+
+    checkouts = [None] * 4
+
+    def run(position):
+        checkouts[position] = checkout_workflow(
+            mirrors, origin, "jason", "run%s" % position, 0
+        )
+
+    threads = [threading.Thread(target=run, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert [checkout.commit for checkout in checkouts] == [first] * 4
+    mirror = mirror_path(mirrors, origin)
+    assert sorted(os.listdir(mirrors)) == [
+        os.path.basename(mirror),
+        os.path.basename(mirror) + ".lock",
+    ]
+    assert len(run_git(["worktree", "list"], git_dir=mirror).splitlines()) == 5
+    with open(checkouts[0].snakefile) as snakefile:
+        assert snakefile.read() == "rule a:"
+
+    # A new commit is fetched, unless the mirror was fetched recently.
+    second = commit_snakefile(origin, "rule b:")
+    assert checkout_workflow(mirrors, origin, "jason", "run4", 3600).commit == first
+    assert checkout_workflow(mirrors, origin, "jason", "run5", 0).commit == second
+    with open("run0/Snakefile") as snakefile:
+        assert snakefile.read() == "rule a:"
+
+    with pytest.raises(subprocess.CalledProcessError):
+        checkout_workflow(mirrors, origin, "missing", "run6", 0)
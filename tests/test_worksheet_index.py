@@ -0,0 +1,61 @@
+"""
+Tests for the worksheet_index module.
+"""
+from openpyxl import Workbook, load_workbook
+
+from framework.tasks.data_classes import RecordContext
+from framework.tasks.process_npx import MANIFEST_HEADERS, process_clinical_metadata
+from framework.tasks.worksheet_index import WorksheetIndex
+from tests.benchmarks.generators import write_clinical_metadata
+
+
+def test_worksheet_index(tmp_path):
+    """
+    Test that cells are found by their text in one pass.
+    """
+    workbook = Workbook()
+    sheet = workbook.active
+    sheet.append(["Name:", "Alice", None, "name:"])
+    sheet.append([None, 0, "Name:"])
+    path = str(tmp_path / "index.xlsx")
+    workbook.save(path)
+
+    workbook = load_workbook(path, read_only=True)
+    try:
+        index = WorksheetIndex(workbook.active)
+    finally:
+        workbook.close()
+    assert index.find("NAME:") == [(1, 1), (1, 4), (2, 3)]
+    assert index.find("name:", column=4) == [(1, 4)]
+    assert index.find("missing") == []
+    assert index.value(1, 2) == "Alice"
+    assert index.value(2, 2) == 0 and index.text(2, 2) == ""
+    assert index.value(5, 5) is None
+    assert (index.max_row, index.max_column) == (2, 4)
+    assert [
+        [cell.value for cell in row] for row in index.iter_rows(1, 1, 2)
+    ] == [["Name:", "Alice"], [None, 0]]
+
+
+def test_process_clinical_metadata(tmp_path):
+    """
+    Test the fields and samples read from a biorepository sheet, and that a missing sample
+    table is reported.
+    """
+    context = RecordContext(trial="123", assay="456", record="foo")
+    path = write_clinical_metadata(str(tmp_path / "bio.xlsx"), 40)
+    with open(path, "rb") as source:
+        record = process_clinical_metadata(source, context)
+    assert record["manifest_id"] == "%s value" % MANIFEST_HEADERS["manifest id:"]
+    assert len(record["samples"]) == 40
+    assert record["samples"][-1]["comments"] == "comments 39"
+
+    workbook = load_workbook(path)
+    workbook.active.cell(row=16, column=1).value = "Unknown"
+    workbook.save(path)
+    with open(path, "rb") as source:
+        record = process_clinical_metadata(source, context)
+    assert record["samples"] == []
+    assert record["validation_errors"][-1]["explanation"] == (
+        "Could not find the sample description headers"
+    )